@@ -0,0 +1,139 @@
+import asyncio
+
+from app.config import config
+from .crud import UserCRUD, OrderCRUD, ChatHistoryCRUD, message_timestamp
+from .executor import run_query
+from .history_cache import history_cache
+from .write_behind import write_behind
+
+# (user_id, window) -> задача загрузки окна истории из БД
+_loading = {}
+
+# user_id -> [загрузок окна в работе, поколение истории]. Запись во время загрузки
+# меняет поколение, и прочитанное до нее окно не устанавливается в кэш
+_generations = {}
+
+def _write_behind_history() -> bool:
+    """Отложенная запись истории - только с окном в памяти процесса.
+    
+    Общее окно (Redis) загружает из БД любая реплика, а очередь у каждой своя:
+    загрузка не увидит чужих незаписанных сообщений и поставит неполное окно всем.
+    """
+    return config.WRITE_BEHIND_ENABLED and not history_cache.shared
+
+def _bump_generation(user_id: int):
+    entry = _generations.get(user_id)
+    if entry is not None:
+        entry[1] += 1
+
+class AsyncUserCRUD:
+    @staticmethod
+    async def get_or_create_user(user_id: int, username: str = None,
+                                 first_name: str = None, last_name: str = None):
+        return await run_query(
+            UserCRUD.get_or_create_user, user_id, username, first_name, last_name
+        )
+    
+    @staticmethod
+    async def ensure_user(user_id: int, username: str = None,
+                          first_name: str = None, last_name: str = None):
+        """Регистрация пользователя: известные пользователи не затрагивают БД"""
+        if config.WRITE_BEHIND_ENABLED:
+            write_behind.ensure_user(user_id, username, first_name, last_name)
+        else:
+            await AsyncUserCRUD.get_or_create_user(user_id, username, first_name, last_name)
+    
+    @staticmethod
+    async def increment_orders_count(user_id: int):
+        await run_query(UserCRUD.increment_orders_count, user_id)
+    
+    @staticmethod
+    async def get_user_ids_after(last_id: int, limit: int = 1000) -> list:
+        return await run_query(UserCRUD.get_user_ids_after, last_id, limit)
+
+class AsyncOrderCRUD:
+    @staticmethod
+    async def create_order(user_id: int, products: list, total_amount: float):
+        return await run_query(
+            OrderCRUD.create_order, user_id, products, total_amount
+        )
+    
+    @staticmethod
+    async def place_order(user_id: int, items: list):
+        return await run_query(OrderCRUD.place_order, user_id, items)
+
+class AsyncChatHistoryCRUD:
+    @staticmethod
+    async def add_message(user_id: int, role: str, message: str):
+        # Метка одна для окна и БД: по ней сводка истории находит свернутые сообщения
+        timestamp = message_timestamp()
+        if _write_behind_history():
+            # Окно обновляется сразу, в БД сообщение попадет с ближайшим пакетом.
+            # Сначала очередь: параллельная загрузка окна увидит сообщение в ней
+            write_behind.add_message(user_id, role, message, timestamp)
+            _bump_generation(user_id)
+            await history_cache.append(user_id, role, message, timestamp)
+            return
+        
+        # Запись сквозная: окно в памяти обновляется сразу, БД - в потоке БД
+        was_cached = await history_cache.contains(user_id)
+        await history_cache.append(user_id, role, message, timestamp)
+        
+        try:
+            await run_query(ChatHistoryCRUD.add_message, user_id, role, message, timestamp)
+        except Exception:
+            # Окно не должно расходиться с БД
+            await history_cache.discard(user_id)
+            raise
+        
+        _bump_generation(user_id)
+        if not was_cached:
+            # Окно могли загрузить из БД параллельно с записью - неизвестно,
+            # попало ли туда это сообщение, поэтому загрузим заново при чтении
+            await history_cache.discard(user_id)
+    
+    @staticmethod
+    async def get_recent_history(user_id: int, limit: int = 10):
+        cached = await history_cache.get(user_id, limit)
+        if cached is not None:
+            return cached
+        
+        # Одновременные промахи по одному пользователю ждут одно чтение из БД
+        window = max(limit, history_cache.window)
+        task = _loading.get((user_id, window))
+        if task is None:
+            task = asyncio.ensure_future(AsyncChatHistoryCRUD._load_history(user_id, window))
+            _loading[(user_id, window)] = task
+            task.add_done_callback(lambda _: _loading.pop((user_id, window), None))
+        
+        history = await asyncio.shield(task)
+        return history[:limit]
+    
+    @staticmethod
+    async def _load_history(user_id: int, window: int) -> list:
+        entry = _generations.setdefault(user_id, [0, 0])
+        entry[0] += 1
+        try:
+            if _write_behind_history():
+                # Пока читаем БД, пакеты не пишутся - дополняем историю сообщениями из очереди:
+                # все, что поставлено в очередь до этого момента, в историю попадает
+                async with write_behind.lock:
+                    history = await run_query(ChatHistoryCRUD.get_recent_history, user_id, window)
+                    generation = entry[1]
+                    history = write_behind.pending_messages(user_id) + history
+            else:
+                generation = entry[1]
+                history = await run_query(ChatHistoryCRUD.get_recent_history, user_id, window)
+            
+            # Сообщение, записанное во время чтения, могло в него не попасть - окно не ставим,
+            # следующее чтение загрузит его заново
+            if entry[1] == generation:
+                await history_cache.warm(user_id, history)
+                if entry[1] != generation:
+                    # Запись пришла, пока окно устанавливалось в общее хранилище
+                    await history_cache.discard(user_id)
+        finally:
+            entry[0] -= 1
+            if entry[0] == 0:
+                del _generations[user_id]
+        return history
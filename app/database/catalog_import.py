@@ -0,0 +1,229 @@
+import csv
+import gzip
+import hashlib
+import json
+import logging
+import time
+from itertools import islice
+
+from .models import Database
+
+logger = logging.getLogger(__name__)
+
+# Допустимые названия колонок прайс-листа для каждого поля товара
+FIELD_ALIASES = {
+    "sku": ("sku", "артикул", "article", "vendor_code"),
+    "name": ("name", "название", "наименование", "title"),
+    "category": ("category", "категория"),
+    "brand": ("brand", "бренд", "производитель", "vendor"),
+    "price": ("price", "цена"),
+    "description": ("description", "описание"),
+    "stock": ("stock", "остаток", "quantity", "количество", "qty"),
+}
+
+FIELDS = tuple(FIELD_ALIASES)
+
+class CatalogImporter:
+    """Потоковый импорт прайс-листа (CSV или JSONL) в таблицу products.
+    
+    Файл читается построчно и пишется пачками по chunk_size строк в отдельных
+    транзакциях, поэтому память не зависит от размера файла, а запись бота
+    не ждет окончания импорта. Перезаписываются только новые и изменившиеся
+    товары (по хэшу содержимого). Если что-то изменилось, увеличивается версия
+    каталога - бот по ней перестраивает поисковый индекс.
+    """
+    
+    def __init__(self, database: Database, chunk_size: int = 1000):
+        self.database = database
+        self.chunk_size = chunk_size
+    
+    @staticmethod
+    def _open(path: str):
+        if path.endswith(".gz"):
+            return gzip.open(path, "rt", encoding="utf-8-sig", newline="")
+        return open(path, "r", encoding="utf-8-sig", newline="")
+    
+    def read_rows(self, path: str, fmt: str = None, delimiter: str = ","):
+        """Строки файла как словари: формат определяется по расширению, если не задан"""
+        name = path[:-3] if path.endswith(".gz") else path
+        fmt = fmt or ("jsonl" if name.endswith((".jsonl", ".ndjson")) else "csv")
+        
+        with self._open(path) as file:
+            if fmt == "csv":
+                yield from csv.DictReader(file, delimiter=delimiter)
+            elif fmt == "jsonl":
+                for line in file:
+                    if line.strip():
+                        yield json.loads(line)
+            else:
+                raise Exception(f"Unsupported catalog format: {fmt}")
+    
+    @staticmethod
+    def _columns(row: dict) -> dict:
+        return {str(key).strip().lower(): value for key, value in row.items() if key is not None}
+    
+    @classmethod
+    def row_sku(cls, row):
+        """Артикул строки, даже если остальные поля не разбираются, или None"""
+        if not isinstance(row, dict):
+            return None
+        columns = cls._columns(row)
+        value = next((columns[alias] for alias in FIELD_ALIASES["sku"] if alias in columns), None)
+        value = value.strip() if isinstance(value, str) else value
+        return str(value) if value else None
+    
+    @classmethod
+    def normalize(cls, row: dict):
+        """Товар с полями таблицы products или None, если нет артикула или названия"""
+        if not isinstance(row, dict):
+            # Строка JSONL с массивом, числом или строкой вместо объекта
+            raise TypeError(f"expected an object, got {type(row).__name__}")
+        columns = cls._columns(row)
+        product = {}
+        for field, aliases in FIELD_ALIASES.items():
+            value = next((columns[alias] for alias in aliases if alias in columns), None)
+            product[field] = value.strip() if isinstance(value, str) else value
+        
+        if not product["sku"] or not product["name"]:
+            return None
+        product["sku"] = str(product["sku"])
+        
+        price = product["price"]
+        if isinstance(price, str):
+            # "32 990,00" -> 32990.0
+            price = price.replace(" ", "").replace("\u00a0", "").replace(",", ".")
+        product["price"] = float(price) if price not in (None, "") else None
+        
+        stock = product["stock"]
+        product["stock"] = int(float(stock)) if stock not in (None, "") else 0
+        
+        for field in ("category", "brand", "description"):
+            product[field] = product[field] or None
+        
+        product["content_hash"] = hashlib.sha1(
+            json.dumps([product[field] for field in FIELDS], ensure_ascii=False).encode()
+        ).hexdigest()
+        return product
+    
+    def _write_chunk(self, conn, products: list, track_seen: bool) -> dict:
+        # Последняя строка с тем же артикулом в пачке побеждает, как и при построчной записи
+        products = list({product["sku"]: product for product in products}.values())
+        skus = [product["sku"] for product in products]
+        
+        existing = {
+            row[0]: row[1] for row in conn.execute(
+                f"SELECT sku, content_hash FROM products WHERE sku IN ({','.join('?' * len(skus))})",
+                skus
+            )
+        }
+        changed = [product for product in products if existing.get(product["sku"]) != product["content_hash"]]
+        
+        if changed:
+            conn.executemany(
+                """INSERT INTO products (sku, name, category, brand, price, description, stock, content_hash)
+                VALUES (:sku, :name, :category, :brand, :price, :description, :stock, :content_hash)
+                ON CONFLICT (sku) DO UPDATE SET
+                    name = excluded.name,
+                    category = excluded.category,
+                    brand = excluded.brand,
+                    price = excluded.price,
+                    description = excluded.description,
+                    stock = excluded.stock,
+                    content_hash = excluded.content_hash,
+                    updated_at = CURRENT_TIMESTAMP""",
+                changed
+            )
+        if track_seen:
+            self._mark_seen(conn, skus)
+        conn.commit()
+        
+        inserted = sum(1 for product in changed if product["sku"] not in existing)
+        return {"inserted": inserted, "updated": len(changed) - inserted, "unchanged": len(products) - len(changed)}
+    
+    @staticmethod
+    def _mark_seen(conn, skus: list):
+        conn.executemany("INSERT OR IGNORE INTO import_seen (sku) VALUES (?)", ((sku,) for sku in skus))
+    
+    def _apply_missing(self, conn, missing: str) -> int:
+        """Товары, которых нет в файле: обнуление остатка или удаление"""
+        if missing == "zero":
+            cursor = conn.execute(
+                """UPDATE products SET stock = 0, content_hash = NULL, updated_at = CURRENT_TIMESTAMP
+                WHERE stock != 0 AND sku NOT IN (SELECT sku FROM import_seen)"""
+            )
+        else:
+            cursor = conn.execute("DELETE FROM products WHERE sku NOT IN (SELECT sku FROM import_seen)")
+        conn.commit()
+        return cursor.rowcount
+    
+    @staticmethod
+    def bump_version(conn) -> int:
+        conn.execute(
+            """INSERT INTO meta (key, value) VALUES ('catalog_version', '1')
+            ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"""
+        )
+        conn.commit()
+        return int(conn.execute("SELECT value FROM meta WHERE key = 'catalog_version'").fetchone()[0])
+    
+    def run(self, path: str, fmt: str = None, delimiter: str = ",", missing: str = "keep") -> dict:
+        """Импорт файла; missing - что делать с товарами, которых нет в файле (keep, zero, delete)"""
+        stats = {"read": 0, "skipped": 0, "inserted": 0, "updated": 0, "unchanged": 0, "missing": 0}
+        started = time.perf_counter()
+        track_seen = missing != "keep"
+        
+        rows = self.read_rows(path, fmt, delimiter)
+        with self.database.connection() as conn:
+            changed = False
+            if track_seen:
+                # Временная таблица живет в этом соединении - список артикулов не держим в памяти
+                conn.execute("CREATE TEMP TABLE IF NOT EXISTS import_seen (sku TEXT PRIMARY KEY)")
+                conn.execute("DELETE FROM import_seen")
+            
+            try:
+                while True:
+                    chunk = list(islice(rows, self.chunk_size))
+                    if not chunk:
+                        break
+                    stats["read"] += len(chunk)
+                    
+                    products = []
+                    # Пропущенные строки с артикулом: товар в файле есть, его нельзя считать отсутствующим
+                    skipped_skus = []
+                    for row in chunk:
+                        try:
+                            product = self.normalize(row)
+                        except (TypeError, ValueError) as e:
+                            logger.warning(f"Skipping catalog row {row}: {e}")
+                            product = None
+                        if product is None:
+                            stats["skipped"] += 1
+                            sku = self.row_sku(row)
+                            if sku:
+                                skipped_skus.append(sku)
+                        else:
+                            products.append(product)
+                    
+                    if track_seen and skipped_skus:
+                        self._mark_seen(conn, skipped_skus)
+                        conn.commit()
+                    if products:
+                        for key, value in self._write_chunk(conn, products, track_seen).items():
+                            stats[key] += value
+                        changed = changed or bool(stats["inserted"] or stats["updated"])
+                    
+                    if stats["read"] % (self.chunk_size * 50) == 0:
+                        logger.info(f"Catalog import progress: {stats}")
+                
+                # Пустой или целиком битый файл не должен очищать каталог
+                if track_seen and stats["read"] > stats["skipped"]:
+                    stats["missing"] = self._apply_missing(conn, missing)
+                    changed = changed or stats["missing"] > 0
+            finally:
+                if track_seen:
+                    conn.execute("DROP TABLE IF EXISTS temp.import_seen")
+                # Записанные пачки уже в БД - даже после ошибки индекс должен их увидеть
+                if changed:
+                    stats["version"] = self.bump_version(conn)
+        
+        stats["elapsed"] = round(time.perf_counter() - started, 2)
+        return stats
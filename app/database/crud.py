@@ -1,6 +1,10 @@
 from .models import db
 import json
-from datetime import datetime
+from datetime import datetime, timezone
+
+def message_timestamp() -> str:
+    """Время сообщения (UTC) в формате SQLite, с микросекундами - метка сообщения в истории"""
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S.%f")
 
 class UserCRUD:
     @staticmethod
@@ -29,6 +33,21 @@ class UserCRUD:
             
             return dict(user) if user else None
     
+    @staticmethod
+    def upsert_users(users: list):
+        """Пакетное создание/обновление пользователей: users - кортежи (id, username, first_name, last_name)"""
+        with db.connection() as conn:
+            conn.executemany(
+                """INSERT INTO users (id, username, first_name, last_name) 
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET
+                    username = excluded.username,
+                    first_name = excluded.first_name,
+                    last_name = excluded.last_name""",
+                users
+            )
+            conn.commit()
+    
     @staticmethod
     def increment_orders_count(user_id: int):
         with db.connection() as conn:
@@ -38,6 +57,25 @@ class UserCRUD:
                 (user_id,)
             )
             conn.commit()
+    
+    @staticmethod
+    def get_user_ids_after(last_id: int, limit: int = 1000) -> list:
+        """Страница id пользователей по возрастанию (для рассылки без загрузки всей таблицы)"""
+        with db.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT id FROM users WHERE id > ? ORDER BY id LIMIT ?",
+                (last_id, limit)
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+class OutOfStockError(Exception):
+    """Товара нет на складе в нужном количестве"""
+    
+    def __init__(self, sku: str, available: int):
+        super().__init__(f"Not enough stock for {sku}: {available} available")
+        self.sku = sku
+        self.available = available
 
 class OrderCRUD:
     @staticmethod
@@ -51,16 +89,137 @@ class OrderCRUD:
             )
             conn.commit()
             return cursor.lastrowid
+    
+    @staticmethod
+    def place_order(user_id: int, items: list):
+        """Заказ с резервированием товара: items - пары (sku, quantity).
+        
+        Списание остатков, заказ и счетчик заказов пользователя - одна транзакция
+        BEGIN IMMEDIATE: блокировка записи берется до первого чтения, поэтому
+        одновременные заказы одного товара выполняются по очереди и не продают
+        больше, чем есть на складе. Цены берутся из БД, а не из корзины.
+        Заказ, после которого товар закончился, увеличивает версию каталога:
+        индексы в памяти перестанут показывать товар в наличии.
+        """
+        with db.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                products = []
+                stock = {}
+                total_amount = 0.0
+                for sku, quantity in items:
+                    # Остаток изменился не импортом - следующий импорт перезапишет его из прайс-листа
+                    product = conn.execute(
+                        """UPDATE products SET stock = stock - ?, content_hash = NULL
+                        WHERE sku = ? AND stock >= ?
+                        RETURNING name, price, stock""",
+                        (quantity, sku, quantity)
+                    ).fetchone()
+                    if product is None:
+                        row = conn.execute("SELECT stock FROM products WHERE sku = ?", (sku,)).fetchone()
+                        raise OutOfStockError(sku, row[0] if row else 0)
+                    
+                    price = product["price"] or 0
+                    products.append({"sku": sku, "name": product["name"], "price": price, "quantity": quantity})
+                    stock[sku] = product["stock"]
+                    total_amount += price * quantity
+                
+                cursor = conn.execute(
+                    """INSERT INTO orders (user_id, products, total_amount) 
+                    VALUES (?, ?, ?)""",
+                    (user_id, json.dumps(products, ensure_ascii=False), total_amount)
+                )
+                # Пользователь может еще лежать в очереди отложенной записи
+                conn.execute(
+                    """INSERT INTO users (id, orders_count) VALUES (?, 1)
+                    ON CONFLICT (id) DO UPDATE SET orders_count = orders_count + 1""",
+                    (user_id,)
+                )
+                if 0 in stock.values():
+                    conn.execute(
+                        """INSERT INTO meta (key, value) VALUES ('catalog_version', '1')
+                        ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"""
+                    )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            
+            return {"order_id": cursor.lastrowid, "products": products, "stock": stock,
+                    "total_amount": total_amount}
+
+class ProductCRUD:
+    @staticmethod
+    def get_all_products():
+        with db.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """SELECT sku, name, category, brand, price, description, stock 
+                FROM products"""
+            )
+            return [dict(row) for row in cursor.fetchall()]
+    
+    @staticmethod
+    def get_product(sku: str):
+        with db.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """SELECT sku, name, category, brand, price, description, stock 
+                FROM products WHERE sku = ?""",
+                (sku,)
+            )
+            product = cursor.fetchone()
+            return dict(product) if product else None
+    
+    @staticmethod
+    def upsert_products(products: list):
+        """Пакетное создание/обновление товаров по артикулу: products - словари с полями таблицы"""
+        with db.connection() as conn:
+            conn.executemany(
+                """INSERT INTO products (sku, name, category, brand, price, description, stock) 
+                VALUES (:sku, :name, :category, :brand, :price, :description, :stock)
+                ON CONFLICT (sku) DO UPDATE SET
+                    name = excluded.name,
+                    category = excluded.category,
+                    brand = excluded.brand,
+                    price = excluded.price,
+                    description = excluded.description,
+                    stock = excluded.stock,
+                    content_hash = NULL,
+                    updated_at = CURRENT_TIMESTAMP""",
+                products
+            )
+            conn.commit()
+    
+    @staticmethod
+    def get_catalog_version() -> int:
+        """Версия каталога: увеличивается импортом при каждом изменении товаров"""
+        with db.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT value FROM meta WHERE key = 'catalog_version'")
+            row = cursor.fetchone()
+            return int(row[0]) if row else 0
 
 class ChatHistoryCRUD:
     @staticmethod
-    def add_message(user_id: int, role: str, message: str):
+    def add_message(user_id: int, role: str, message: str, timestamp: str = None):
         with db.connection() as conn:
             cursor = conn.cursor()
             cursor.execute(
-                """INSERT INTO chat_history (user_id, role, message) 
-                VALUES (?, ?, ?)""",
-                (user_id, role, message)
+                """INSERT INTO chat_history (user_id, role, message, timestamp) 
+                VALUES (?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))""",
+                (user_id, role, message, timestamp)
+            )
+            conn.commit()
+    
+    @staticmethod
+    def add_messages(messages: list):
+        """Пакетная запись сообщений: messages - кортежи (user_id, role, message, timestamp)"""
+        with db.connection() as conn:
+            conn.executemany(
+                """INSERT INTO chat_history (user_id, role, message, timestamp) 
+                VALUES (?, ?, ?, ?)""",
+                messages
             )
             conn.commit()
     
@@ -69,9 +228,22 @@ class ChatHistoryCRUD:
         with db.connection() as conn:
             cursor = conn.cursor()
             cursor.execute(
-                """SELECT role, message FROM chat_history 
+                """SELECT role, message, timestamp FROM chat_history 
                 WHERE user_id = ? 
-                ORDER BY timestamp DESC LIMIT ?""",
+                ORDER BY timestamp DESC, id DESC LIMIT ?""",
                 (user_id, limit)
             )
             return [dict(row) for row in cursor.fetchall()]
+    
+    @staticmethod
+    def get_messages_after(last_id: int, limit: int = 1000):
+        """Страница сообщений всех пользователей по возрастанию id (для построения индексов)"""
+        with db.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """SELECT id, user_id, role, message FROM chat_history 
+                WHERE id > ? 
+                ORDER BY id LIMIT ?""",
+                (last_id, limit)
+            )
+            return [dict(row) for row in cursor.fetchall()]
@@ -0,0 +1,51 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from app.services import metrics
+from .models import db
+from .postgres import pg_db
+
+# Выделенные потоки для SQLite: синхронные вызовы не блокируют event loop.
+# По одному потоку на соединение пула, чтобы потокам не приходилось ждать соединения
+db_executor = ThreadPoolExecutor(max_workers=db.pool_size if db is not None else 1, thread_name_prefix="db")
+
+async def run_in_db_thread(func, *args, **kwargs):
+    """Выполнение синхронной функции БД в выделенном потоке"""
+    loop = asyncio.get_running_loop()
+    operation = getattr(func, "__qualname__", repr(func))
+    started = time.perf_counter()
+    try:
+        return await loop.run_in_executor(db_executor, partial(func, *args, **kwargs))
+    except Exception:
+        metrics.DB_ERRORS.labels(operation).inc()
+        raise
+    finally:
+        # Время вместе с ожиданием свободного потока - так видна и очередь к БД
+        metrics.DB_LATENCY.labels(operation).observe(time.perf_counter() - started)
+
+async def run_query(func, *args, **kwargs):
+    """Вызов функции CRUD из crud.py на выбранной БД.
+    
+    SQLite - в потоке БД, PostgreSQL - асинхронный двойник из postgres.py
+    с тем же именем и аргументами, без потоков.
+    """
+    if pg_db is None:
+        return await run_in_db_thread(func, *args, **kwargs)
+    
+    operation = func.__qualname__
+    started = time.perf_counter()
+    try:
+        return await pg_db.twin(func)(*args, **kwargs)
+    except Exception:
+        metrics.DB_ERRORS.labels(operation).inc()
+        raise
+    finally:
+        metrics.DB_LATENCY.labels(operation).observe(time.perf_counter() - started)
+
+def shutdown_db_executor():
+    """Остановка потоков БД с ожиданием незавершенных операций"""
+    db_executor.shutdown(wait=True)
+    if db is not None:
+        db.close()
@@ -0,0 +1,205 @@
+import json
+import logging
+from collections import OrderedDict, deque
+from itertools import islice
+from typing import Optional
+
+from app.config import config
+from app.services import metrics
+from app.services.storage import storage
+
+logger = logging.getLogger(__name__)
+
+# Примерные накладные расходы на одно сообщение в памяти (dict + deque)
+MESSAGE_OVERHEAD = 200
+
+class HistoryCache:
+    """Окно последних сообщений активных пользователей в памяти процесса.
+    
+    Для каждого пользователя хранится кольцевой буфер из window сообщений,
+    пользователи вытесняются по LRU при превышении количества или объема.
+    """
+    
+    # Окно видно только этому процессу
+    shared = False
+    
+    def __init__(self, window: int = 10, max_users: int = 10000, max_bytes: int = 20_000_000):
+        self.window = window
+        self.max_users = max_users
+        self.max_bytes = max_bytes
+        
+        # user_id -> deque сообщений от старых к новым
+        self._users = OrderedDict()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def _message_size(message: dict) -> int:
+        return len(message["message"]) + MESSAGE_OVERHEAD
+    
+    async def contains(self, user_id: int) -> bool:
+        return user_id in self._users
+    
+    async def get(self, user_id: int, limit: int) -> Optional[list]:
+        """Последние limit сообщений (от новых к старым) или None, если окна недостаточно"""
+        messages = self._users.get(user_id)
+        if messages is None or limit > self.window:
+            self.misses += 1
+            return None
+        
+        self._users.move_to_end(user_id)
+        self.hits += 1
+        return list(islice(reversed(messages), limit))
+    
+    async def warm(self, user_id: int, history: list):
+        """Загрузка окна из БД (history - от новых к старым, как в get_recent_history)"""
+        self._remove(user_id)
+        
+        messages = deque(reversed(history[:self.window]), maxlen=self.window)
+        self._users[user_id] = messages
+        self._size += sum(self._message_size(msg) for msg in messages)
+        self._evict()
+    
+    async def append(self, user_id: int, role: str, message: str, timestamp: str = None):
+        messages = self._users.get(user_id)
+        if messages is None:
+            return
+        
+        if len(messages) == messages.maxlen:
+            self._size -= self._message_size(messages[0])
+        
+        item = {"role": role, "message": message, "timestamp": timestamp}
+        messages.append(item)
+        self._size += self._message_size(item)
+        self._users.move_to_end(user_id)
+        self._evict()
+    
+    async def discard(self, user_id: int):
+        self._remove(user_id)
+    
+    def _remove(self, user_id: int):
+        messages = self._users.pop(user_id, None)
+        if messages is not None:
+            self._size -= sum(self._message_size(msg) for msg in messages)
+    
+    def _evict(self):
+        while self._users and (len(self._users) > self.max_users or self._size > self.max_bytes):
+            self._remove(next(iter(self._users)))
+    
+    def clear(self):
+        self._users.clear()
+        self._size = 0
+    
+    def stats(self) -> dict:
+        return {
+            "users": len(self._users),
+            "bytes": self._size,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+class SharedHistoryCache:
+    """Окно последних сообщений в общем хранилище (Redis) - одно на все реплики.
+    
+    Окно пользователя - список JSON-сообщений от старых к новым. Список создает
+    только загрузка из БД (с меткой в начале, чтобы пустое окно тоже существовало),
+    добавление работает лишь для существующего списка - неполных окон не бывает.
+    Ошибки хранилища не ломают ответ: чтение превращается в промах и идет в БД.
+    """
+    
+    # Метка загруженного окна; вытесняется первым при заполнении
+    LOADED = ""
+    
+    shared = True
+    
+    def __init__(self, storage, window: int = 10, ttl: float = 3600):
+        self.storage = storage
+        self.window = window
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+    
+    @staticmethod
+    def _key(user_id: int) -> str:
+        return f"history:{user_id}"
+    
+    async def contains(self, user_id: int) -> bool:
+        try:
+            return await self.storage.exists(self._key(user_id))
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Shared history cache error: {e}")
+            return False
+    
+    async def get(self, user_id: int, limit: int) -> Optional[list]:
+        """Последние limit сообщений (от новых к старым) или None, если окна недостаточно"""
+        items = None
+        if limit <= self.window:
+            try:
+                items = await self.storage.list_range(self._key(user_id))
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"Shared history cache error: {e}")
+        
+        if not items:
+            self.misses += 1
+            return None
+        
+        self.hits += 1
+        messages = [json.loads(item) for item in reversed(items) if item != self.LOADED]
+        return messages[:limit]
+    
+    async def warm(self, user_id: int, history: list):
+        """Загрузка окна из БД (history - от новых к старым, как в get_recent_history)"""
+        items = [self.LOADED] + [
+            json.dumps(
+                {"role": msg["role"], "message": msg["message"], "timestamp": msg.get("timestamp")},
+                ensure_ascii=False
+            )
+            for msg in reversed(history[:self.window])
+        ]
+        try:
+            await self.storage.list_replace(self._key(user_id), items, self.window + 1, self.ttl)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Shared history cache error: {e}")
+    
+    async def append(self, user_id: int, role: str, message: str, timestamp: str = None):
+        item = json.dumps({"role": role, "message": message, "timestamp": timestamp}, ensure_ascii=False)
+        try:
+            await self.storage.list_push(
+                self._key(user_id), [item], self.window + 1, self.ttl, only_existing=True
+            )
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Shared history cache error: {e}")
+            # Окно без этого сообщения не должно использоваться
+            await self.discard(user_id)
+    
+    async def discard(self, user_id: int):
+        try:
+            await self.storage.delete(self._key(user_id))
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Shared history cache discard error: {e}")
+    
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors
+        }
+
+if storage.shared:
+    history_cache = SharedHistoryCache(storage, window=config.HISTORY_CACHE_WINDOW, ttl=config.HISTORY_CACHE_TTL)
+else:
+    history_cache = HistoryCache(
+        window=config.HISTORY_CACHE_WINDOW,
+        max_users=config.HISTORY_CACHE_MAX_USERS,
+        max_bytes=config.HISTORY_CACHE_MAX_BYTES
+    )
+
+metrics.HISTORY_CACHE.labels("hit").set_function(lambda: history_cache.hits)
+metrics.HISTORY_CACHE.labels("miss").set_function(lambda: history_cache.misses)
@@ -1,16 +1,82 @@
+import logging
+import queue
 import sqlite3
+import threading
 from contextlib import contextmanager
-from datetime import datetime
+
+from app.config import config
+
+logger = logging.getLogger(__name__)
+
+# Миграции схемы: элемент списка N переводит БД на версию N + 1 (PRAGMA user_version)
+MIGRATIONS = [
+    # 1: индексы для выборки истории пользователя и очистки по возрасту
+    [
+        "CREATE INDEX IF NOT EXISTS idx_chat_history_user_ts ON chat_history (user_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_chat_history_timestamp ON chat_history (timestamp)",
+    ],
+    # 2: каталог товаров
+    [
+        """CREATE TABLE IF NOT EXISTS products (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sku TEXT NOT NULL UNIQUE,
+            name TEXT NOT NULL,
+            category TEXT,
+            brand TEXT,
+            price REAL,
+            description TEXT,
+            stock INTEGER DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""",
+    ],
+    # 3: хэш содержимого товара для импорта и служебные значения (версия каталога)
+    [
+        "ALTER TABLE products ADD COLUMN content_hash TEXT",
+        "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)",
+    ],
+]
 
 class Database:
-    def __init__(self, db_path: str):
+    def __init__(self, db_path: str, pool_size: int = 4, busy_timeout: int = 5000,
+                 cached_statements: int = 256):
         self.db_path = db_path
-        self.init_db()
+        self.pool_size = max(1, pool_size)
+        self.busy_timeout = busy_timeout
+        self.cached_statements = cached_statements
+        
+        # Пул долгоживущих соединений вместо открытия нового на каждый запрос
+        self._pool = queue.LifoQueue(maxsize=self.pool_size)
+        self._created = 0
+        self._lock = threading.Lock()
+        
+        # Файл БД создается и мигрируется при первом обращении, а не при импорте модуля
+        self._opened = False
+        self._open_lock = threading.Lock()
+    
+    def open(self):
+        """Создание схемы и миграции (один раз): при старте бота или первом запросе"""
+        with self._open_lock:
+            if not self._opened:
+                self.init_db()
+                self._opened = True
     
     def init_db(self):
-        with self.connection() as conn:
+        with self._connection() as conn:
             cursor = conn.cursor()
             
+            # Инкрементальная очистка освобожденных страниц: новая БД создается сразу с ней,
+            # существующую переводит vacuum_db.py - полный VACUUM блокирует БД надолго
+            if cursor.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                if cursor.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()[0] == 0:
+                    # Файл пустой - VACUUM мгновенный (заголовок уже записан при включении WAL)
+                    cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                    cursor.execute("VACUUM")
+                else:
+                    logger.warning(
+                        f"{self.db_path}: auto_vacuum is off, freed pages are not returned to the file system. "
+                        f"Run vacuum_db.py while the bot is stopped"
+                    )
+            
             # Пользователи
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS users (
@@ -49,14 +115,113 @@ class Database:
             ''')
             
             conn.commit()
+            
+            self._migrate(conn)
     
-    @contextmanager
-    def connection(self):
-        conn = sqlite3.connect(self.db_path)
+    def enable_incremental_vacuum(self) -> bool:
+        """Перевод существующей БД на инкрементальную очистку полным VACUUM.
+        
+        Перезаписывает весь файл и блокирует запись на это время. False - уже включена.
+        """
+        with self.connection() as conn:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                return False
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+            return True
+    
+    def _migrate(self, conn: sqlite3.Connection):
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        
+        for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {number}")
+            conn.commit()
+    
+    def _create_connection(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout / 1000,
+            check_same_thread=False,  # соединение переходит между потоками пула
+            cached_statements=self.cached_statements
+        )
         conn.row_factory = sqlite3.Row
+        
+        # WAL: читатели не блокируются писателем, NORMAL безопасен в режиме WAL
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+    
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+        
+        with self._lock:
+            if self._created < self.pool_size:
+                self._created += 1
+                try:
+                    return self._create_connection()
+                except Exception:
+                    self._created -= 1
+                    raise
+        
+        # Все соединения заняты - ждем освобождения
+        return self._pool.get(timeout=self.busy_timeout / 1000)
+    
+    def _release(self, conn: sqlite3.Connection):
+        try:
+            # Незакоммиченные изменения не должны достаться следующему владельцу
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            # Сломанное соединение не возвращаем в пул
+            with self._lock:
+                self._created -= 1
+            conn.close()
+            return
+        self._pool.put_nowait(conn)
+    
+    def connection(self):
+        """Соединение из пула: with db.connection() as conn"""
+        if not self._opened:
+            self.open()
+        return self._connection()
+    
+    @contextmanager
+    def _connection(self):
+        conn = self._acquire()
         try:
             yield conn
         finally:
-            conn.close()
+            self._release(conn)
+    
+    def close(self):
+        """Закрытие всех соединений пула"""
+        with self._lock:
+            while True:
+                try:
+                    conn = self._pool.get_nowait()
+                except queue.Empty:
+                    break
+                conn.close()
+                self._created -= 1
+
+def is_postgres_url(url: str) -> bool:
+    return url.startswith(("postgres://", "postgresql://"))
+
+def sqlite_path(url: str) -> str:
+    """Путь к файлу SQLite: DATABASE_URL - путь или sqlite:///путь"""
+    return url[len("sqlite:///"):] if url.startswith("sqlite:///") else url
 
-db = Database("shop_bot.db")
+# С PostgreSQL (DATABASE_URL=postgresql://...) файл SQLite не создается
+db = None if is_postgres_url(config.DATABASE_URL) else Database(
+    sqlite_path(config.DATABASE_URL),
+    pool_size=config.DB_POOL_SIZE,
+    busy_timeout=config.DB_BUSY_TIMEOUT,
+    cached_statements=config.DB_CACHED_STATEMENTS
+)
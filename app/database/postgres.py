@@ -0,0 +1,364 @@
+import asyncio
+import json
+import logging
+import sys
+from contextlib import asynccontextmanager
+
+from app.config import config
+from .crud import OutOfStockError
+from .models import is_postgres_url
+
+logger = logging.getLogger(__name__)
+
+# Схема, эквивалентная SQLite: элемент списка N переводит БД на версию N + 1 (таблица schema_version).
+# Внешних ключей нет, как и в SQLite (PRAGMA foreign_keys выключен): сообщения из очереди
+# отложенной записи могут прийти раньше пользователя
+MIGRATIONS = [
+    # 1: исходные таблицы
+    [
+        """CREATE TABLE IF NOT EXISTS users (
+            id BIGINT PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            created_at TIMESTAMP DEFAULT (now() AT TIME ZONE 'utc'),
+            orders_count INTEGER DEFAULT 0
+        )""",
+        """CREATE TABLE IF NOT EXISTS orders (
+            id BIGSERIAL PRIMARY KEY,
+            user_id BIGINT,
+            products JSONB,
+            total_amount DOUBLE PRECISION,
+            status TEXT DEFAULT 'pending',
+            created_at TIMESTAMP DEFAULT (now() AT TIME ZONE 'utc')
+        )""",
+        """CREATE TABLE IF NOT EXISTS chat_history (
+            id BIGSERIAL PRIMARY KEY,
+            user_id BIGINT,
+            role TEXT,
+            message TEXT,
+            timestamp TIMESTAMP DEFAULT (now() AT TIME ZONE 'utc')
+        )""",
+    ],
+    # 2: индексы для выборки истории пользователя и очистки по возрасту
+    [
+        "CREATE INDEX IF NOT EXISTS idx_chat_history_user_ts ON chat_history (user_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_chat_history_timestamp ON chat_history (timestamp)",
+    ],
+    # 3: каталог товаров, хэш содержимого для импорта и служебные значения
+    [
+        """CREATE TABLE IF NOT EXISTS products (
+            id BIGSERIAL PRIMARY KEY,
+            sku TEXT NOT NULL UNIQUE,
+            name TEXT NOT NULL,
+            category TEXT,
+            brand TEXT,
+            price DOUBLE PRECISION,
+            description TEXT,
+            stock INTEGER DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT (now() AT TIME ZONE 'utc'),
+            content_hash TEXT
+        )""",
+        "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)",
+    ],
+]
+
+# Ключ advisory-блокировки: реплики, стартующие одновременно, применяют миграции по очереди
+MIGRATION_LOCK = 7352001
+
+class PostgresDatabase:
+    """Пул соединений asyncpg с миграциями схемы при первом подключении.
+    
+    asyncpg подготавливает каждый запрос на сервере и кэширует подготовленные
+    выражения в соединении (statement_cache_size), поэтому повторные вызовы CRUD
+    не разбирают SQL заново.
+    """
+    
+    def __init__(self, dsn: str, min_size: int = 2, max_size: int = 20,
+                 statement_cache_size: int = 256, command_timeout: float = 10):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.statement_cache_size = statement_cache_size
+        self.command_timeout = command_timeout
+        self._pool = None
+        self._lock = None
+    
+    async def _create_pool(self):
+        try:
+            import asyncpg
+        except ImportError:
+            raise Exception("PostgreSQL DATABASE_URL requires the asyncpg package (pip install asyncpg)")
+        
+        pool = await asyncpg.create_pool(
+            self.dsn,
+            min_size=self.min_size,
+            max_size=self.max_size,
+            statement_cache_size=self.statement_cache_size,
+            command_timeout=self.command_timeout
+        )
+        async with pool.acquire() as conn:
+            await self._migrate(conn)
+        return pool
+    
+    async def _migrate(self, conn):
+        async with conn.transaction():
+            await conn.execute("SELECT pg_advisory_xact_lock($1)", MIGRATION_LOCK)
+            await conn.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+            version = await conn.fetchval("SELECT version FROM schema_version")
+            if version is None:
+                version = 0
+                await conn.execute("INSERT INTO schema_version (version) VALUES (0)")
+            
+            for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+                for statement in statements:
+                    await conn.execute(statement)
+                await conn.execute("UPDATE schema_version SET version = $1", number)
+                logger.info(f"PostgreSQL schema migrated to version {number}")
+    
+    async def pool(self):
+        """Пул создается при первом обращении - в работающем event loop"""
+        if self._pool is None:
+            if self._lock is None:
+                self._lock = asyncio.Lock()
+            async with self._lock:
+                if self._pool is None:
+                    self._pool = await self._create_pool()
+        return self._pool
+    
+    @asynccontextmanager
+    async def connection(self):
+        pool = await self.pool()
+        async with pool.acquire() as conn:
+            yield conn
+    
+    async def close(self):
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+    
+    @staticmethod
+    def twin(func):
+        """Асинхронный двойник функции CRUD из crud.py: UserCRUD.add -> postgres.UserCRUD.add"""
+        class_name, _, name = func.__qualname__.rpartition(".")
+        return getattr(getattr(sys.modules[__name__], class_name), name)
+
+class UserCRUD:
+    @staticmethod
+    async def get_or_create_user(user_id: int, username: str = None,
+                                 first_name: str = None, last_name: str = None):
+        async with pg_db.connection() as conn:
+            user = await conn.fetchrow(
+                """WITH created AS (
+                    INSERT INTO users (id, username, first_name, last_name)
+                    VALUES ($1, $2, $3, $4)
+                    ON CONFLICT (id) DO NOTHING
+                    RETURNING *
+                )
+                SELECT * FROM created UNION ALL SELECT * FROM users WHERE id = $1
+                LIMIT 1""",
+                user_id, username, first_name, last_name
+            )
+            if user is None:
+                # Параллельная вставка победила: снимок запроса строки еще не видел,
+                # новый запрос увидит ее закоммиченной
+                user = await conn.fetchrow("SELECT * FROM users WHERE id = $1", user_id)
+            return dict(user) if user else None
+    
+    @staticmethod
+    async def upsert_users(users: list):
+        """Пакетное создание/обновление пользователей: users - кортежи (id, username, first_name, last_name)"""
+        async with pg_db.connection() as conn:
+            await conn.executemany(
+                """INSERT INTO users (id, username, first_name, last_name)
+                VALUES ($1, $2, $3, $4)
+                ON CONFLICT (id) DO UPDATE SET
+                    username = excluded.username,
+                    first_name = excluded.first_name,
+                    last_name = excluded.last_name""",
+                users
+            )
+    
+    @staticmethod
+    async def increment_orders_count(user_id: int):
+        async with pg_db.connection() as conn:
+            await conn.execute(
+                "UPDATE users SET orders_count = orders_count + 1 WHERE id = $1",
+                user_id
+            )
+    
+    @staticmethod
+    async def get_user_ids_after(last_id: int, limit: int = 1000) -> list:
+        """Страница id пользователей по возрастанию (для рассылки без загрузки всей таблицы)"""
+        async with pg_db.connection() as conn:
+            rows = await conn.fetch(
+                "SELECT id FROM users WHERE id > $1 ORDER BY id LIMIT $2",
+                last_id, limit
+            )
+            return [row["id"] for row in rows]
+
+class OrderCRUD:
+    @staticmethod
+    async def create_order(user_id: int, products: list, total_amount: float):
+        async with pg_db.connection() as conn:
+            return await conn.fetchval(
+                """INSERT INTO orders (user_id, products, total_amount)
+                VALUES ($1, $2, $3) RETURNING id""",
+                user_id, json.dumps(products, ensure_ascii=False), total_amount
+            )
+    
+    @staticmethod
+    async def place_order(user_id: int, items: list):
+        """Заказ с резервированием товара: items - пары (sku, quantity).
+        
+        Строки товаров блокируются условным UPDATE внутри транзакции: параллельный
+        заказ того же товара ждет ее завершения и перепроверяет остаток. Товары
+        блокируются в порядке артикулов, чтобы встречные заказы не взаимоблокировались.
+        Если товар закончился, последней увеличивается версия каталога - строка meta
+        блокируется только до коммита и только такими заказами.
+        """
+        async with pg_db.connection() as conn:
+            async with conn.transaction():
+                products = []
+                stock = {}
+                total_amount = 0.0
+                for sku, quantity in sorted(items):
+                    product = await conn.fetchrow(
+                        """UPDATE products SET stock = stock - $1, content_hash = NULL
+                        WHERE sku = $2 AND stock >= $1
+                        RETURNING name, price, stock""",
+                        quantity, sku
+                    )
+                    if product is None:
+                        available = await conn.fetchval("SELECT stock FROM products WHERE sku = $1", sku)
+                        raise OutOfStockError(sku, available or 0)
+                    
+                    price = product["price"] or 0
+                    products.append({"sku": sku, "name": product["name"], "price": price, "quantity": quantity})
+                    stock[sku] = product["stock"]
+                    total_amount += price * quantity
+                
+                order_id = await conn.fetchval(
+                    """INSERT INTO orders (user_id, products, total_amount)
+                    VALUES ($1, $2, $3) RETURNING id""",
+                    user_id, json.dumps(products, ensure_ascii=False), total_amount
+                )
+                await conn.execute(
+                    """INSERT INTO users (id, orders_count) VALUES ($1, 1)
+                    ON CONFLICT (id) DO UPDATE SET orders_count = users.orders_count + 1""",
+                    user_id
+                )
+                if 0 in stock.values():
+                    await conn.execute(
+                        """INSERT INTO meta (key, value) VALUES ('catalog_version', '1')
+                        ON CONFLICT (key) DO UPDATE SET value = (CAST(meta.value AS INTEGER) + 1)::text"""
+                    )
+            
+            return {"order_id": order_id, "products": products, "stock": stock,
+                    "total_amount": total_amount}
+
+class ProductCRUD:
+    @staticmethod
+    async def get_all_products():
+        async with pg_db.connection() as conn:
+            rows = await conn.fetch(
+                """SELECT sku, name, category, brand, price, description, stock
+                FROM products"""
+            )
+            return [dict(row) for row in rows]
+    
+    @staticmethod
+    async def get_product(sku: str):
+        async with pg_db.connection() as conn:
+            product = await conn.fetchrow(
+                """SELECT sku, name, category, brand, price, description, stock
+                FROM products WHERE sku = $1""",
+                sku
+            )
+            return dict(product) if product else None
+    
+    @staticmethod
+    async def upsert_products(products: list):
+        """Пакетное создание/обновление товаров по артикулу: products - словари с полями таблицы"""
+        async with pg_db.connection() as conn:
+            await conn.executemany(
+                """INSERT INTO products (sku, name, category, brand, price, description, stock)
+                VALUES ($1, $2, $3, $4, $5, $6, $7)
+                ON CONFLICT (sku) DO UPDATE SET
+                    name = excluded.name,
+                    category = excluded.category,
+                    brand = excluded.brand,
+                    price = excluded.price,
+                    description = excluded.description,
+                    stock = excluded.stock,
+                    content_hash = NULL,
+                    updated_at = now() AT TIME ZONE 'utc'""",
+                [
+                    (p["sku"], p["name"], p.get("category"), p.get("brand"), p.get("price"),
+                     p.get("description"), p.get("stock") or 0)
+                    for p in products
+                ]
+            )
+    
+    @staticmethod
+    async def get_catalog_version() -> int:
+        """Версия каталога: увеличивается импортом при каждом изменении товаров"""
+        async with pg_db.connection() as conn:
+            value = await conn.fetchval("SELECT value FROM meta WHERE key = 'catalog_version'")
+            return int(value) if value else 0
+
+class ChatHistoryCRUD:
+    @staticmethod
+    async def add_message(user_id: int, role: str, message: str, timestamp: str = None):
+        async with pg_db.connection() as conn:
+            await conn.execute(
+                """INSERT INTO chat_history (user_id, role, message, timestamp)
+                VALUES ($1, $2, $3, COALESCE(CAST($4::text AS TIMESTAMP), now() AT TIME ZONE 'utc'))""",
+                user_id, role, message, timestamp
+            )
+    
+    @staticmethod
+    async def add_messages(messages: list):
+        """Пакетная запись сообщений: messages - кортежи (user_id, role, message, timestamp)"""
+        async with pg_db.connection() as conn:
+            # Время приходит строкой в формате SQLite (UTC)
+            await conn.executemany(
+                """INSERT INTO chat_history (user_id, role, message, timestamp)
+                VALUES ($1, $2, $3, CAST($4::text AS TIMESTAMP))""",
+                messages
+            )
+    
+    @staticmethod
+    async def get_recent_history(user_id: int, limit: int = 10):
+        async with pg_db.connection() as conn:
+            rows = await conn.fetch(
+                """SELECT role, message, timestamp FROM chat_history
+                WHERE user_id = $1
+                ORDER BY timestamp DESC, id DESC LIMIT $2""",
+                user_id, limit
+            )
+            # Метка времени - строкой, как в SQLite и в окне истории
+            return [
+                dict(row, timestamp=row["timestamp"].strftime("%Y-%m-%d %H:%M:%S.%f"))
+                for row in rows
+            ]
+    
+    @staticmethod
+    async def get_messages_after(last_id: int, limit: int = 1000):
+        """Страница сообщений всех пользователей по возрастанию id (для построения индексов)"""
+        async with pg_db.connection() as conn:
+            rows = await conn.fetch(
+                """SELECT id, user_id, role, message FROM chat_history
+                WHERE id > $1
+                ORDER BY id LIMIT $2""",
+                last_id, limit
+            )
+            return [dict(row) for row in rows]
+
+pg_db = PostgresDatabase(
+    config.DATABASE_URL,
+    min_size=config.PG_POOL_MIN_SIZE,
+    max_size=config.PG_POOL_MAX_SIZE,
+    statement_cache_size=config.DB_CACHED_STATEMENTS,
+    command_timeout=config.PG_COMMAND_TIMEOUT
+) if is_postgres_url(config.DATABASE_URL) else None
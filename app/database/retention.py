@@ -0,0 +1,157 @@
+import asyncio
+import logging
+
+from app.config import config
+from .models import Database, db
+from .executor import run_in_db_thread
+from .postgres import PostgresDatabase, pg_db
+
+logger = logging.getLogger(__name__)
+
+class HistoryRetention:
+    """Фоновая очистка chat_history: ограничение истории пользователя по количеству и возрасту"""
+    
+    # Размер пачки удаления - блокировка записи удерживается недолго
+    BATCH_SIZE = 5000
+    
+    def __init__(self, database: Database, max_messages: int, max_age_days: int,
+                 interval: float, vacuum_pages: int, pg_database: PostgresDatabase = None):
+        self.database = database
+        self.pg_database = pg_database
+        self.max_messages = max_messages
+        self.max_age_days = max_age_days
+        self.interval = interval
+        self.vacuum_pages = vacuum_pages
+        self._task = None
+    
+    def _delete_expired(self, conn) -> int:
+        deleted = 0
+        while True:
+            cursor = conn.execute(
+                """DELETE FROM chat_history WHERE id IN (
+                    SELECT id FROM chat_history
+                    WHERE timestamp < datetime('now', ?)
+                    LIMIT ?
+                )""",
+                (f"-{self.max_age_days} days", self.BATCH_SIZE)
+            )
+            conn.commit()
+            deleted += cursor.rowcount
+            if cursor.rowcount < self.BATCH_SIZE:
+                return deleted
+    
+    def _trim_users(self, conn) -> int:
+        user_ids = [
+            row[0] for row in conn.execute(
+                "SELECT user_id FROM chat_history GROUP BY user_id HAVING COUNT(*) > ?",
+                (self.max_messages,)
+            )
+        ]
+        
+        deleted = 0
+        for i, user_id in enumerate(user_ids, start=1):
+            cursor = conn.execute(
+                """DELETE FROM chat_history WHERE user_id = ? AND id IN (
+                    SELECT id FROM chat_history
+                    WHERE user_id = ?
+                    ORDER BY timestamp DESC, id DESC
+                    LIMIT -1 OFFSET ?
+                )""",
+                (user_id, user_id, self.max_messages)
+            )
+            deleted += cursor.rowcount
+            if i % 100 == 0:
+                conn.commit()
+        conn.commit()
+        return deleted
+    
+    def run_once(self) -> dict:
+        """Один проход очистки (синхронно, выполняется в потоке БД)"""
+        stats = {"expired": 0, "trimmed": 0}
+        
+        with self.database.connection() as conn:
+            if self.max_age_days > 0:
+                stats["expired"] = self._delete_expired(conn)
+            if self.max_messages > 0:
+                stats["trimmed"] = self._trim_users(conn)
+            if self.vacuum_pages > 0:
+                # Возвращаем освободившиеся страницы файловой системе небольшими порциями
+                conn.execute(f"PRAGMA incremental_vacuum({int(self.vacuum_pages)})").fetchall()
+        
+        return stats
+    
+    async def run_once_postgres(self) -> dict:
+        """Один проход очистки в PostgreSQL; место освобождает autovacuum"""
+        stats = {"expired": 0, "trimmed": 0}
+        
+        async with self.pg_database.connection() as conn:
+            if self.max_age_days > 0:
+                while True:
+                    status = await conn.execute(
+                        """DELETE FROM chat_history WHERE id IN (
+                            SELECT id FROM chat_history
+                            WHERE timestamp < (now() AT TIME ZONE 'utc') - make_interval(days => $1)
+                            LIMIT $2
+                        )""",
+                        self.max_age_days, self.BATCH_SIZE
+                    )
+                    # Статус команды: "DELETE <количество>"
+                    deleted = int(status.split()[-1])
+                    stats["expired"] += deleted
+                    if deleted < self.BATCH_SIZE:
+                        break
+            
+            if self.max_messages > 0:
+                user_ids = await conn.fetch(
+                    "SELECT user_id FROM chat_history GROUP BY user_id HAVING COUNT(*) > $1",
+                    self.max_messages
+                )
+                # Как в SQLite - по пользователю за запрос: каждый запрос - своя короткая транзакция
+                for row in user_ids:
+                    status = await conn.execute(
+                        """DELETE FROM chat_history WHERE user_id = $1 AND id IN (
+                            SELECT id FROM chat_history
+                            WHERE user_id = $1
+                            ORDER BY timestamp DESC, id DESC
+                            OFFSET $2
+                        )""",
+                        row["user_id"], self.max_messages
+                    )
+                    stats["trimmed"] += int(status.split()[-1])
+        
+        return stats
+    
+    async def _run_forever(self):
+        while True:
+            try:
+                if self.pg_database is not None:
+                    stats = await self.run_once_postgres()
+                else:
+                    stats = await run_in_db_thread(self.run_once)
+                if stats["expired"] or stats["trimmed"]:
+                    logger.info(f"Chat history retention: {stats}")
+            except Exception as e:
+                logger.error(f"Chat history retention error: {e}")
+            await asyncio.sleep(self.interval)
+    
+    def start(self):
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run_forever())
+    
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+history_retention = HistoryRetention(
+    db,
+    max_messages=config.HISTORY_MAX_MESSAGES,
+    max_age_days=config.HISTORY_MAX_AGE_DAYS,
+    interval=config.HISTORY_RETENTION_INTERVAL,
+    vacuum_pages=config.HISTORY_VACUUM_PAGES,
+    pg_database=pg_db
+)
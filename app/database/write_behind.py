@@ -0,0 +1,164 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+
+from app.config import config
+from app.services import metrics
+from .crud import UserCRUD, ChatHistoryCRUD
+from .executor import run_query
+
+logger = logging.getLogger(__name__)
+
+class WriteBehindQueue:
+    """Отложенная запись сообщений и пользователей пакетами.
+    
+    Сообщения и регистрации пользователей копятся в памяти и записываются
+    одним executemany по достижении batch_size, раз в interval секунд
+    и при остановке бота.
+    """
+    
+    def __init__(self, batch_size: int = 500, interval: float = 0.5,
+                 max_pending: int = 100000, known_users_max: int = 1000000):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_pending = max_pending
+        self.known_users_max = known_users_max
+        
+        # (user_id, role, message, timestamp) в порядке поступления
+        self._messages = []
+        # user_id -> (id, username, first_name, last_name)
+        self._users = {}
+        # Пользователи, которые уже есть в БД или в очереди
+        self.known_users = set()
+        
+        # Пока блокировка захвачена, пакет не пишется: БД и очередь вместе
+        # содержат всю историю без пропусков и повторов
+        self.lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._stopping = False
+        
+        self.flushes = 0
+        self.flushed_messages = 0
+        self.failures = 0
+        self.dropped = 0
+    
+    @property
+    def pending(self) -> int:
+        return len(self._messages) + len(self._users)
+    
+    def add_message(self, user_id: int, role: str, message: str, timestamp: str = None):
+        if timestamp is None:
+            timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        self._messages.append((user_id, role, message, timestamp))
+        
+        if len(self._messages) > self.max_pending:
+            # БД недоступна слишком долго - жертвуем самыми старыми сообщениями
+            overflow = len(self._messages) - self.max_pending
+            del self._messages[:overflow]
+            self.dropped += overflow
+            logger.error(f"Write-behind queue overflow, dropped {overflow} messages")
+        
+        if len(self._messages) >= self.batch_size:
+            self._wakeup.set()
+    
+    def ensure_user(self, user_id: int, username: str = None,
+                    first_name: str = None, last_name: str = None):
+        if user_id in self.known_users:
+            return
+        
+        if len(self.known_users) >= self.known_users_max:
+            self.known_users.clear()
+        self.known_users.add(user_id)
+        self._users[user_id] = (user_id, username, first_name, last_name)
+    
+    def pending_messages(self, user_id: int) -> list:
+        """Еще не записанные сообщения пользователя, от новых к старым"""
+        return [
+            {"role": role, "message": message, "timestamp": timestamp}
+            for uid, role, message, timestamp in reversed(self._messages)
+            if uid == user_id
+        ]
+    
+    async def flush(self):
+        async with self.lock:
+            if not self._messages and not self._users:
+                return
+            
+            messages, self._messages = self._messages, []
+            users, self._users = self._users, {}
+            
+            try:
+                # Сначала пользователи, затем их сообщения; при ошибке пакет повторяется целиком,
+                # повторная запись пользователей безвредна
+                if users:
+                    await run_query(UserCRUD.upsert_users, list(users.values()))
+                if messages:
+                    await run_query(ChatHistoryCRUD.add_messages, messages)
+            except Exception:
+                self.failures += 1
+                # Возвращаем пакет в начало очереди для следующей попытки
+                self._messages[:0] = messages
+                for user_id, user in users.items():
+                    self._users.setdefault(user_id, user)
+                raise
+            
+            self.flushes += 1
+            self.flushed_messages += len(messages)
+    
+    async def _run_forever(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Write-behind flush error: {e}")
+                await asyncio.sleep(self.interval)
+    
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run_forever())
+    
+    async def stop(self, attempts: int = 3):
+        """Остановка с записью всего, что осталось в очереди"""
+        if self._task is not None:
+            # Не отменяем задачу, чтобы не прервать запись пакета на середине
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        
+        for attempt in range(1, attempts + 1):
+            try:
+                await self.flush()
+                return
+            except Exception as e:
+                logger.error(f"Write-behind drain attempt {attempt} failed: {e}")
+                await asyncio.sleep(self.interval)
+        
+        logger.error(f"Write-behind drain failed, {self.pending} records lost")
+    
+    def stats(self) -> dict:
+        return {
+            "pending": self.pending,
+            "known_users": len(self.known_users),
+            "flushes": self.flushes,
+            "flushed_messages": self.flushed_messages,
+            "failures": self.failures,
+            "dropped": self.dropped
+        }
+
+write_behind = WriteBehindQueue(
+    batch_size=config.WRITE_BEHIND_BATCH_SIZE,
+    interval=config.WRITE_BEHIND_INTERVAL,
+    max_pending=config.WRITE_BEHIND_MAX_PENDING,
+    known_users_max=config.KNOWN_USERS_MAX
+)
+
+metrics.WRITE_BEHIND_PENDING.set_function(lambda: write_behind.pending)
@@ -0,0 +1,36 @@
+from aiogram import Bot, Router, F, types
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.filters import Command, CommandObject
+
+from app.config import config
+from app.services.broadcast import broadcaster
+
+ADMIN_IDS = {int(user_id) for user_id in config.ADMIN_IDS.split(",") if user_id.strip()}
+
+async def broadcast_handler(message: types.Message, command: CommandObject, bot: Bot):
+    if not command.args:
+        usage = "Использование: /broadcast текст сообщения (HTML-разметка Telegram)"
+        await message.answer(f"{broadcaster.report()}\n\n{usage}", parse_mode=None)
+        return
+    
+    if broadcaster.running:
+        await message.answer(f"Дождитесь окончания текущей рассылки.\n{broadcaster.report()}", parse_mode=None)
+        return
+    
+    # Предпросмотр администратору: ошибка разметки обнаружится до рассылки
+    try:
+        await message.answer(command.args)
+    except TelegramBadRequest as e:
+        await message.answer(f"Сообщение не отправлено: {e.message}", parse_mode=None)
+        return
+    
+    broadcaster.start(bot, command.args, report_chat_id=message.chat.id)
+    await message.answer("📣 Рассылка запущена. Ход - /broadcast без текста, отчет придет по завершении.")
+
+def create_router() -> Router:
+    """Роутер команд администратора; новый на каждый диспетчер"""
+    router = Router(name="broadcast")
+    # У остальных пользователей команда уходит консультанту как обычный текст
+    router.message.filter(F.from_user.id.in_(ADMIN_IDS))
+    router.message.register(broadcast_handler, Command("broadcast"))
+    return router
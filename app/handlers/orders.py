@@ -0,0 +1,214 @@
+import logging
+from typing import Optional
+
+from aiogram import Router, F, types
+from aiogram.filters import Command, StateFilter
+from aiogram.filters.callback_data import CallbackData
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+from app.config import config
+from app.database.async_crud import AsyncOrderCRUD
+from app.database.crud import OutOfStockError
+from app.keyboards import get_main_keyboard, get_checkout_keyboard
+from app.services import metrics
+from app.services.catalog import catalog
+
+logger = logging.getLogger(__name__)
+
+class CheckoutStates(StatesGroup):
+    choosing_product = State()
+    choosing_quantity = State()
+    confirming = State()
+    # Заказ записывается - повторное нажатие "Оформить" не создаст второй
+    placing = State()
+
+class CartCallback(CallbackData, prefix="cart"):
+    action: str  # add, more, confirm, cancel
+    sku: Optional[str] = None
+
+def format_cart(cart: dict) -> str:
+    """Состав корзины с ценами из каталога (окончательная сумма считается при оформлении)"""
+    lines = ["🛒 Ваша корзина:"]
+    total = 0.0
+    for sku, quantity in cart.items():
+        product = catalog.index.get(sku)
+        name = product["name"] if product else sku
+        price = (product.get("price") if product else None) or 0
+        total += price * quantity
+        lines.append(f"• {name} × {quantity} - {price * quantity:.0f} руб.")
+    lines.append(f"\nИтого: <b>{total:.0f} руб.</b>")
+    return "\n".join(lines)
+
+def get_cart_keyboard():
+    builder = InlineKeyboardBuilder()
+    builder.button(text="✅ Оформить", callback_data=CartCallback(action="confirm"))
+    builder.button(text="➕ Добавить товар", callback_data=CartCallback(action="more"))
+    builder.button(text="❌ Отменить", callback_data=CartCallback(action="cancel"))
+    builder.adjust(1)
+    return builder.as_markup()
+
+async def show_cart(message: types.Message, state: FSMContext, cart: dict):
+    if not cart:
+        await state.set_state(CheckoutStates.choosing_product)
+        await message.answer("Корзина пуста. Напишите, какой товар хотите заказать.")
+        return
+    
+    await state.set_state(CheckoutStates.confirming)
+    await message.answer(format_cart(cart), reply_markup=get_cart_keyboard())
+
+async def order_handler(message: types.Message, state: FSMContext):
+    await state.set_state(CheckoutStates.choosing_product)
+    await state.set_data({"cart": {}})
+    await message.answer(
+        "Напишите, какой товар хотите заказать: например, «смартфон Samsung до 30000».",
+        reply_markup=get_checkout_keyboard()
+    )
+
+async def cancel_order_handler(message: types.Message, state: FSMContext):
+    await state.clear()
+    await message.answer("Оформление заказа отменено.", reply_markup=get_main_keyboard())
+
+async def choose_product_handler(message: types.Message, state: FSMContext):
+    products = catalog.search(message.text, limit=config.ORDER_SEARCH_RESULTS, in_stock=True)
+    if not products:
+        await message.answer("Не нашел такого товара в наличии. Попробуйте описать его иначе.")
+        return
+    
+    builder = InlineKeyboardBuilder()
+    for product in products:
+        builder.button(
+            text=f"{product['name']} - {product.get('price') or 0:.0f} руб.",
+            callback_data=CartCallback(action="add", sku=product["sku"])
+        )
+    builder.adjust(1)
+    await message.answer("Выберите товар:", reply_markup=builder.as_markup())
+
+async def add_product_handler(callback: types.CallbackQuery, callback_data: CartCallback, state: FSMContext):
+    product = catalog.index.get(callback_data.sku)
+    if product is None or not product.get("stock"):
+        await callback.answer("Этого товара уже нет в наличии", show_alert=True)
+        return
+    
+    await state.update_data(sku=product["sku"])
+    await state.set_state(CheckoutStates.choosing_quantity)
+    await callback.message.answer(
+        f"{product['name']}\nСколько штук? (от 1 до {min(config.ORDER_MAX_QUANTITY, product['stock'])})"
+    )
+    await callback.answer()
+
+async def choose_quantity_handler(message: types.Message, state: FSMContext):
+    text = message.text.strip()
+    if not text.isdigit() or not 1 <= int(text) <= config.ORDER_MAX_QUANTITY:
+        await message.answer(f"Введите число от 1 до {config.ORDER_MAX_QUANTITY}.")
+        return
+    
+    data = await state.get_data()
+    cart = data.get("cart", {})
+    sku = data["sku"]
+    cart[sku] = min(cart.get(sku, 0) + int(text), config.ORDER_MAX_QUANTITY)
+    await state.update_data(cart=cart)
+    await show_cart(message, state, cart)
+
+async def more_products_handler(callback: types.CallbackQuery, state: FSMContext):
+    await state.set_state(CheckoutStates.choosing_product)
+    await callback.message.answer("Напишите, какой товар добавить в заказ.")
+    await callback.answer()
+
+async def cancel_order_callback(callback: types.CallbackQuery, state: FSMContext):
+    await state.clear()
+    await callback.message.answer("Оформление заказа отменено.", reply_markup=get_main_keyboard())
+    await callback.answer()
+
+async def confirm_order_handler(callback: types.CallbackQuery, state: FSMContext):
+    await state.set_state(CheckoutStates.placing)
+    await callback.answer()
+    cart = (await state.get_data()).get("cart", {})
+    
+    try:
+        order = await AsyncOrderCRUD.place_order(callback.from_user.id, list(cart.items()))
+    except OutOfStockError as e:
+        # Товар раскупили, пока покупатель собирал корзину - предлагаем доступное количество
+        product = catalog.index.get(e.sku)
+        name = product["name"] if product else e.sku
+        if e.available > 0:
+            cart[e.sku] = min(cart[e.sku], e.available)
+            text = f"⚠️ {name}: осталось только {e.available} шт., количество в корзине уменьшено."
+        else:
+            cart.pop(e.sku, None)
+            text = f"⚠️ {name} закончился и убран из корзины."
+        await state.update_data(cart=cart)
+        await callback.message.answer(text)
+        await show_cart(callback.message, state, cart)
+        return
+    except Exception as e:
+        metrics.HANDLER_ERRORS.labels("confirm_order_handler").inc()
+        logger.error(f"Error placing order: {e}")
+        await state.set_state(CheckoutStates.confirming)
+        await callback.message.answer("Не удалось оформить заказ. Попробуйте еще раз чуть позже.")
+        return
+    
+    # Поиск и промпты этой реплики видят новые остатки сразу, остальные - после перечитывания каталога
+    catalog.update_stock(order["stock"])
+    await state.clear()
+    await callback.message.answer(
+        f"✅ Заказ №{order['order_id']} оформлен!\n"
+        f"Сумма: <b>{order['total_amount']:.0f} руб.</b>\n"
+        "Менеджер свяжется с вами для подтверждения доставки.",
+        reply_markup=get_main_keyboard()
+    )
+
+async def checkout_step_callback(callback: types.CallbackQuery, state: FSMContext):
+    # Кнопка с другого шага текущего оформления: товар из прошлой выдачи, повторное "Оформить"
+    if await state.get_state() == CheckoutStates.placing.state:
+        await callback.answer("Заказ уже оформляется, подождите немного", show_alert=True)
+    else:
+        await callback.answer("Эта кнопка относится к другому шагу оформления", show_alert=True)
+
+async def stale_cart_callback(callback: types.CallbackQuery):
+    # Кнопка из уже оформленного или отмененного заказа
+    await callback.answer("Эта корзина уже неактуальна", show_alert=True)
+
+async def checkout_reminder_handler(message: types.Message, state: FSMContext):
+    """Сообщение, которого текущий шаг оформления не ждет: текст при подтверждении, фото и т.п."""
+    current = await state.get_state()
+    if current == CheckoutStates.placing.state:
+        await message.answer("⏳ Заказ оформляется, подождите немного.")
+    elif current == CheckoutStates.confirming.state:
+        cart = (await state.get_data()).get("cart", {})
+        if cart:
+            await message.answer("Оформите или отмените заказ кнопками под корзиной.")
+        await show_cart(message, state, cart)
+    else:
+        await message.answer("Напишите ответ текстом или отмените заказ: «❌ Отменить заказ».")
+
+def create_router() -> Router:
+    """Роутер оформления заказа. Роутер подключается только к одному диспетчеру,
+    поэтому каждый create_dispatcher() получает новый.
+    
+    Обработчики проверяются в порядке регистрации: общие для всех шагов - последними.
+    """
+    router = Router(name="orders")
+    router.message.register(order_handler, F.text == "📦 Сделать заказ")
+    router.message.register(order_handler, Command("order"))
+    router.message.register(cancel_order_handler, StateFilter(CheckoutStates), F.text == "❌ Отменить заказ")
+    router.message.register(cancel_order_handler, StateFilter(CheckoutStates), Command("cancel"))
+    router.message.register(choose_product_handler, CheckoutStates.choosing_product, F.text)
+    router.callback_query.register(
+        add_product_handler, CheckoutStates.choosing_product, CartCallback.filter(F.action == "add")
+    )
+    router.message.register(choose_quantity_handler, CheckoutStates.choosing_quantity, F.text)
+    router.callback_query.register(
+        more_products_handler, CheckoutStates.confirming, CartCallback.filter(F.action == "more")
+    )
+    router.callback_query.register(
+        cancel_order_callback, StateFilter(CheckoutStates), CartCallback.filter(F.action == "cancel")
+    )
+    router.callback_query.register(
+        confirm_order_handler, CheckoutStates.confirming, CartCallback.filter(F.action == "confirm")
+    )
+    router.callback_query.register(checkout_step_callback, StateFilter(CheckoutStates), CartCallback.filter())
+    router.callback_query.register(stale_cart_callback, StateFilter(None), CartCallback.filter())
+    router.message.register(checkout_reminder_handler, StateFilter(CheckoutStates))
+    return router
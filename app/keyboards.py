@@ -0,0 +1,16 @@
+from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
+
+def get_main_keyboard():
+    return ReplyKeyboardMarkup(
+        keyboard=[
+            [KeyboardButton(text="🛍️ Консультация по товарам"), KeyboardButton(text="📦 Сделать заказ")],
+            [KeyboardButton(text="❓ Частые вопросы"), KeyboardButton(text="📞 Контакты")]
+        ],
+        resize_keyboard=True
+    )
+
+def get_checkout_keyboard():
+    return ReplyKeyboardMarkup(
+        keyboard=[[KeyboardButton(text="❌ Отменить заказ")]],
+        resize_keyboard=True
+    )
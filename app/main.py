@@ -1,38 +1,47 @@
 import asyncio
 import logging
-from aiogram import Bot, Dispatcher, types, F
-from aiogram.filters import Command
+import time
+from aiohttp import web
+from aiogram import Bot, Dispatcher, Router, types, F
+from aiogram.filters import Command, StateFilter
+from aiogram.fsm.context import FSMContext
 from aiogram.client.default import DefaultBotProperties
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 
 from app.config import config
-from app.database.crud import UserCRUD, OrderCRUD
+from app.database.async_crud import AsyncUserCRUD
+from app.database.executor import run_in_db_thread, shutdown_db_executor
+from app.database.models import db
+from app.database.postgres import pg_db
+from app.database.retention import history_retention
+from app.database.write_behind import write_behind
+from app.services import metrics
 from app.services.llm_service import llm_service
+from app.services.catalog import catalog
+from app.services.metrics import metrics_server
+from app.services.outbound import outbound
+from app.services.broadcast import broadcaster
+from app.services.storage import storage, create_fsm_storage
+from app.services.throttling import throttler
+from app.middlewares.metrics import UpdateMetricsMiddleware, HandlerMetricsMiddleware
+from app.middlewares.outbound import OutboundLimitMiddleware
+from app.middlewares.throttling import ThrottlingMiddleware
+from app.handlers import broadcast, orders
+from app.keyboards import get_main_keyboard
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Инициализация бота
-bot = Bot(token=config.BOT_TOKEN, default=DefaultBotProperties(parse_mode='HTML'))
-dp = Dispatcher()
-
-# Клавиатуры
-from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
-
-def get_main_keyboard():
-    return ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text="🛍️ Консультация по товарам"), KeyboardButton(text="📦 Сделать заказ")],
-            [KeyboardButton(text="❓ Частые вопросы"), KeyboardButton(text="📞 Контакты")]
-        ],
-        resize_keyboard=True
-    )
+# Бот, диспетчер и роутеры создаются в create_bot() и create_dispatcher(): импорт
+# модуля не требует токена и не обращается к БД, хранилищу и сети
 
 # Обработчики
-@dp.message(Command("start"))
-async def start_command(message: types.Message):
+async def start_command(message: types.Message, state: FSMContext):
+    await state.clear()
     user = message.from_user
-    UserCRUD.get_or_create_user(
+    await AsyncUserCRUD.ensure_user(
         user_id=user.id,
         username=user.username,
         first_name=user.first_name,
@@ -52,15 +61,14 @@ async def start_command(message: types.Message):
     
     await message.answer(welcome_text, reply_markup=get_main_keyboard())
 
-@dp.message(F.text == "🛍️ Консультация по товарам")
-async def consultation_handler(message: types.Message):
+async def consultation_handler(message: types.Message, state: FSMContext):
+    await state.clear()
     await message.answer(
         "Расскажите, какой товар вас интересует? "
         "Я помогу с выбором и отвечу на вопросы!",
         reply_markup=types.ReplyKeyboardRemove()
     )
 
-@dp.message(F.text == "❓ Частые вопросы")
 async def faq_handler(message: types.Message):
     faq_text = """
 🤔 Частые вопросы:
@@ -74,7 +82,6 @@ async def faq_handler(message: types.Message):
     """
     await message.answer(faq_text, reply_markup=get_main_keyboard())
 
-@dp.message(F.text == "📞 Контакты")
 async def contacts_handler(message: types.Message):
     contacts_text = """
 📞 Наши контакты:
@@ -86,44 +93,256 @@ async def contacts_handler(message: types.Message):
     """
     await message.answer(contacts_text, reply_markup=get_main_keyboard())
 
-@dp.message(F.text == "📦 Сделать заказ")
-async def order_handler(message: types.Message):
-    await message.answer(
-        "Для оформления заказа напишите, что вы хотите заказать. "
-        "Я помогу оформить заказ!",
-        reply_markup=types.ReplyKeyboardRemove()
-    )
-
-@dp.message()
-async def handle_all_messages(message: types.Message):
+async def handle_all_messages(message: types.Message, bot: Bot):
     user_id = message.from_user.id
     
     # Создаем/обновляем пользователя
-    UserCRUD.get_or_create_user(
+    await AsyncUserCRUD.ensure_user(
         user_id=user_id,
         username=message.from_user.username,
         first_name=message.from_user.first_name,
         last_name=message.from_user.last_name
     )
     
+    # Типовые вопросы (доставка, оплата, гарантия) - сразу, без LLM
+    answer = await llm_service.quick_answer(user_id, message.text)
+    if answer is not None:
+        await message.answer(answer, reply_markup=get_main_keyboard())
+        return
+    
     # Показываем индикатор набора
     await bot.send_chat_action(chat_id=message.chat.id, action="typing")
     
+    if config.LLM_STREAMING:
+        await answer_streaming(message, user_id)
+        return
+    
     try:
         # Получаем ответ от AI
         response = await llm_service.get_ai_response(user_id, message.text)
+        if response is None:
+            # Сообщение объединено с вопросом, ответ на который еще готовится
+            return
         await message.answer(response, reply_markup=get_main_keyboard())
         
     except Exception as e:
+        # Исключение не доходит до HandlerMetricsMiddleware - считаем здесь
+        metrics.HANDLER_ERRORS.labels("handle_all_messages").inc()
         logger.error(f"Error processing message: {e}")
         await message.answer(
             "Извините, произошла ошибка. Попробуйте позже.",
             reply_markup=get_main_keyboard()
         )
 
+async def send_answer(message: types.Message, text: str) -> types.Message:
+    """Отправка первого фрагмента ответа; незакрытая разметка - как обычный текст"""
+    try:
+        return await message.answer(text, reply_markup=get_main_keyboard())
+    except TelegramBadRequest as e:
+        if "can't parse entities" not in str(e):
+            raise
+        return await message.answer(text, reply_markup=get_main_keyboard(), parse_mode=None)
+
+async def edit_answer(answer: types.Message, text: str, final: bool = False) -> bool:
+    """Редактирование ответа с учетом ограничений Telegram. Возвращает True, если текст обновлен"""
+    try:
+        await answer.edit_text(text)
+        return True
+    except TelegramRetryAfter as e:
+        if not final:
+            # Промежуточное обновление можно пропустить
+            return False
+        await asyncio.sleep(e.retry_after)
+        return await edit_answer(answer, text, final=True)
+    except TelegramBadRequest as e:
+        if "message is not modified" in str(e):
+            return True
+        if "can't parse entities" in str(e):
+            # Незакрытая HTML-разметка в частичном ответе - отправляем как обычный текст
+            await answer.edit_text(text, parse_mode=None)
+            return True
+        raise
+
+async def answer_streaming(message: types.Message, user_id: int):
+    """Ответ с постепенным обновлением одного сообщения по мере генерации"""
+    loop = asyncio.get_running_loop()
+    answer = None
+    shown_text = ""
+    text = None
+    last_edit = 0.0
+    stream = llm_service.stream_ai_response(user_id, message.text)
+    
+    try:
+        try:
+            async for text in stream:
+                if not text.strip():
+                    continue
+                
+                if answer is None:
+                    # Первый фрагмент - отправляем сообщение, дальше только редактируем
+                    answer = await send_answer(message, text)
+                    shown_text = text
+                    last_edit = loop.time()
+                elif loop.time() - last_edit >= config.STREAM_EDIT_INTERVAL:
+                    if await edit_answer(answer, text):
+                        shown_text = text
+                    last_edit = loop.time()
+        finally:
+            # При ошибке отправки генератор иначе держит ход пользователя и слот LLM до сборки мусора
+            await stream.aclose()
+        
+        if text is None:
+            # Сообщение объединено с вопросом, ответ на который еще готовится
+            return
+        
+        if answer is None:
+            await message.answer(
+                "Извините, произошла ошибка. Попробуйте позже.",
+                reply_markup=get_main_keyboard()
+            )
+        elif text != shown_text:
+            await edit_answer(answer, text, final=True)
+    
+    except Exception as e:
+        metrics.HANDLER_ERRORS.labels("handle_all_messages").inc()
+        logger.error(f"Error processing message: {e}")
+        if answer is None:
+            await message.answer(
+                "Извините, произошла ошибка. Попробуйте позже.",
+                reply_markup=get_main_keyboard()
+            )
+
+async def on_startup(bot: Bot, dispatcher: Dispatcher):
+    started = time.perf_counter()
+    if config.METRICS_ENABLED:
+        await metrics_server.start()
+    
+    # Независимые шаги подготовки - одновременно: индекс ответов загружается, пока читается
+    # каталог. Каталог ждет миграций сам - первое обращение к БД их дожидается
+    steps = [llm_service.start()]
+    if db is not None:
+        # Схема и миграции до приема апдейтов
+        steps.append(run_in_db_thread(db.open))
+    if pg_db is not None:
+        steps.append(pg_db.pool())
+    if config.CATALOG_ENABLED:
+        steps.append(catalog.load())
+    await asyncio.gather(*steps)
+    
+    if config.CATALOG_ENABLED:
+        catalog.start()
+    history_retention.start()
+    if config.WRITE_BEHIND_ENABLED:
+        write_behind.start()
+    
+    if config.BOT_MODE == "webhook":
+        # Каждая реплика регистрирует один и тот же адрес балансировщика
+        await bot.set_webhook(
+            f"{config.WEBHOOK_BASE_URL}{config.WEBHOOK_PATH}",
+            secret_token=config.WEBHOOK_SECRET or None,
+            allowed_updates=dispatcher.resolve_used_update_types()
+        )
+    logger.info(f"Bot is ready in {time.perf_counter() - started:.2f}s")
+
+async def on_shutdown(bot: Bot):
+    await broadcaster.stop()
+    await catalog.stop()
+    await history_retention.stop()
+    await llm_service.close()
+    # Дописываем очередь до остановки потоков БД
+    await write_behind.stop()
+    shutdown_db_executor()
+    if pg_db is not None:
+        await pg_db.close()
+    await storage.close()
+    await metrics_server.stop()
+
+def create_bot() -> Bot:
+    """Бот с сессией Bot API; соединение открывается при первом запросе"""
+    bot = Bot(token=config.BOT_TOKEN, default=DefaultBotProperties(parse_mode='HTML'))
+    if config.OUTBOUND_LIMIT_ENABLED:
+        # Все исходящие сообщения, включая message.answer в обработчиках, - через лимиты Telegram
+        bot.session.middleware(OutboundLimitMiddleware(
+            outbound,
+            max_retries=config.OUTBOUND_MAX_RETRIES,
+            max_retry_wait=config.OUTBOUND_RETRY_MAX_WAIT
+        ))
+    return bot
+
+def create_router() -> Router:
+    """Роутер команд и кнопок главного меню; новый на каждый диспетчер"""
+    router = Router(name="main")
+    router.message.register(start_command, Command("start"))
+    router.message.register(consultation_handler, F.text == "🛍️ Консультация по товарам")
+    router.message.register(faq_handler, F.text == "❓ Частые вопросы")
+    router.message.register(contacts_handler, F.text == "📞 Контакты")
+    return router
+
+def create_fallback_router() -> Router:
+    """Свободный текст вне оформления заказа - консультанту: роутер подключается последним"""
+    router = Router(name="fallback")
+    router.message.register(handle_all_messages, StateFilter(None))
+    return router
+
+def create_dispatcher() -> Dispatcher:
+    """Диспетчер с обработчиками, middleware и хуками запуска и остановки.
+    
+    БД, LLM-провайдеры, каталог и фоновые задачи готовятся в on_startup, а не при импорте.
+    Роутер подключается только к одному диспетчеру, поэтому роутеры создаются заново.
+    """
+    # Состояния диалогов (оформление заказа) - в общем хранилище, если реплик несколько
+    dp = Dispatcher(storage=create_fsm_storage())
+    dp.update.outer_middleware(UpdateMetricsMiddleware())
+    if config.THROTTLE_ENABLED:
+        # Флуд отбрасывается до обработчиков: без обращений к БД и LLM
+        dp.update.outer_middleware(ThrottlingMiddleware(throttler))
+    dp.message.middleware(HandlerMetricsMiddleware())
+    dp.callback_query.middleware(HandlerMetricsMiddleware())
+    
+    # Кнопки главного меню проверяются раньше шагов оформления заказа
+    dp.include_router(create_router())
+    dp.include_router(broadcast.create_router())
+    dp.include_router(orders.create_router())
+    dp.include_router(create_fallback_router())
+    
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+    return dp
+
+def create_webhook_app(dp: Dispatcher = None, bot: Bot = None) -> web.Application:
+    """aiohttp-приложение, принимающее апдейты от Telegram на WEBHOOK_PATH"""
+    dp = dp or create_dispatcher()
+    bot = bot or create_bot()
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=config.WEBHOOK_SECRET or None
+    ).register(app, path=config.WEBHOOK_PATH)
+    # Запуск и остановка приложения вызывают startup/shutdown диспетчера
+    setup_application(app, dp, bot=bot)
+    return app
+
+async def run_webhook():
+    if not config.WEBHOOK_BASE_URL:
+        raise Exception("WEBHOOK_BASE_URL is not configured")
+    
+    runner = web.AppRunner(create_webhook_app())
+    await runner.setup()
+    site = web.TCPSite(runner, config.WEBAPP_HOST, config.WEBAPP_PORT)
+    await site.start()
+    logger.info(f"Webhook server listening on {config.WEBAPP_HOST}:{config.WEBAPP_PORT}{config.WEBHOOK_PATH}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
 async def main():
-    logger.info("Starting bot...")
-    await dp.start_polling(bot)
+    logger.info(f"Starting bot in {config.BOT_MODE} mode...")
+    if config.BOT_MODE == "webhook":
+        await run_webhook()
+    else:
+        await create_dispatcher().start_polling(create_bot())
 
 if __name__ == "__main__":
     asyncio.run(main())
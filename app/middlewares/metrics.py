@@ -0,0 +1,41 @@
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from app.services import metrics
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Счетчик апдейтов и число апдейтов в обработке (outer-middleware на dp.update)"""
+    
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        metrics.UPDATES.labels(event.event_type).inc()
+        with metrics.UPDATES_IN_FLIGHT.track_inprogress():
+            return await handler(event, data)
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Время работы и ошибки обработчиков (inner-middleware на dp.message и dp.callback_query)"""
+    
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            metrics.HANDLER_ERRORS.labels(name).inc()
+            raise
+        finally:
+            metrics.HANDLER_LATENCY.labels(name).observe(time.perf_counter() - started)
@@ -0,0 +1,52 @@
+import logging
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+
+from app.services import metrics
+from app.services.outbound import OutboundScheduler
+
+logger = logging.getLogger(__name__)
+
+class OutboundLimitMiddleware(BaseRequestMiddleware):
+    """Лимиты Telegram на исходящие сообщения (request-middleware сессии бота: bot.session.middleware)"""
+    
+    # Индикатор набора не расходует лимит сообщений
+    UNLIMITED_METHODS = {"SendChatAction"}
+    # Промежуточные правки потокового ответа вызывающий код при RetryAfter пропускает сам
+    NO_RETRY_METHODS = {"EditMessageText"}
+    
+    def __init__(self, scheduler: OutboundScheduler, max_retries: int = 2, max_retry_wait: float = 30):
+        self.scheduler = scheduler
+        self.max_retries = max_retries
+        self.max_retry_wait = max_retry_wait
+    
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot,
+        method: TelegramMethod[TelegramType]
+    ) -> Response[TelegramType]:
+        name = type(method).__name__
+        chat_id = getattr(method, "chat_id", None)
+        # Методы без чата (getUpdates, answerCallbackQuery, setWebhook) не ограничиваются
+        if chat_id is None or name in self.UNLIMITED_METHODS:
+            return await make_request(bot, method)
+        
+        attempt = 0
+        while True:
+            await self.scheduler.acquire(chat_id)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                metrics.OUTBOUND_RETRY_AFTER.labels(name).inc()
+                # Следующие запросы в чат подождут, даже если этот не повторяем
+                self.scheduler.pause(chat_id, e.retry_after)
+                attempt += 1
+                if (name in self.NO_RETRY_METHODS or attempt > self.max_retries
+                        or e.retry_after > self.max_retry_wait):
+                    raise
+                logger.warning(f"Telegram flood control on {name} in chat {chat_id}, "
+                               f"retrying in {e.retry_after}s")
@@ -0,0 +1,64 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from app.services import metrics
+from app.services.throttling import Throttler
+
+logger = logging.getLogger(__name__)
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Антифлуд до обработчиков, БД и LLM (outer-middleware на dp.update, после UserContextMiddleware)"""
+    
+    WARNING = "⏳ Слишком много сообщений. Подождите немного и повторите вопрос."
+    
+    def __init__(self, throttler: Throttler):
+        self.throttler = throttler
+    
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get("event_from_user")
+        chat = data.get("event_chat")
+        user_id = user.id if user is not None else None
+        chat_id = chat.id if chat is not None and chat.type != "private" else None
+        
+        now = asyncio.get_running_loop().time()
+        delay, scope = self.throttler.reserve(user_id, chat_id, now)
+        if delay is None:
+            return await self._drop(event, data, scope, user_id, chat_id, now)
+        
+        if self.throttler.shared is not None:
+            # Лимиты реплики пройдены - проверяем общие для всех реплик
+            exceeded = await self.throttler.reserve_shared(user_id, chat_id)
+            if exceeded is not None:
+                return await self._drop(event, data, exceeded, user_id, chat_id, now)
+        
+        if delay:
+            metrics.THROTTLED.labels(scope, "delayed").inc()
+            await asyncio.sleep(delay)
+        return await handler(event, data)
+    
+    async def _drop(self, event: Update, data: Dict[str, Any], scope: str, user_id, chat_id, now: float):
+        """Апдейт отбрасывается; отправителю - предупреждение, не чаще раза в max_delay"""
+        metrics.THROTTLED.labels(scope, "dropped").inc()
+        if self.throttler.should_warn(user_id if scope == "user" else chat_id, now):
+            await self._warn(event, data)
+        return None
+    
+    async def _warn(self, event: Update, data: Dict[str, Any]):
+        """Сообщение отправителю, что его апдейты отбрасываются"""
+        try:
+            if event.callback_query is not None:
+                # Иначе кнопка останется в состоянии загрузки
+                await event.callback_query.answer(self.WARNING)
+            elif event.message is not None:
+                await data["bot"].send_message(event.message.chat.id, self.WARNING)
+        except Exception as e:
+            logger.warning(f"Throttling warning was not delivered: {e}")
@@ -0,0 +1,328 @@
+import asyncio
+import hashlib
+import json
+import logging
+import mmap
+import os
+import re
+import zlib
+
+import numpy as np
+
+from app.config import config
+from app.services.response_cache import ResponseCache
+
+logger = logging.getLogger(__name__)
+
+# Слова с цифрами или латиницей - модели, бренды, цены. Вопросы, различающиеся только ими
+# ("iPhone 15" и "iPhone 13", "до 50000" и "до 150000"), близки по триграммам, но требуют разных ответов
+KEY_CHARS = re.compile(r"[0-9a-z]")
+
+def _features(text: str) -> list:
+    """Признаки вопроса: слова и символьные триграммы с границами слов"""
+    text = ResponseCache.normalize(text)
+    padded = f" {text} "
+    return text.split() + [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+def key_tokens(text: str) -> frozenset:
+    """Модели, бренды и числа вопроса"""
+    return frozenset(word for word in ResponseCache.normalize(text).split() if KEY_CHARS.search(word))
+
+def embed(texts: list, dim: int) -> np.ndarray:
+    """Векторы вопросов (хэширование признаков со знаком), нормированные по длине.
+    
+    Опечатки, порядок слов и окончания меняют лишь часть триграмм, поэтому
+    близкие формулировки получают близкие векторы.
+    """
+    rows, columns, signs = [], [], []
+    for row, text in enumerate(texts):
+        for feature in _features(text):
+            h = zlib.crc32(feature.encode())
+            rows.append(row)
+            columns.append(h % dim)
+            signs.append(1.0 if h & 0x80000000 else -1.0)
+    
+    matrix = np.zeros((len(texts), dim), dtype=np.float32)
+    np.add.at(matrix, (rows, columns), signs)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix
+
+def context_key(system_prompt: str) -> int:
+    """Ключ контекста ответа: ответ переиспользуется только при тех же товарах и ценах в промпте"""
+    return int(hashlib.sha1(system_prompt.encode()).hexdigest()[:15], 16)
+
+class AnswerIndex:
+    """Индекс прошлых вопросов и ответов консультанта для поиска похожих вопросов.
+    
+    Векторы лежат одной матрицей float32 в файле, отображенном в память (path.vectors),
+    пары вопрос-ответ - строками JSON в path.jsonl; в памяти только смещения строк
+    и ключи контекста. Новые пары дописываются в конец, файл векторов растет удвоением.
+    Одновременные поиски объединяются в один батч: матрица читается один раз на батч.
+    Файлы принадлежат одной реплике - у каждой реплики свой path.
+    """
+    
+    # Строк матрицы на один шаг поиска - промежуточные оценки помещаются в кэш
+    BLOCK_ROWS = 65536
+    # Конец строки path.jsonl: ключ контекста add_many пишет последним
+    CONTEXT_PATTERN = re.compile(rb'"c": (-?\d+)\}\n')
+    
+    def __init__(self, path: str, dim: int = 256, answer_threshold: float = 0.9,
+                 context_threshold: float = 0.5, context_items: int = 2, initial_capacity: int = 1024):
+        self.path = path
+        self.dim = dim
+        self.answer_threshold = answer_threshold
+        self.context_threshold = context_threshold
+        self.context_items = context_items
+        self.initial_capacity = initial_capacity
+        
+        self.count = 0
+        self._capacity = 0
+        self._vectors = None
+        self._offsets = np.zeros(0, dtype=np.int64)
+        self._contexts = np.zeros(0, dtype=np.int64)
+        self._end = 0
+        self._fd = None
+        
+        self._pending = []
+        self._worker = None
+    
+    def __len__(self):
+        return self.count
+    
+    @property
+    def vectors_path(self) -> str:
+        return f"{self.path}.vectors"
+    
+    @property
+    def entries_path(self) -> str:
+        return f"{self.path}.jsonl"
+    
+    def open(self):
+        """Загрузка индекса с диска; файлы создаются, если их нет"""
+        if self._fd is not None:
+            return
+        
+        offsets, contexts, position = self._read_entries()
+        
+        # Вектор пишется раньше строки: векторов без строки быть может, наоборот - нет
+        rows = os.path.getsize(self.vectors_path) // (self.dim * 4) if os.path.exists(self.vectors_path) else 0
+        if rows < len(offsets):
+            raise Exception(f"Answer index {self.vectors_path} is shorter than {self.entries_path}: "
+                            f"rebuild it with build_answer_index.py (ANSWER_INDEX_DIM={self.dim}?)")
+        
+        self._fd = os.open(self.entries_path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        os.ftruncate(self._fd, position)
+        self._end = position
+        self._ensure_capacity(max(rows, len(offsets)))
+        self._offsets[:len(offsets)] = offsets
+        self._contexts[:len(contexts)] = contexts
+        self.count = len(offsets)
+        logger.info(f"Answer index loaded: {self.count} answers")
+    
+    def _read_entries(self) -> tuple:
+        """Смещения строк path.jsonl, их ключи контекста и длина целой части файла.
+        
+        Строки не разбираются по одной: концы строк ищет NumPy, ключи - одно регулярное
+        выражение по всему файлу. Недописанная строка после сбоя отбрасывается.
+        """
+        empty = np.zeros(0, dtype=np.int64)
+        if not os.path.exists(self.entries_path) or not os.path.getsize(self.entries_path):
+            return empty, empty, 0
+        
+        with open(self.entries_path, "rb") as entries, \
+                mmap.mmap(entries.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            ends = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == ord("\n")) + 1
+            contexts = np.array([int(c) for c in self.CONTEXT_PATTERN.findall(data)], dtype=np.int64)
+            if len(contexts) != len(ends):
+                raise Exception(f"Answer index {self.entries_path} is damaged: rebuild it with build_answer_index.py")
+            
+            # Сбой мог оборвать запись и на границе строки - проверяем последнюю целиком
+            if len(ends):
+                try:
+                    json.loads(data[ends[-2] if len(ends) > 1 else 0:ends[-1]])
+                except ValueError:
+                    ends, contexts = ends[:-1], contexts[:-1]
+        
+        offsets = np.concatenate(([0], ends[:-1])) if len(ends) else empty
+        return offsets, contexts, int(ends[-1]) if len(ends) else 0
+    
+    async def load(self):
+        loop = asyncio.get_running_loop()
+        # Чтение смещений большого файла - не на event loop
+        await loop.run_in_executor(None, self.open)
+    
+    def close(self):
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._vectors = None
+            self._capacity = 0
+            # Запас под рост на диске не храним: при открытии файл снова растет удвоением
+            os.truncate(self.vectors_path, self.count * self.dim * 4)
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+    
+    def _ensure_capacity(self, rows: int):
+        if rows <= self._capacity and self._vectors is not None:
+            return
+        
+        capacity = max(rows, self._capacity * 2, self.initial_capacity)
+        if self._vectors is not None:
+            self._vectors.flush()
+        if not os.path.exists(self.vectors_path):
+            open(self.vectors_path, "wb").close()
+        if os.path.getsize(self.vectors_path) < capacity * self.dim * 4:
+            os.truncate(self.vectors_path, capacity * self.dim * 4)
+        
+        # Прежнее отображение остается действительным для поиска, начатого до роста
+        self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+        for name in ("_offsets", "_contexts"):
+            grown = np.zeros(capacity, dtype=np.int64)
+            grown[:self.count] = getattr(self, name)[:self.count]
+            setattr(self, name, grown)
+        self._capacity = capacity
+    
+    def add_many(self, questions: list, answers: list, contexts: list):
+        """Добавление пар вопрос-ответ; contexts - ключи context_key (0 - контекст неизвестен)"""
+        if not questions:
+            return
+        if self._fd is None:
+            self.open()
+        
+        start = self.count
+        end = start + len(questions)
+        self._ensure_capacity(end)
+        self._vectors[start:end] = embed(questions, self.dim)
+        
+        lines = [
+            json.dumps({"q": q, "a": a, "c": c}, ensure_ascii=False).encode() + b"\n"
+            for q, a, c in zip(questions, answers, contexts)
+        ]
+        os.write(self._fd, b"".join(lines))
+        for i, line in enumerate(lines):
+            self._offsets[start + i] = self._end
+            self._end += len(line)
+        self._contexts[start:end] = contexts
+        
+        # Поиск видит новые строки только после того, как они записаны целиком
+        self.count = end
+    
+    def add(self, question: str, answer: str, context: int = 0):
+        self.add_many([question], [answer], [context])
+    
+    def entry(self, entry_id: int) -> dict:
+        """Пара вопрос-ответ по номеру: {"q", "a", "c"}"""
+        end = self._offsets[entry_id + 1] if entry_id + 1 < self.count else self._end
+        start = self._offsets[entry_id]
+        return json.loads(os.pread(self._fd, int(end - start), int(start)))
+    
+    def search_vectors(self, queries: np.ndarray, k: int) -> tuple:
+        """Косинусная близость батча запросов ко всем вопросам индекса.
+        
+        Возвращает (scores, ids) формы (len(queries), k), от ближайших к дальним.
+        """
+        count = self.count
+        vectors = self._vectors
+        k = min(k, count)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        best_ids = np.empty((len(queries), 0), dtype=np.int64)
+        
+        for start in range(0, count, self.BLOCK_ROWS):
+            block = vectors[start:min(start + self.BLOCK_ROWS, count)]
+            scores = queries @ block.T
+            # Лучшие k блока объединяем с лучшими k предыдущих блоков
+            top = np.argpartition(scores, -min(k, scores.shape[1]), axis=1)[:, -k:]
+            best_scores = np.concatenate([best_scores, np.take_along_axis(scores, top, axis=1)], axis=1)
+            best_ids = np.concatenate([best_ids, top + start], axis=1)
+            if best_scores.shape[1] > k:
+                top = np.argpartition(best_scores, -k, axis=1)[:, -k:]
+                best_scores = np.take_along_axis(best_scores, top, axis=1)
+                best_ids = np.take_along_axis(best_ids, top, axis=1)
+        
+        order = np.argsort(-best_scores, axis=1)
+        return np.take_along_axis(best_scores, order, axis=1), np.take_along_axis(best_ids, order, axis=1)
+    
+    def search_many(self, texts: list, k: int) -> list:
+        """Для каждого текста - список (близость, номер) ближайших вопросов"""
+        if not self.count or not texts:
+            return [[] for _ in texts]
+        scores, ids = self.search_vectors(embed(texts, self.dim), k)
+        return [list(zip(row_scores.tolist(), row_ids.tolist())) for row_scores, row_ids in zip(scores, ids)]
+    
+    async def search(self, text: str, k: int = 5) -> list:
+        """Ближайшие вопросы; одновременные поиски выполняются одним батчем в пуле потоков"""
+        if not self.count:
+            return []
+        
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((text, k, future))
+        if self._worker is None:
+            self._worker = asyncio.ensure_future(self._drain())
+        return await future
+    
+    async def _drain(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while self._pending:
+                batch, self._pending = self._pending, []
+                k = max(item[1] for item in batch)
+                try:
+                    # Умножение матриц в NumPy отпускает GIL - event loop не блокируется
+                    results = await loop.run_in_executor(None, self.search_many, [item[0] for item in batch], k)
+                except Exception as e:
+                    for _, _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                for (_, item_k, future), found in zip(batch, results):
+                    if not future.done():
+                        future.set_result(found[:item_k])
+        finally:
+            self._worker = None
+    
+    async def match(self, question: str, context: int = 0) -> tuple:
+        """(готовый ответ или None, похожие пары для промпта); при context=0 только похожие пары"""
+        found = await self.search(question, max(self.context_items, 5))
+        
+        answer = None
+        keys = None
+        for score, entry_id in found:
+            if not context or score < self.answer_threshold:
+                break
+            # Ответ с другими товарами или ценами в промпте мог устареть
+            if self._contexts[entry_id] != context:
+                continue
+            entry = self.entry(entry_id)
+            if keys is None:
+                keys = key_tokens(question)
+            # Близость не различает модели и суммы - они должны совпасть точно
+            if key_tokens(entry["q"]) == keys:
+                answer = entry["a"]
+                break
+        
+        neighbours = [
+            self.entry(entry_id) for score, entry_id in found[:self.context_items]
+            if score >= self.context_threshold
+        ]
+        return answer, neighbours
+    
+    @staticmethod
+    def prompt_context(neighbours: list) -> str:
+        """Похожие вопросы с ответами для системного промпта или пустая строка"""
+        if not neighbours:
+            return ""
+        
+        lines = ["Похожие вопросы клиентов и ответы консультанта (используй как образец, "
+                 "цены и наличие проверяй по каталогу):"]
+        for entry in neighbours:
+            lines.append(f"- Вопрос: {entry['q'][:200]}\n  Ответ: {entry['a'][:400]}")
+        return "\n".join(lines)
+
+answer_index = AnswerIndex(
+    config.ANSWER_INDEX_PATH,
+    dim=config.ANSWER_INDEX_DIM,
+    answer_threshold=config.ANSWER_INDEX_THRESHOLD,
+    context_threshold=config.ANSWER_INDEX_CONTEXT_THRESHOLD,
+    context_items=config.ANSWER_INDEX_CONTEXT_ITEMS
+)
@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError
+
+from app.config import config
+from app.database.async_crud import AsyncUserCRUD
+from app.services import metrics
+from app.services.outbound import outbound
+
+logger = logging.getLogger(__name__)
+
+class Broadcaster:
+    """Рассылка сообщения всем пользователям из таблицы users.
+    
+    Получатели читаются страницами по id: таблица в память целиком не загружается,
+    следующая страница читается, пока отправляется текущая. Сообщения уходят
+    с приоритетом рассылки - ответы пользователям проходят лимиты Telegram первыми.
+    Одновременно идет одна рассылка.
+    """
+    
+    def __init__(self, page_size: int = 1000, concurrency: int = 30):
+        self.page_size = page_size
+        self.concurrency = concurrency
+        self.progress = None
+        self._task = None
+    
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+    
+    def start(self, bot: Bot, text: str, report_chat_id: int = None) -> bool:
+        """Запуск рассылки в фоне; False, если предыдущая еще не закончилась"""
+        if self.running:
+            return False
+        self._task = asyncio.ensure_future(self._run(bot, text, report_chat_id))
+        return True
+    
+    async def stop(self):
+        if self.running:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+    
+    async def _run(self, bot: Bot, text: str, report_chat_id: int):
+        try:
+            await self.run(bot, text)
+        except Exception as e:
+            logger.error(f"Broadcast failed: {e}")
+            self.progress["error"] = str(e)
+        
+        if report_chat_id is not None:
+            try:
+                await bot.send_message(report_chat_id, self.report(), parse_mode=None)
+            except Exception as e:
+                logger.error(f"Broadcast report was not delivered: {e}")
+    
+    async def run(self, bot: Bot, text: str) -> dict:
+        """Отправка text всем пользователям; возвращает статистику доставки"""
+        stats = self.progress = {
+            "sent": 0, "blocked": 0, "failed": 0,
+            "started": time.perf_counter(), "finished": None
+        }
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks = set()
+        next_page = None
+        
+        def done(task):
+            tasks.discard(task)
+            semaphore.release()
+        
+        # Задачи отправки наследуют приоритет рассылки из контекста
+        with outbound.bulk():
+            try:
+                page = await AsyncUserCRUD.get_user_ids_after(0, self.page_size)
+                while page:
+                    next_page = asyncio.ensure_future(AsyncUserCRUD.get_user_ids_after(page[-1], self.page_size))
+                    for user_id in page:
+                        await semaphore.acquire()
+                        task = asyncio.ensure_future(self._send(bot, user_id, text, stats))
+                        tasks.add(task)
+                        task.add_done_callback(done)
+                    page = await next_page
+                if tasks:
+                    await asyncio.gather(*tasks)
+            finally:
+                # Остановка бота: недоставленное не досылаем
+                for task in list(tasks) + [next_page]:
+                    if task is not None and not task.done():
+                        task.cancel()
+                stats["finished"] = time.perf_counter()
+        
+        logger.info(f"Broadcast finished: {self.report()}")
+        return stats
+    
+    @staticmethod
+    async def _send(bot: Bot, user_id: int, text: str, stats: dict):
+        try:
+            await bot.send_message(user_id, text)
+            result = "sent"
+        except TelegramForbiddenError:
+            # Пользователь заблокировал бота
+            result = "blocked"
+        except Exception as e:
+            logger.warning(f"Broadcast to {user_id} failed: {e}")
+            result = "failed"
+        stats[result] += 1
+        metrics.BROADCAST_MESSAGES.labels(result).inc()
+    
+    def report(self) -> str:
+        """Ход или итог последней рассылки"""
+        stats = self.progress
+        if stats is None:
+            return "Рассылок еще не было"
+        
+        elapsed = (stats["finished"] or time.perf_counter()) - stats["started"]
+        processed = stats["sent"] + stats["blocked"] + stats["failed"]
+        title = "📣 Рассылка идет" if stats["finished"] is None else "📣 Рассылка завершена"
+        lines = [
+            f"{title}: {processed} получателей за {elapsed:.0f} с ({processed / max(elapsed, 0.001):.1f} сообщ/с)",
+            f"Доставлено: {stats['sent']}, заблокировали бота: {stats['blocked']}, ошибок: {stats['failed']}"
+        ]
+        if "error" in stats:
+            lines.append(f"Рассылка прервана: {stats['error']}")
+        return "\n".join(lines)
+
+broadcaster = Broadcaster(
+    page_size=config.BROADCAST_PAGE_SIZE,
+    concurrency=config.BROADCAST_CONCURRENCY
+)
@@ -0,0 +1,385 @@
+import asyncio
+import bisect
+import heapq
+import logging
+import math
+import re
+from functools import lru_cache
+from itertools import islice
+
+from app.config import config
+from app.database.crud import ProductCRUD
+from app.database.executor import run_query
+
+logger = logging.getLogger(__name__)
+
+# Стеммер Портера для русского языка (упрощенный Snowball)
+_PERFECTIVE_GERUND = re.compile(r"((ив|ивши|ившись|ыв|ывши|ывшись)|((?<=[ая])(в|вши|вшись)))$")
+_REFLEXIVE = re.compile(r"(с[яь])$")
+_ADJECTIVE = re.compile(r"(ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому|их|ых|ую|юю|ая|яя|ою|ею)$")
+_PARTICIPLE = re.compile(r"((ивш|ывш|ующ)|((?<=[ая])(ем|нн|вш|ющ|щ)))$")
+_VERB = re.compile(r"((ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло|ено|ят|ует|уют|ит|ыт|ены|ить|ыть|ишь|ую|ю)|((?<=[ая])(ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют|ны|ть|ешь|нно)))$")
+_NOUN = re.compile(r"(а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем|ам|ом|о|у|ах|иях|ях|ы|ь|ию|ью|ю|ия|ья|я)$")
+_RV = re.compile(r"^(.*?[аеиоуыэюя])(.*)$")
+_DERIVATIONAL = re.compile(r".*[^аеиоуыэюя]+[аеиоуыэюя].*ость?$")
+_DER = re.compile(r"ость?$")
+_SUPERLATIVE = re.compile(r"(ейше|ейш)$")
+
+_TOKEN = re.compile(r"[a-zа-я0-9]+")
+
+# Ценовые ограничения в запросе: "до 30000", "дешевле 20 тыс", "от 10к"
+_PRICE = r"\s*(\d+(?:\s\d{3})*)(?:(к)\b|\s*(тыс\w*))?"
+_MAX_PRICE = re.compile(r"\b(?:до|дешевле|не дороже|не больше|максимум)" + _PRICE)
+_MIN_PRICE = re.compile(r"\b(?:от|дороже|не дешевле|минимум)" + _PRICE)
+
+STOP_WORDS = {
+    "и", "в", "во", "на", "с", "со", "по", "для", "до", "от", "за", "к", "у", "о", "об", "из", "не",
+    "а", "но", "или", "ли", "же", "бы", "то", "что", "как", "какой", "какая", "какие", "какое",
+    "есть", "мне", "вас", "нас", "я", "вы", "это", "этот", "хочу", "нужен", "нужна", "нужно",
+    "нужны", "посоветуйте", "подскажите", "покажите", "купить", "выбрать", "рублей", "руб", "р",
+    "тыс", "привет", "здравствуйте", "пожалуйста", "можно", "хороший", "лучший",
+}
+
+@lru_cache(maxsize=100000)
+def stem(word: str) -> str:
+    match = _RV.match(word)
+    if not match:
+        return word
+    prefix, rv = match.groups()
+    
+    temp = _PERFECTIVE_GERUND.sub("", rv, 1)
+    if temp == rv:
+        rv = _REFLEXIVE.sub("", rv, 1)
+        temp = _ADJECTIVE.sub("", rv, 1)
+        if temp != rv:
+            rv = _PARTICIPLE.sub("", temp, 1)
+        else:
+            temp = _VERB.sub("", rv, 1)
+            rv = _NOUN.sub("", rv, 1) if temp == rv else temp
+    else:
+        rv = temp
+    
+    if rv.endswith("и"):
+        rv = rv[:-1]
+    if _DERIVATIONAL.match(rv):
+        rv = _DER.sub("", rv, 1)
+    if rv.endswith("ь"):
+        rv = rv[:-1]
+    else:
+        rv = _SUPERLATIVE.sub("", rv, 1)
+        if rv.endswith("нн"):
+            rv = rv[:-1]
+    return prefix + rv
+
+def tokenize(text: str) -> list:
+    """Основы слов текста без стоп-слов"""
+    if not text:
+        return []
+    words = _TOKEN.findall(text.lower().replace("ё", "е"))
+    return [stem(word) for word in words if word not in STOP_WORDS]
+
+def _parse_price(number: str, multiplier: str) -> float:
+    value = float(number.replace(" ", ""))
+    return value * 1000 if multiplier else value
+
+def parse_query(text: str) -> dict:
+    """Разбор запроса: слова и ценовые ограничения"""
+    text = text.lower()
+    min_price = max_price = None
+    
+    match = _MAX_PRICE.search(text)
+    if match:
+        max_price = _parse_price(match.group(1), match.group(2) or match.group(3))
+        text = text[:match.start()] + " " + text[match.end():]
+    
+    match = _MIN_PRICE.search(text)
+    if match:
+        min_price = _parse_price(match.group(1), match.group(2) or match.group(3))
+        text = text[:match.start()] + " " + text[match.end():]
+    
+    return {"terms": tokenize(text), "min_price": min_price, "max_price": max_price}
+
+def _to_bitmap(doc_ids, size: int) -> bytes:
+    """Битовая карта из номеров товаров (бит doc_id установлен у каждого номера)"""
+    bits = bytearray((size >> 3) + 1)
+    for doc_id in doc_ids:
+        bits[doc_id >> 3] |= 1 << (doc_id & 7)
+    return bytes(bits)
+
+def _to_mask(doc_ids, size: int) -> int:
+    return int.from_bytes(_to_bitmap(doc_ids, size), "little")
+
+def _range_mask(start: int, end: int) -> int:
+    return ((1 << end) - 1) ^ ((1 << start) - 1)
+
+def _iter_bits(mask: int):
+    """Номера установленных битов по возрастанию"""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+def _contains(posting, doc_id: int) -> bool:
+    """Проверка номера во множестве или в битовой карте за O(1)"""
+    if isinstance(posting, bytes):
+        return posting[doc_id >> 3] >> (doc_id & 7) & 1 == 1
+    return doc_id in posting
+
+class CatalogIndex:
+    """Неизменяемый инвертированный индекс каталога.
+    
+    Номера товаров назначаются по статическому рангу: сначала товары в наличии,
+    внутри группы - по возрастанию цены. Поэтому при равной релевантности
+    выигрывает меньший номер, а ценовой диапазон - это два непрерывных отрезка номеров.
+    Частые слова хранятся битовыми масками (пересечение за микросекунды на любом
+    размере каталога), редкие - множествами номеров.
+    """
+    
+    # Слово считается частым, если встречается хотя бы у 1/DENSE_RATIO товаров
+    DENSE_RATIO = 256
+    
+    def __init__(self, products: list, version: int = 0):
+        self.version = version
+        self.products = sorted(
+            products,
+            key=lambda p: (not p.get("stock"), p.get("price") or 0, p["sku"])
+        )
+        size = len(self.products)
+        self.by_sku = {product["sku"]: doc_id for doc_id, product in enumerate(self.products)}
+        
+        self._in_stock = sum(1 for product in self.products if product.get("stock"))
+        self._prices = [product.get("price") or 0 for product in self.products]
+        
+        # основа слова -> номера товаров (по всем полям и только по названию/бренду/категории)
+        postings, titles = {}, {}
+        categories, brands = {}, {}
+        for doc_id, product in enumerate(self.products):
+            title = set(tokenize(" ".join(filter(None, (
+                product.get("name"), product.get("brand"), product.get("category")
+            )))))
+            for term in title:
+                titles.setdefault(term, []).append(doc_id)
+            for term in title.union(tokenize(product.get("description"))):
+                postings.setdefault(term, []).append(doc_id)
+            
+            if product.get("category"):
+                categories.setdefault(product["category"].lower(), []).append(doc_id)
+            if product.get("brand"):
+                brands.setdefault(product["brand"].lower(), []).append(doc_id)
+        
+        # Для частых слов - маска (пересечения) и битовая карта (проверка одного товара)
+        self._postings, self._title, self._bitmaps = {}, {}, {}
+        for term, doc_ids in postings.items():
+            if len(doc_ids) * self.DENSE_RATIO >= size:
+                bitmap = _to_bitmap(doc_ids, size)
+                title_bitmap = _to_bitmap(titles.get(term, ()), size)
+                self._postings[term] = int.from_bytes(bitmap, "little")
+                self._title[term] = int.from_bytes(title_bitmap, "little")
+                self._bitmaps[term] = (bitmap, title_bitmap)
+            else:
+                self._postings[term] = frozenset(doc_ids)
+                self._title[term] = frozenset(titles.get(term, ()))
+        self._df = {term: len(doc_ids) for term, doc_ids in postings.items()}
+        
+        self._categories = {name: _to_mask(ids, size) for name, ids in categories.items()}
+        self._brands = {name: _to_mask(ids, size) for name, ids in brands.items()}
+    
+    def __len__(self) -> int:
+        return len(self.products)
+    
+    def get(self, sku: str):
+        doc_id = self.by_sku.get(sku)
+        return self.products[doc_id] if doc_id is not None else None
+    
+    def _price_mask(self, min_price: float, max_price: float, in_stock: bool) -> int:
+        """Маска товаров в ценовом диапазоне: отрезок среди товаров в наличии и среди остальных"""
+        low = -math.inf if min_price is None else min_price
+        high = math.inf if max_price is None else max_price
+        
+        mask = 0
+        groups = [(0, self._in_stock)] if in_stock else [(0, self._in_stock), (self._in_stock, len(self.products))]
+        for start, end in groups:
+            left = bisect.bisect_left(self._prices, low, start, end)
+            right = bisect.bisect_right(self._prices, high, start, end)
+            if left < right:
+                mask |= _range_mask(left, right)
+        return mask
+    
+    def _filter_mask(self, category: str, brand: str, min_price: float,
+                     max_price: float, in_stock: bool):
+        """Маска всех фильтров или None, если фильтров нет"""
+        mask = None
+        if category:
+            mask = self._categories.get(category.lower(), 0)
+        if brand:
+            brand_mask = self._brands.get(brand.lower(), 0)
+            mask = brand_mask if mask is None else mask & brand_mask
+        if min_price is not None or max_price is not None or in_stock:
+            price_mask = self._price_mask(min_price, max_price, in_stock)
+            mask = price_mask if mask is None else mask & price_mask
+        return mask
+    
+    def _match(self, terms: list, limit: int, filters):
+        """Товары, содержащие все слова terms, или None, если таких нет"""
+        postings = [self._postings[term] for term in terms]
+        titles = [self._title[term] for term in terms]
+        sparse = [posting for posting in postings if not isinstance(posting, int)]
+        
+        if sparse:
+            # Есть редкое слово - кандидатов немного, проверяем каждого
+            candidates = set(min(sparse, key=len)).intersection(*sparse)
+            checks = [self._bitmaps[term][0] if term in self._bitmaps else self._postings[term] for term in terms]
+            title_checks = [self._bitmaps[term][1] if term in self._bitmaps else self._title[term] for term in terms]
+            if filters is not None:
+                checks.append(filters.to_bytes((len(self.products) >> 3) + 1, "little"))
+            
+            found = []
+            for doc_id in candidates:
+                if all(_contains(posting, doc_id) for posting in checks):
+                    score = sum(1 for title in title_checks if _contains(title, doc_id))
+                    found.append((-score, doc_id))
+            if not found:
+                return None
+            return [doc_id for _, doc_id in heapq.nsmallest(limit, found)]
+        
+        # Все слова частые - пересекаем битовые маски
+        mask = postings[0]
+        for posting in postings[1:]:
+            mask &= posting
+        if filters is not None:
+            mask &= filters
+        if not mask:
+            return None
+        
+        # Сначала товары, у которых все слова в названии, затем остальные
+        in_title = mask
+        for title in titles:
+            in_title &= title
+        
+        found = list(islice(_iter_bits(in_title), limit))
+        if len(found) < limit:
+            found.extend(islice(_iter_bits(mask & ~in_title), limit - len(found)))
+        return found
+    
+    def search(self, query: str, limit: int = 5, category: str = None, brand: str = None,
+               min_price: float = None, max_price: float = None, in_stock: bool = False) -> list:
+        """Товары, подходящие под запрос, от более релевантных к менее"""
+        parsed = parse_query(query)
+        min_price = parsed["min_price"] if min_price is None else min_price
+        max_price = parsed["max_price"] if max_price is None else max_price
+        
+        # Неизвестные каталогу слова ("учеба", "подарок") не должны обнулять выдачу
+        terms = [term for term in dict.fromkeys(parsed["terms"]) if term in self._postings]
+        filters = self._filter_mask(category, brand, min_price, max_price, in_stock)
+        
+        if not terms:
+            # Только фильтры ("Apple до 50000") - все товары каталога под ними, по статическому рангу
+            if filters is None:
+                return []
+            return [self.products[doc_id] for doc_id in islice(_iter_bits(filters), limit)]
+        
+        # Ни один товар не содержит всех слов - по очереди отбрасываем самые частые
+        terms.sort(key=self._df.get)
+        while terms:
+            found = self._match(terms, limit, filters)
+            if found is not None:
+                return [self.products[doc_id] for doc_id in found]
+            terms.pop()
+        return []
+
+class Catalog:
+    """Каталог товаров в памяти; индекс перестраивается целиком и подменяется атомарно"""
+    
+    def __init__(self, reload_interval: float = 60):
+        self.reload_interval = reload_interval
+        self.index = CatalogIndex([])
+        self._task = None
+        self._reload = None
+        self._stale = False
+    
+    async def load(self):
+        # Версию читаем до товаров: импорт, закончившийся во время загрузки, вызовет еще одну
+        version = await run_query(ProductCRUD.get_catalog_version)
+        products = await run_query(ProductCRUD.get_all_products)
+        loop = asyncio.get_running_loop()
+        # Построение индекса - чистый CPU, не занимаем им потоки БД
+        index = await loop.run_in_executor(None, CatalogIndex, products, version)
+        # Поиск, начатый на старом индексе, дорабатывает на нем же
+        self.index = index
+        logger.info(f"Catalog index loaded: {len(index)} products, version {version}")
+    
+    async def _run_forever(self):
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            try:
+                version = await run_query(ProductCRUD.get_catalog_version)
+                if version != self.index.version:
+                    await self.load()
+            except Exception as e:
+                logger.error(f"Catalog reload error: {e}")
+    
+    def update_stock(self, stock: dict):
+        """Остатки после заказа (артикул -> остаток) без ожидания перестроения индекса.
+        
+        Пока товар остается в наличии, его номер в индексе не меняется - достаточно
+        обновить остаток. Закончившийся товар переходит в другую группу номеров,
+        поэтому индекс перестраивается в фоне.
+        """
+        sold_out = False
+        for sku, remaining in stock.items():
+            product = self.index.get(sku)
+            if product is None:
+                continue
+            sold_out = sold_out or (bool(product.get("stock")) and not remaining)
+            product["stock"] = remaining
+        if sold_out:
+            self._stale = True
+            if self._reload is None or self._reload.done():
+                self._reload = asyncio.create_task(self._reload_stale())
+    
+    async def _reload_stale(self):
+        # Загрузка, начатая до заказа, могла прочитать старые остатки - тогда еще один проход
+        while self._stale:
+            self._stale = False
+            try:
+                await self.load()
+            except Exception as e:
+                logger.error(f"Catalog reload error: {e}")
+    
+    def start(self):
+        """Отслеживание версии каталога и перестроение индекса после импорта"""
+        if self._task is None and self.reload_interval > 0:
+            self._task = asyncio.create_task(self._run_forever())
+    
+    async def stop(self):
+        for task in (self._task, self._reload):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = self._reload = None
+    
+    def search(self, query: str, limit: int = 5, **filters) -> list:
+        return self.index.search(query, limit=limit, **filters)
+    
+    def prompt_context(self, user_message: str) -> str:
+        """Подходящие товары для системного промпта или пустая строка"""
+        products = self.search(user_message, limit=config.CATALOG_PROMPT_ITEMS)
+        if not products:
+            return ""
+        
+        lines = ["Товары из каталога магазина, подходящие под запрос. "
+                 "Рекомендуй только их и не придумывай другие модели и цены:"]
+        for product in products:
+            availability = "в наличии" if product.get("stock") else "нет в наличии"
+            line = (f"- {product['name']}, {product.get('price') or 0:.0f} руб., "
+                    f"{availability}, артикул {product['sku']}")
+            if product.get("description"):
+                line += f": {product['description'][:150]}"
+            lines.append(line)
+        
+        return "\n".join(lines)[:config.CATALOG_PROMPT_MAX_CHARS]
+
+catalog = Catalog(reload_interval=config.CATALOG_RELOAD_INTERVAL)
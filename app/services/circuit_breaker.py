@@ -0,0 +1,99 @@
+import logging
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+class CircuitOpenError(Exception):
+    """Провайдер считается недоступным, запрос не выполняется"""
+
+class CircuitBreaker:
+    """Автомат защиты по доле неудачных вызовов в скользящем окне.
+    
+    closed - вызовы идут как обычно; open - вызовы сразу отклоняются;
+    half_open - после паузы пропускается пробный вызов, по его итогу
+    автомат закрывается или снова размыкается.
+    """
+    
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    
+    # Числовое представление состояния для метрик
+    STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+    
+    def __init__(self, name: str, window: int = 20, min_calls: int = 5,
+                 failure_rate: float = 0.5, open_seconds: float = 30, half_open_calls: int = 1):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        
+        self._results = deque(maxlen=window)
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        self.opened_count = 0
+    
+    @property
+    def state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._set_state(self.HALF_OPEN)
+            self._probes = 0
+        return self._state
+    
+    def _set_state(self, state: str):
+        if state != self._state:
+            logger.warning(f"Circuit breaker {self.name}: {self._state} -> {state}")
+            self._state = state
+    
+    def before_call(self):
+        """Проверка перед вызовом; в разомкнутом состоянии сразу бросает CircuitOpenError"""
+        state = self.state
+        if state == self.OPEN:
+            raise CircuitOpenError(f"{self.name} circuit is open")
+        if state == self.HALF_OPEN:
+            if self._probes >= self.half_open_calls:
+                raise CircuitOpenError(f"{self.name} circuit is half-open, probe in progress")
+            self._probes += 1
+    
+    def release_call(self):
+        """Вызов прерван без результата - освобождаем место пробного вызова"""
+        if self._state == self.HALF_OPEN and self._probes > 0:
+            self._probes -= 1
+    
+    def record_success(self):
+        if self._state == self.HALF_OPEN:
+            self._results.clear()
+            self._set_state(self.CLOSED)
+        self._results.append(True)
+    
+    def record_failure(self):
+        if self._state == self.HALF_OPEN:
+            self._open()
+            return
+        
+        self._results.append(False)
+        if len(self._results) >= self.min_calls and self.current_failure_rate() >= self.failure_rate:
+            self._open()
+    
+    def _open(self):
+        self._set_state(self.OPEN)
+        self._opened_at = time.monotonic()
+        self._results.clear()
+        self.opened_count += 1
+    
+    def current_failure_rate(self) -> float:
+        if not self._results:
+            return 0.0
+        return self._results.count(False) / len(self._results)
+    
+    def stats(self) -> dict:
+        state = self.state
+        return {
+            "state": state,
+            "state_value": self.STATE_VALUES[state],
+            "failure_rate": self.current_failure_rate(),
+            "opened_count": self.opened_count
+        }
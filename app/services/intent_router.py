@@ -0,0 +1,111 @@
+import re
+from typing import Optional
+
+from app.config import config
+from app.services import metrics
+
+# Слова, которые не меняют смысл короткого вопроса ("сколько стоит доставка?")
+NEUTRAL_WORDS = {
+    "а", "и", "в", "во", "на", "с", "со", "по", "у", "о", "к", "за", "ли", "же", "ну", "не", "мне", "вас",
+    "есть", "как", "какая", "какой", "какие", "каким", "какова", "сколько", "стоит", "когда", "где", "что",
+    "можно", "будет", "подскажите", "скажите", "пожалуйста", "условия", "это", "вы", "я", "бы",
+    "хотел", "хотела", "узнать", "интересует", "поводу", "товар", "заказ",
+}
+
+# Вежливые интенты: рядом с вопросом по существу их слова не учитываются
+POLITE_INTENTS = {"greeting", "thanks"}
+
+# Интент: ключевые слова (регулярные выражения для одного слова) и готовый ответ
+INTENTS = {
+    "greeting": {
+        "patterns": [r"привет\w*", r"здравств\w*", r"добр\w+\s+(?:день|утро|вечер)", r"hello", r"hi"],
+        "answer": "Здравствуйте! Чем могу помочь с выбором электроники?",
+    },
+    "thanks": {
+        "patterns": [r"спасиб\w*", r"благодар\w*", r"thanks"],
+        "answer": "Пожалуйста! Если появятся вопросы о товарах - пишите.",
+    },
+    "delivery": {
+        "patterns": [r"доставк\w*", r"достав\w*", r"курьер\w*", r"самовывоз\w*", r"привез\w*"],
+        "answer": "🚚 Доставка по городу - 1-3 дня, по стране - 3-7 дней. Есть самовывоз.",
+    },
+    "payment": {
+        "patterns": [r"оплат\w*", r"заплат\w*", r"рассрочк\w*", r"кредит\w*", r"картой", r"наличн\w*"],
+        "answer": "💳 Принимаем оплату наличными, картой и онлайн. Есть рассрочка.",
+    },
+    "warranty": {
+        "patterns": [r"гаранти\w*", r"возврат\w*", r"вернуть", r"обмен\w*"],
+        "answer": "🛡️ Гарантия на всю технику - от 1 года. Вернуть товар можно в течение 14 дней.",
+    },
+    "contacts": {
+        "patterns": [r"контакт\w*", r"телефон\s+магазина", r"адрес\w*", r"email", r"почт\w*", r"график\w*", r"режим\w*"],
+        "answer": ("📞 Телефон: +7 (999) 123-45-67, email: shop@example.com\n"
+                   "Адрес: г. Москва, ул. Примерная, 123. График: Пн-Пт 9:00-18:00"),
+    },
+}
+
+_WORD = re.compile(r"[a-zа-яё0-9]+")
+
+class IntentRouter:
+    """Быстрые ответы на типовые вопросы без обращения к LLM.
+    
+    Все ключевые слова собраны в одно регулярное выражение с именованными группами,
+    поэтому сообщение просматривается один раз. Уверенность - доля значимых слов
+    сообщения, относящихся к одному интенту: "сколько стоит доставка?" - 1.0,
+    "доставка iPhone 15 в Казань" - 0.25, такой вопрос уходит в LLM.
+    """
+    
+    def __init__(self, min_confidence: float = 0.6, max_words: int = 12):
+        self.min_confidence = min_confidence
+        self.max_words = max_words
+        self._pattern = re.compile(
+            "|".join(
+                rf"(?P<{name}>\b(?:{'|'.join(intent['patterns'])})\b)"
+                for name, intent in INTENTS.items()
+            )
+        )
+    
+    def classify(self, text: str) -> tuple:
+        """(интент, уверенность) или (None, 0.0)"""
+        text = text.lower()
+        words = _WORD.findall(text)
+        if not words or len(words) > self.max_words:
+            return None, 0.0
+        
+        hits = {}
+        for match in self._pattern.finditer(text):
+            # Выражение может захватить несколько слов ("телефон магазина")
+            hits[match.lastgroup] = hits.get(match.lastgroup, 0) + len(_WORD.findall(match.group()))
+        if not hits:
+            return None, 0.0
+        
+        content = sum(1 for word in words if word not in NEUTRAL_WORDS)
+        topics = {name: count for name, count in hits.items() if name not in POLITE_INTENTS}
+        if topics:
+            # "Привет, сколько стоит доставка?" - вопрос о доставке
+            content -= sum(count for name, count in hits.items() if name in POLITE_INTENTS)
+            hits = topics
+        
+        intent = max(hits, key=hits.get)
+        return intent, min(1.0, hits[intent] / max(1, content))
+    
+    def answer(self, text: str) -> Optional[str]:
+        """Готовый ответ, если интент распознан уверенно, иначе None"""
+        if not text:
+            return None
+        
+        intent, confidence = self.classify(text)
+        if intent is None:
+            metrics.INTENT_ROUTER.labels("none", "passed").inc()
+            return None
+        if confidence < self.min_confidence:
+            metrics.INTENT_ROUTER.labels(intent, "passed").inc()
+            return None
+        
+        metrics.INTENT_ROUTER.labels(intent, "answered").inc()
+        return INTENTS[intent]["answer"]
+
+intent_router = IntentRouter(
+    min_confidence=config.INTENT_MIN_CONFIDENCE,
+    max_words=config.INTENT_MAX_WORDS
+)
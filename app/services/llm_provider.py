@@ -0,0 +1,226 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import Optional
+
+import aiohttp
+
+from app.config import config
+from app.services.circuit_breaker import CircuitBreaker
+from app.services import metrics
+
+logger = logging.getLogger(__name__)
+
+SYSTEM_PROMPT = """Ты - консультант интернет-магазина электроники. 
+Отвечай вежливо и помогай клиентам с выбором товаров.
+Отвечай на русском языке."""
+
+# Статусы, при которых запрос имеет смысл повторить
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+# Статусы, при которых провайдер не ответит ни на один запрос: ключ, права, модель
+UNAVAILABLE_STATUSES = {401, 403, 404}
+
+class LLMProviderError(Exception):
+    """Ошибка запроса к провайдеру LLM; retryable - можно ли повторить запрос, status - HTTP-статус ответа"""
+    
+    def __init__(self, message: str, retryable: bool = False, status: int = None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.status = status
+
+class LLMProvider:
+    """Общая часть клиентов LLM: HTTP-сессия, повторы, circuit breaker и статистика задержек.
+    
+    Наследник задает name и реализует _request (ответ целиком) и _stream_request
+    (накопленный текст по мере генерации).
+    """
+    
+    name = "llm"
+    
+    def __init__(self):
+        self._session = None
+        self.breaker = CircuitBreaker(
+            self.name,
+            window=config.BREAKER_WINDOW,
+            min_calls=config.BREAKER_MIN_CALLS,
+            failure_rate=config.BREAKER_FAILURE_RATE,
+            open_seconds=config.BREAKER_OPEN_SECONDS
+        )
+        metrics.BREAKER_STATE.labels(self.name).set_function(
+            lambda: self.breaker.STATE_VALUES[self.breaker.state]
+        )
+        # Задержки успешных запросов: ответ целиком и первый фрагмент потока
+        self._latencies = {
+            "sync": deque(maxlen=config.LLM_LATENCY_WINDOW),
+            "stream": deque(maxlen=config.LLM_LATENCY_WINDOW)
+        }
+    
+    @property
+    def configured(self) -> bool:
+        """Заданы ли параметры подключения"""
+        return True
+    
+    def latency(self, mode: str = "sync", p: float = 0.5) -> Optional[float]:
+        """Перцентиль задержки последних успешных запросов или None, если данных мало"""
+        samples = self._latencies[mode]
+        if len(samples) < config.LLM_LATENCY_MIN_SAMPLES:
+            return None
+        values = sorted(samples)
+        return values[min(len(values) - 1, int(len(values) * p))]
+    
+    async def start(self):
+        """Создание общей HTTP-сессии с пулом keep-alive соединений"""
+        if self._session is not None and not self._session.closed:
+            return
+        
+        connector = aiohttp.TCPConnector(
+            limit=config.HTTP_POOL_LIMIT,
+            limit_per_host=config.HTTP_POOL_LIMIT_PER_HOST,
+            ttl_dns_cache=config.HTTP_DNS_CACHE_TTL,
+            keepalive_timeout=config.HTTP_KEEPALIVE_TIMEOUT
+        )
+        self._session = aiohttp.ClientSession(connector=connector)
+    
+    async def close(self):
+        """Закрытие HTTP-сессии и всех соединений пула"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+    
+    async def _get_session(self) -> aiohttp.ClientSession:
+        # Сессия создается лениво, если сервис используется без start()
+        if self._session is None or self._session.closed:
+            await self.start()
+        return self._session
+    
+    async def _request(self, user_message: str, history: list, timeout: float,
+                       system_prompt: str) -> str:
+        raise NotImplementedError
+    
+    async def _stream_request(self, user_message: str, history: list, system_prompt: str):
+        raise NotImplementedError
+        yield ""
+    
+    def _observe_request(self, mode: str, started: float, outcome: str):
+        elapsed = time.perf_counter() - started
+        metrics.LLM_LATENCY.labels(self.name, mode).observe(elapsed)
+        metrics.LLM_REQUESTS.labels(self.name, outcome).inc()
+        if outcome == "ok" and mode == "sync":
+            self._latencies["sync"].append(elapsed)
+    
+    def _retry_delay(self, attempt: int, deadline: float, retries: int):
+        """Пауза перед повтором (экспоненциальная с jitter) или None, если повторять нельзя"""
+        if attempt > retries:
+            return None
+        
+        delay = min(config.LLM_RETRY_MAX_DELAY, config.LLM_RETRY_BASE_DELAY * 2 ** (attempt - 1))
+        delay = random.uniform(delay / 2, delay)
+        
+        # После паузы должно остаться время хотя бы на короткую попытку
+        if asyncio.get_running_loop().time() + delay + 1 >= deadline:
+            return None
+        return delay
+    
+    def _record_result(self, error: Exception = None):
+        if error is None:
+            self.breaker.record_success()
+        elif getattr(error, "retryable", False) or getattr(error, "status", None) in UNAVAILABLE_STATUSES:
+            self.breaker.record_failure()
+        else:
+            # Ошибка конкретного запроса (400) не говорит ни о доступности провайдера, ни о недоступности
+            self.breaker.release_call()
+    
+    async def request_with_retry(self, user_message: str, history: list, system_prompt: str = SYSTEM_PROMPT,
+                                 retries: int = None, deadline: float = None) -> str:
+        """Запрос с повторами в пределах общего бюджета времени и защитой circuit breaker.
+        
+        retries - число повторов после первой попытки (по умолчанию LLM_RETRY_ATTEMPTS),
+        deadline - общий срок по часам event loop (по умолчанию LLM_LATENCY_BUDGET от начала).
+        """
+        loop = asyncio.get_running_loop()
+        if deadline is None:
+            deadline = loop.time() + config.LLM_LATENCY_BUDGET
+        if retries is None:
+            retries = config.LLM_RETRY_ATTEMPTS
+        attempt = 0
+        
+        while True:
+            # При разомкнутом автомате сразу уходим к другому провайдеру или на резервный ответ
+            self.breaker.before_call()
+            attempt += 1
+            started = time.perf_counter()
+            try:
+                timeout = min(15, deadline - loop.time())
+                response = await self._request(user_message, history, timeout, system_prompt)
+            except LLMProviderError as e:
+                self._observe_request("sync", started, "error")
+                self._record_result(e)
+                delay = self._retry_delay(attempt, deadline, retries) if e.retryable else None
+                if delay is None:
+                    raise
+                logger.warning(f"{self.name} attempt {attempt} failed: {e}, retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                continue
+            except asyncio.CancelledError:
+                self.breaker.release_call()
+                raise
+            except Exception:
+                self._observe_request("sync", started, "error")
+                self.breaker.record_failure()
+                raise
+            
+            self._observe_request("sync", started, "ok")
+            self._record_result()
+            return response
+    
+    async def stream_with_retry(self, user_message: str, history: list, system_prompt: str = SYSTEM_PROMPT,
+                                retries: int = None, deadline: float = None):
+        """Потоковый запрос с повторами до получения первого фрагмента"""
+        loop = asyncio.get_running_loop()
+        if deadline is None:
+            deadline = loop.time() + config.LLM_LATENCY_BUDGET
+        if retries is None:
+            retries = config.LLM_RETRY_ATTEMPTS
+        attempt = 0
+        
+        while True:
+            self.breaker.before_call()
+            attempt += 1
+            started = False
+            request_started = time.perf_counter()
+            try:
+                async for text in self._stream_request(user_message, history, system_prompt):
+                    if not started:
+                        first_chunk = time.perf_counter() - request_started
+                        metrics.LLM_FIRST_CHUNK.labels(self.name).observe(first_chunk)
+                        self._latencies["stream"].append(first_chunk)
+                    started = True
+                    yield text
+            except LLMProviderError as e:
+                self._observe_request("stream", request_started, "error")
+                self._record_result(e)
+                delay = self._retry_delay(attempt, deadline, retries) if e.retryable and not started else None
+                if delay is None:
+                    raise
+                logger.warning(f"{self.name} stream attempt {attempt} failed: {e}, retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                continue
+            except (asyncio.CancelledError, GeneratorExit):
+                # Чтение прервано получателем: если ответ уже шел, провайдер доступен
+                if started:
+                    self._observe_request("stream", request_started, "ok")
+                    self.breaker.record_success()
+                else:
+                    self.breaker.release_call()
+                raise
+            except Exception:
+                self._observe_request("stream", request_started, "error")
+                self.breaker.record_failure()
+                raise
+            
+            self._observe_request("stream", request_started, "ok")
+            self._record_result()
+            return
@@ -0,0 +1,193 @@
+import asyncio
+import logging
+
+from app.config import config
+from app.services import metrics
+from app.services.circuit_breaker import CircuitBreaker
+from app.services.llm_provider import LLMProviderError, SYSTEM_PROMPT
+from app.services.ollama_service import ollama_service
+from app.services.yandex_gpt_service import yandex_gpt_service
+
+logger = logging.getLogger(__name__)
+
+class LLMRouter:
+    """Выбор провайдера LLM для запроса.
+    
+    Провайдеры перебираются по приоритету (policy="priority") или по медиане задержки
+    последних ответов (policy="latency"); провайдеры с разомкнутым автоматом - в конце.
+    При ошибке запрос уходит следующему провайдеру, повторы выполняет только последний.
+    С hedge=True, если основной провайдер не ответил за перцентиль своей задержки,
+    отправляется страхующий запрос второму и берется первый успешный ответ.
+    Потоковые запросы переключаются на другой провайдер только до первого фрагмента.
+    """
+    
+    def __init__(self, providers: list, policy: str = "priority", hedge: bool = False,
+                 hedge_delay: float = 0, hedge_percentile: float = 0.95, hedge_min_delay: float = 0.5):
+        if policy not in ("priority", "latency"):
+            raise Exception(f"Unknown LLM_ROUTING policy: {policy}")
+        
+        self.all_providers = providers
+        self.policy = policy
+        self.hedge = hedge
+        self.hedge_delay = hedge_delay
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+    
+    @property
+    def providers(self) -> list:
+        """Провайдеры с заданными параметрами подключения, в порядке приоритета"""
+        return [provider for provider in self.all_providers if provider.configured]
+    
+    def candidates(self, mode: str = "sync") -> list:
+        providers = self.providers
+        if self.policy == "latency":
+            # Провайдеры без статистики идут первыми - так она у них появится
+            providers = sorted(providers, key=lambda provider: provider.latency(mode) or 0.0)
+        return sorted(providers, key=lambda provider: provider.breaker.state == CircuitBreaker.OPEN)
+    
+    async def start(self):
+        for provider in self.providers:
+            await provider.start()
+    
+    async def close(self):
+        for provider in self.all_providers:
+            await provider.close()
+    
+    def _hedge_delay(self, provider):
+        """Через сколько отправлять страхующий запрос или None, если данных о задержке нет"""
+        if self.hedge_delay:
+            return self.hedge_delay
+        delay = provider.latency("sync", self.hedge_percentile)
+        return max(delay, self.hedge_min_delay) if delay is not None else None
+    
+    async def complete(self, user_message: str, history: list, system_prompt: str = SYSTEM_PROMPT) -> str:
+        """Ответ целиком от первого успешно ответившего провайдера"""
+        candidates = self.candidates("sync")
+        if not candidates:
+            raise LLMProviderError("No LLM provider configured")
+        
+        deadline = asyncio.get_running_loop().time() + config.LLM_LATENCY_BUDGET
+        last_error = None
+        i = 0
+        while i < len(candidates):
+            provider = candidates[i]
+            delay = self._hedge_delay(provider) if self.hedge and i + 1 < len(candidates) else None
+            group = candidates[i:i + 2] if delay is not None else [provider]
+            try:
+                return await self._race(group, delay, candidates[-1], user_message, history,
+                                        system_prompt, deadline)
+            except Exception as e:
+                last_error = e
+            i += len(group)
+            if i < len(candidates):
+                logger.warning(f"LLM provider {group[-1].name} failed: {last_error}, switching to {candidates[i].name}")
+                metrics.LLM_FAILOVERS.labels(group[-1].name).inc()
+        raise last_error
+    
+    async def _race(self, group: list, delay, last, user_message: str, history: list,
+                    system_prompt: str, deadline: float) -> str:
+        """Запрос первому провайдеру группы; второму - после delay или при ошибке первого"""
+        def start(provider):
+            # Пока есть куда переключиться, не тратим бюджет времени на повторы
+            retries = None if provider is last else 0
+            return asyncio.ensure_future(
+                provider.request_with_retry(user_message, history, system_prompt, retries, deadline)
+            )
+        
+        pending = {start(group[0]): group[0]}
+        waiting = list(group[1:])
+        hedged = False
+        last_error = None
+        try:
+            while pending:
+                done, _ = await asyncio.wait(
+                    pending, timeout=delay if waiting else None, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    # Основной провайдер отвечает дольше обычного - страхующий запрос
+                    hedged = True
+                    provider = waiting.pop(0)
+                    pending[start(provider)] = provider
+                    continue
+                
+                for task in done:
+                    provider = pending.pop(task)
+                    if task.exception() is None:
+                        if hedged:
+                            metrics.LLM_HEDGES.labels("hedge" if provider is not group[0] else "primary").inc()
+                        return task.result()
+                    last_error = task.exception()
+                
+                if waiting and not pending:
+                    # Основной провайдер ответил ошибкой до срока страхующего запроса
+                    logger.warning(f"LLM provider {group[0].name} failed: {last_error}, switching to {waiting[0].name}")
+                    metrics.LLM_FAILOVERS.labels(group[0].name).inc()
+                    provider = waiting.pop(0)
+                    pending[start(provider)] = provider
+            
+            if hedged:
+                metrics.LLM_HEDGES.labels("error").inc()
+            raise last_error
+        finally:
+            for task in pending:
+                task.cancel()
+    
+    async def stream(self, user_message: str, history: list, system_prompt: str = SYSTEM_PROMPT):
+        """Потоковый ответ: накопленный текст по мере генерации"""
+        candidates = self.candidates("stream")
+        if not candidates:
+            raise LLMProviderError("No LLM provider configured")
+        
+        deadline = asyncio.get_running_loop().time() + config.LLM_LATENCY_BUDGET
+        for i, provider in enumerate(candidates):
+            started = False
+            retries = None if i + 1 == len(candidates) else 0
+            try:
+                async for text in provider.stream_with_retry(user_message, history, system_prompt,
+                                                             retries, deadline):
+                    started = True
+                    yield text
+                return
+            except Exception as e:
+                # Часть ответа уже показана - продолжить его другой моделью нельзя
+                if started or i + 1 == len(candidates):
+                    raise
+                logger.warning(f"LLM provider {provider.name} stream failed: {e}, "
+                               f"switching to {candidates[i + 1].name}")
+                metrics.LLM_FAILOVERS.labels(provider.name).inc()
+    
+    def stats(self) -> dict:
+        """Состояние провайдеров: circuit breaker и задержки последних ответов"""
+        return {
+            provider.name: {
+                **provider.breaker.stats(),
+                "p50": provider.latency("sync", 0.5),
+                "p95": provider.latency("sync", 0.95),
+                "first_chunk_p50": provider.latency("stream", 0.5)
+            }
+            for provider in self.providers
+        }
+
+def create_router() -> LLMRouter:
+    """Провайдеры в порядке LLM_PROVIDERS, включенные флагами USE_*"""
+    available = {
+        "yandex_gpt": (yandex_gpt_service, config.USE_YANDEX_GPT),
+        "ollama": (ollama_service, config.USE_OLLAMA),
+    }
+    providers = []
+    for name in config.LLM_PROVIDERS.split(","):
+        name = name.strip()
+        if name not in available:
+            raise Exception(f"Unknown LLM provider: {name}")
+        provider, enabled = available[name]
+        if enabled:
+            providers.append(provider)
+    
+    return LLMRouter(
+        providers,
+        policy=config.LLM_ROUTING,
+        hedge=config.LLM_HEDGE_ENABLED,
+        hedge_delay=config.LLM_HEDGE_DELAY,
+        hedge_percentile=config.LLM_HEDGE_PERCENTILE,
+        hedge_min_delay=config.LLM_HEDGE_MIN_DELAY
+    )
@@ -0,0 +1,110 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+from app.config import config
+from app.services import metrics
+
+class SchedulerBusyError(Exception):
+    """Очередь ожидания LLM переполнена"""
+
+class _UserTurns:
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        # Сообщения хода, ожидающего завершения текущей генерации
+        self.waiting = None
+        self.refs = 0
+
+class LLMScheduler:
+    """Планировщик запросов к LLM.
+    
+    Ходы одного пользователя выполняются строго по очереди; сообщения, пришедшие
+    во время генерации, объединяются в один следующий ход. Общее число
+    одновременных запросов ограничено семафором с ограниченной очередью ожидания.
+    """
+    
+    def __init__(self, max_concurrency: int = 10, max_queue: int = 100, coalesce: bool = True):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.coalesce = coalesce
+        
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._waiting = 0
+        self._users = {}
+        
+        self.in_flight = 0
+        self.coalesced = 0
+        self.rejected = 0
+    
+    @asynccontextmanager
+    async def user_turn(self, user_id: int, user_message: str):
+        """Очередь ходов пользователя.
+        
+        Отдает текст хода (возможно, из нескольких сообщений) или None, если
+        сообщение присоединено к уже ожидающему ходу и отвечать на него не нужно.
+        """
+        turns = self._users.get(user_id)
+        if turns is None:
+            turns = self._users[user_id] = _UserTurns()
+        
+        if self.coalesce and turns.waiting is not None:
+            turns.waiting.append(user_message)
+            self.coalesced += 1
+            yield None
+            return
+        
+        messages = [user_message]
+        if self.coalesce and turns.lock.locked():
+            turns.waiting = messages
+        
+        turns.refs += 1
+        try:
+            async with turns.lock:
+                if turns.waiting is messages:
+                    turns.waiting = None
+                yield "\n".join(messages)
+        finally:
+            # Ход отменен, не дождавшись очереди - новые сообщения к нему не присоединяем
+            if turns.waiting is messages:
+                turns.waiting = None
+            turns.refs -= 1
+            if turns.refs == 0:
+                del self._users[user_id]
+    
+    @asynccontextmanager
+    async def slot(self):
+        """Место среди одновременных запросов к LLM"""
+        if self._semaphore.locked() and self._waiting >= self.max_queue:
+            self.rejected += 1
+            metrics.LLM_REJECTED.inc()
+            raise SchedulerBusyError("LLM wait queue is full")
+        
+        self._waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+        
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+    
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "waiting": self._waiting,
+            "active_users": len(self._users),
+            "coalesced": self.coalesced,
+            "rejected": self.rejected
+        }
+
+llm_scheduler = LLMScheduler(
+    max_concurrency=config.LLM_MAX_CONCURRENCY,
+    max_queue=config.LLM_MAX_QUEUE,
+    coalesce=config.LLM_COALESCE_MESSAGES
+)
+
+metrics.LLM_IN_FLIGHT.set_function(lambda: llm_scheduler.in_flight)
+metrics.LLM_WAITING.set_function(lambda: llm_scheduler._waiting)
@@ -1,51 +1,319 @@
+import asyncio
 import logging
+from contextlib import suppress
 from app.config import config
-from app.database.crud import ChatHistoryCRUD
-from app.services.yandex_gpt_service import yandex_gpt_service
+from app.database.async_crud import AsyncChatHistoryCRUD
+from app.services import metrics
+from app.services.answer_index import answer_index, context_key
+from app.services.catalog import catalog
+from app.services.circuit_breaker import CircuitOpenError
+from app.services.llm_provider import SYSTEM_PROMPT
+from app.services.llm_router import LLMRouter, create_router
+from app.services.response_cache import response_cache
+from app.services.llm_scheduler import llm_scheduler, SchedulerBusyError
+from app.services.intent_router import intent_router
+from app.services.prompt_builder import prompt_builder, SUMMARY_PROMPT
 
 logger = logging.getLogger(__name__)
 
+BUSY_MESSAGE = "Сейчас много обращений, попробуйте повторить вопрос через минуту."
+NOT_CONFIGURED_MESSAGE = "Извините, сервис AI не настроен. Обратитесь к администратору."
+ERROR_MESSAGE = "Извините, сервис консультаций временно недоступен. Попробуйте позже."
+TRUNCATED_NOTICE = "⚠️ Ответ прервался. Повторите вопрос, если нужна полная информация."
+
 class LLMService:
     def __init__(self):
         self.use_yandex_gpt = config.USE_YANDEX_GPT
         self.use_ollama = config.USE_OLLAMA
-        
-        # Проверяем конфигурацию
+        self._router = None
+    
+    @property
+    def router(self) -> LLMRouter:
+        """Провайдеры из LLM_PROVIDERS; создаются при первом обращении (в start()), а не при импорте"""
+        if self._router is None:
+            self._router = create_router()
+        return self._router
+    
+    async def start(self):
+        """Подготовка HTTP-соединений провайдеров при старте бота"""
+        # Проверяем конфигурацию при запуске, а не при импорте модуля
         if self.use_yandex_gpt:
             if not config.YANDEX_API_KEY:
                 logger.warning("YANDEX_API_KEY not set, but USE_YANDEX_GPT is True")
             if not config.YANDEX_FOLDER_ID:
                 logger.warning("YANDEX_FOLDER_ID not set, but USE_YANDEX_GPT is True")
+        if not self.router.providers:
+            logger.warning("No LLM provider configured, answering with fallback messages")
+        await self.router.start()
+        if config.ANSWER_INDEX_ENABLED:
+            await answer_index.load()
+    
+    async def close(self):
+        """Освобождение HTTP-соединений при остановке бота"""
+        # Фоновые обновления сводок используют ту же HTTP-сессию
+        await prompt_builder.close()
+        await self.router.close()
+        answer_index.close()
+    
+    async def quick_answer(self, user_id: int, user_message: str):
+        """Ответ на типовой вопрос без обращения к LLM или None"""
+        if not config.INTENT_ROUTER_ENABLED:
+            return None
+        
+        answer = intent_router.answer(user_message)
+        if answer is not None:
+            # Вопрос и ответ остаются в истории - LLM увидит их в следующих ходах
+            await AsyncChatHistoryCRUD.add_message(user_id, "user", user_message)
+            await AsyncChatHistoryCRUD.add_message(user_id, "assistant", answer)
+        return answer
     
-    async def get_ai_response(self, user_id: int, user_message: str) -> str:
-        """Получение ответа от выбранного AI провайдера"""
+    async def get_ai_response(self, user_id: int, user_message: str):
+        """Получение ответа от выбранного AI провайдера.
         
-        if self.use_yandex_gpt and config.YANDEX_API_KEY and config.YANDEX_FOLDER_ID:
+        Возвращает None, если сообщение объединено с ожидающим ходом пользователя
+        и отдельный ответ на него не нужен.
+        """
+        async with llm_scheduler.user_turn(user_id, user_message) as turn_message:
+            if turn_message is None:
+                return None
             try:
-                return await yandex_gpt_service.get_ai_response(user_id, user_message)
-            except Exception as e:
-                logger.error(f"Yandex GPT service error: {e}")
-                return "Извините, сервис консультаций временно недоступен. Попробуйте позже."
-        elif self.use_ollama:
-            return await self._ollama_request(user_id, user_message)
-        else:
+                async with llm_scheduler.slot():
+                    return await self._get_ai_response(user_id, turn_message)
+            except SchedulerBusyError:
+                logger.warning("LLM queue is full, rejecting request")
+                return BUSY_MESSAGE
+    
+    async def _get_ai_response(self, user_id: int, user_message: str) -> str:
+        if not self.router.providers:
             logger.error("No AI provider configured properly")
-            return "Извините, сервис AI не настроен. Обратитесь к администратору."
+            return NOT_CONFIGURED_MESSAGE
+        try:
+            return await self._generate(user_id, user_message)
+        except Exception as e:
+            logger.error(f"LLM service error: {e}")
+            return ERROR_MESSAGE
     
-    async def _ollama_request(self, user_id: int, user_message: str) -> str:
-        """Резервный вариант с Ollama (если нужен)"""
-        # Сохраняем сообщение пользователя
-        ChatHistoryCRUD.add_message(user_id, "user", user_message)
+    async def stream_ai_response(self, user_id: int, user_message: str):
+        """Потоковое получение ответа: отдает накопленный текст по мере генерации.
         
+        Ничего не отдает, если сообщение объединено с ожидающим ходом пользователя.
+        Генерация идет в отдельной задаче и освобождает слот LLM сразу по окончании,
+        не дожидаясь, пока вызывающий код отправит фрагменты в Telegram; отставший
+        потребитель получает только последний накопленный текст.
+        """
+        async with llm_scheduler.user_turn(user_id, user_message) as turn_message:
+            if turn_message is None:
+                return
+            
+            queue = asyncio.Queue()
+            producer = asyncio.ensure_future(self._produce_stream(user_id, turn_message, queue))
+            try:
+                while True:
+                    texts = [await queue.get()]
+                    while not queue.empty():
+                        texts.append(queue.get_nowait())
+                    # None - генерация закончилась
+                    done = texts[-1] is None
+                    texts = [text for text in texts if text is not None]
+                    if texts:
+                        yield texts[-1]
+                    if done:
+                        break
+                # Ошибка генерации - вызывающему коду
+                await producer
+            finally:
+                if not producer.done():
+                    producer.cancel()
+                    with suppress(asyncio.CancelledError):
+                        await producer
+    
+    async def _produce_stream(self, user_id: int, user_message: str, queue: asyncio.Queue):
+        """Генерация потокового ответа в очередь фрагментов; в конце - None"""
         try:
-            # Простая заглушка - в реальности здесь будет запрос к Ollama
-            response = "Это ответ от локальной модели Ollama. Для работы с Yandex GPT настройте YANDEX_API_KEY и YANDEX_FOLDER_ID."
+            async with llm_scheduler.slot():
+                if self.router.providers:
+                    async for text in self._generate_stream(user_id, user_message):
+                        queue.put_nowait(text)
+                else:
+                    queue.put_nowait(await self._get_ai_response(user_id, user_message))
+        except SchedulerBusyError:
+            logger.warning("LLM queue is full, rejecting request")
+            queue.put_nowait(BUSY_MESSAGE)
+        finally:
+            queue.put_nowait(None)
+    
+    async def _generate(self, user_id: int, user_message: str) -> str:
+        """Ответ LLM с историей диалога, кэшем и резервным ответом при недоступности провайдеров"""
+        try:
+            # Сохраняем сообщение пользователя
+            await AsyncChatHistoryCRUD.add_message(user_id, "user", user_message)
+            
+            # Получаем историю диалога и собираем промпт в пределах бюджета токенов
+            system_prompt, history, base_prompt, context = await self._prepare_prompt(user_id, user_message)
+            cache_key = self._cache_key(user_message, history, system_prompt, base_prompt)
+            response = await response_cache.get(cache_key) if cache_key else None
+            self._count_cache_lookup(cache_key, response)
+            
+            if response is None:
+                response, system_prompt = await self._match_answer(user_message, context, system_prompt)
+            if response is None:
+                response = await self.router.complete(user_message, history, system_prompt)
+                if cache_key:
+                    await response_cache.set(cache_key, response)
+                self._remember_answer(user_message, response, context)
+            
+            # Сохраняем ответ ассистента
+            await AsyncChatHistoryCRUD.add_message(user_id, "assistant", response)
             
-            # Сохраняем ответ
-            ChatHistoryCRUD.add_message(user_id, "assistant", response)
             return response
         except Exception as e:
-            logger.error(f"Ollama error: {e}")
-            return "Ошибка локального AI сервиса."
+            logger.error(f"LLM providers error: {e}")
+            self._count_fallback(e)
+            error_msg = self._get_fallback_response(user_message)
+            await AsyncChatHistoryCRUD.add_message(user_id, "assistant", error_msg)
+            return error_msg
+    
+    async def _generate_stream(self, user_id: int, user_message: str):
+        """Потоковый ответ LLM: отдает накопленный текст по мере генерации"""
+        await AsyncChatHistoryCRUD.add_message(user_id, "user", user_message)
+        system_prompt, history, base_prompt, context = await self._prepare_prompt(user_id, user_message)
+        
+        cache_key = self._cache_key(user_message, history, system_prompt, base_prompt)
+        text = await response_cache.get(cache_key) if cache_key else None
+        self._count_cache_lookup(cache_key, text)
+        if text is None:
+            text, system_prompt = await self._match_answer(user_message, context, system_prompt)
+        
+        if text is not None:
+            yield text
+        else:
+            text = ""
+            try:
+                async for text in self.router.stream(user_message, history, system_prompt):
+                    yield text
+                if cache_key and text:
+                    await response_cache.set(cache_key, text)
+                if text:
+                    self._remember_answer(user_message, text, context)
+            except Exception as e:
+                logger.error(f"LLM stream error: {e}")
+                if not text:
+                    # До первого фрагмента ошибка неотличима от обычной - отдаем резервный ответ
+                    self._count_fallback(e)
+                    text = self._get_fallback_response(user_message)
+                else:
+                    # Оборванный ответ не выдаем за полный - ни пользователю, ни в истории
+                    text = f"{text}\n\n{TRUNCATED_NOTICE}"
+                yield text
+        
+        if text:
+            await AsyncChatHistoryCRUD.add_message(user_id, "assistant", text)
+    
+    def _system_prompt(self, user_message: str) -> str:
+        """Системный промпт с подходящими товарами из каталога"""
+        if not config.CATALOG_ENABLED:
+            return SYSTEM_PROMPT
+        
+        context = catalog.prompt_context(user_message)
+        return f"{SYSTEM_PROMPT}\n\n{context}" if context else SYSTEM_PROMPT
+    
+    async def _prepare_prompt(self, user_id: int, user_message: str) -> tuple:
+        """(системный промпт со сводкой, история от старых сообщений к новым,
+        промпт с товарами каталога без сводки, ключ контекста ответа).
+        
+        Ключ контекста есть только у первого вопроса диалога - ответ на него не зависит
+        от предыдущих ходов; для остальных он 0.
+        """
+        history = await AsyncChatHistoryCRUD.get_recent_history(user_id, prompt_builder.history_window)
+        base_prompt = self._system_prompt(user_message)
+        system_prompt, history = await prompt_builder.build(
+            user_id, user_message, history, base_prompt, summarize=self._summarize
+        )
+        return system_prompt, history, base_prompt, 0 if history else context_key(base_prompt)
+    
+    async def _match_answer(self, user_message: str, context: int, system_prompt: str) -> tuple:
+        """(ответ на такой же ранее заданный вопрос или None, промпт с похожими вопросами и ответами)"""
+        if not config.ANSWER_INDEX_ENABLED:
+            return None, system_prompt
+        
+        answer, neighbours = await answer_index.match(user_message, context)
+        if answer is not None:
+            metrics.ANSWER_INDEX.labels("hit").inc()
+            return answer, system_prompt
+        
+        metrics.ANSWER_INDEX.labels("context" if neighbours else "miss").inc()
+        examples = answer_index.prompt_context(neighbours)
+        return None, f"{system_prompt}\n\n{examples}" if examples else system_prompt
+    
+    @staticmethod
+    def _remember_answer(user_message: str, answer: str, context: int):
+        if config.ANSWER_INDEX_ENABLED:
+            answer_index.add(user_message, answer, context)
+    
+    async def _summarize(self, summary: str, messages: list) -> str:
+        """Обновление сводки вытесненных из промпта ходов.
+        
+        Фоновый запрос занимает место в планировщике наравне с ответами; при полной
+        очереди SchedulerBusyError - сводка обновится со следующим ходом.
+        """
+        async with llm_scheduler.slot():
+            return await self.router.complete(prompt_builder.summary_request(summary, messages), [], SUMMARY_PROMPT)
+    
+    def _cache_key(self, user_message: str, history: list, system_prompt: str,
+                   base_prompt: str = SYSTEM_PROMPT):
+        """Ключ кэша ответа или None, если ответ посреди диалога не кэшируется"""
+        if not config.RESPONSE_CACHE_ENABLED:
+            return None
+        
+        if not history and system_prompt == base_prompt:
+            # Первый вопрос диалога: ответ общий для всех пользователей; товары каталога
+            # входят в ключ - после их смены старый ответ не подходит
+            return response_cache.make_key(user_message, base_prompt)
+        if config.RESPONSE_CACHE_STANDALONE_ONLY:
+            return None
+        
+        # Посреди диалога ответ зависит от истории и сводки: промпт со сводкой и история - в ключе
+        return response_cache.make_key(user_message, system_prompt, history)
+    
+    @staticmethod
+    def _count_cache_lookup(cache_key, response):
+        if cache_key:
+            metrics.LLM_CACHE.labels("hit" if response is not None else "miss").inc()
+    
+    @staticmethod
+    def _count_fallback(error: Exception):
+        reason = "circuit_open" if isinstance(error, CircuitOpenError) else "error"
+        metrics.LLM_FALLBACKS.labels(reason).inc()
+    
+    def _get_fallback_response(self, user_message: str) -> str:
+        """Резервные ответы при недоступности провайдеров LLM"""
+        user_message_lower = user_message.lower()
+        
+        if any(word in user_message_lower for word in ['привет', 'здравствуй', 'hello']):
+            return "Здравствуйте! Чем могу помочь с выбором электроники?"
+        elif any(word in user_message_lower for word in ['телефон', 'смартфон']):
+            return "У нас есть широкий выбор смартфонов. Какие характеристики вас интересуют: бюджет, камера, производитель?"
+        elif any(word in user_message_lower for word in ['ноутбук', 'компьютер']):
+            return "Для подбора ноутбука важно знать: для каких задач (работа, игры, учеба), бюджет и предпочитаемый размер экрана."
+        elif any(word in user_message_lower for word in ['доставка', 'доставить']):
+            return "Доставка осуществляется в течение 1-3 дней по городу. Есть самовывоз."
+        elif any(word in user_message_lower for word in ['оплата', 'заплатить']):
+            return "Принимаем оплату картой, наличными и онлайн. Есть рассрочка."
+        elif any(word in user_message_lower for word in ['гарантия', 'возврат']):
+            return "Гарантия на технику от 1 года. Возврат в течение 14 дней."
+        else:
+            return "Извините, в данный момент сервис консультаций временно недоступен. Вы можете задать вопрос по телефону +7 (999) 123-45-67 или написать на shop@example.com"
 
+    def cache_stats(self) -> dict:
+        """Статистика кэша ответов: попадания, промахи, размер"""
+        return response_cache.stats()
+    
+    def breaker_stats(self) -> dict:
+        """Состояние circuit breaker и задержки каждого провайдера"""
+        return self.router.stats()
+    
+    def scheduler_stats(self) -> dict:
+        """Статистика планировщика: запросы в работе, очередь, объединенные сообщения"""
+        return llm_scheduler.stats()
+    
 llm_service = LLMService()
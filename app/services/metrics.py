@@ -0,0 +1,321 @@
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+from aiohttp import web
+
+from app.config import config
+
+logger = logging.getLogger(__name__)
+
+# Границы гистограмм задержек по умолчанию, с
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class _Value:
+    """Значение счетчика или gauge; может вычисляться функцией при сборе"""
+    
+    def __init__(self, lock: threading.Lock):
+        self._lock = lock
+        self._value = 0.0
+        self._function = None
+    
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self._value += amount
+    
+    def dec(self, amount: float = 1):
+        with self._lock:
+            self._value -= amount
+    
+    def set(self, value: float):
+        with self._lock:
+            self._value = value
+    
+    def set_function(self, function):
+        """Значение берется из function() в момент сбора метрик"""
+        self._function = function
+    
+    @contextmanager
+    def track_inprogress(self):
+        self.inc()
+        try:
+            yield
+        finally:
+            self.dec()
+    
+    def get(self) -> float:
+        if self._function is not None:
+            return float(self._function())
+        return self._value
+
+class _HistogramValue:
+    def __init__(self, lock: threading.Lock, buckets: tuple):
+        self._lock = lock
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+    
+    def observe(self, value: float):
+        with self._lock:
+            self.sum += value
+            self.count += 1
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+    
+    @contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+    
+    def cumulative(self) -> list:
+        with self._lock:
+            result, total = [], 0
+            for bound, count in zip(self.buckets, self.counts):
+                total += count
+                result.append((bound, total))
+            return result
+
+class _Metric:
+    TYPE = ""
+    
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}
+        (registry if registry is not None else REGISTRY).register(self)
+    
+    def _new_child(self):
+        return _Value(self._lock)
+    
+    def labels(self, *values, **kwargs):
+        """Дочерняя метрика для набора значений меток"""
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.labelnames)
+        key = tuple(str(value) for value in values)
+        if len(key) != len(self.labelnames):
+            raise ValueError(f"{self.name}: expected labels {self.labelnames}, got {key}")
+        
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+    
+    def _unlabeled(self):
+        if self.labelnames:
+            raise ValueError(f"{self.name} has labels {self.labelnames}, use labels()")
+        return self.labels()
+    
+    def samples(self):
+        """(суффикс, метки, доп. метка, значение) для экспорта"""
+        for key, child in list(self._children.items()):
+            yield "", key, "", child.get()
+
+class Counter(_Metric):
+    TYPE = "counter"
+    
+    def inc(self, amount: float = 1):
+        self._unlabeled().inc(amount)
+    
+    def set_function(self, function):
+        self._unlabeled().set_function(function)
+    
+    def samples(self):
+        for key, child in list(self._children.items()):
+            yield "_total", key, "", child.get()
+
+class Gauge(_Metric):
+    TYPE = "gauge"
+    
+    def inc(self, amount: float = 1):
+        self._unlabeled().inc(amount)
+    
+    def dec(self, amount: float = 1):
+        self._unlabeled().dec(amount)
+    
+    def set(self, value: float):
+        self._unlabeled().set(value)
+    
+    def set_function(self, function):
+        self._unlabeled().set_function(function)
+    
+    def track_inprogress(self):
+        return self._unlabeled().track_inprogress()
+
+class Histogram(_Metric):
+    TYPE = "histogram"
+    
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (),
+                 buckets: tuple = DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        super().__init__(name, documentation, labelnames, registry)
+    
+    def _new_child(self):
+        return _HistogramValue(self._lock, self.buckets)
+    
+    def observe(self, value: float):
+        self._unlabeled().observe(value)
+    
+    def time(self):
+        return self._unlabeled().time()
+    
+    def totals(self) -> tuple:
+        """(сумма, количество) наблюдений по всем меткам"""
+        children = list(self._children.values())
+        return sum(child.sum for child in children), sum(child.count for child in children)
+    
+    def samples(self):
+        for key, child in list(self._children.items()):
+            for bound, count in child.cumulative():
+                yield "_bucket", key, f'le="{_format_value(bound)}"', count
+            yield "_sum", key, "", child.sum
+            yield "_count", key, "", child.count
+
+class Registry:
+    """Набор метрик процесса и их экспорт в текстовом формате Prometheus"""
+    
+    def __init__(self):
+        self._metrics = {}
+    
+    def register(self, metric: _Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+    
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                # Ошибка в функции-источнике не должна ломать весь экспорт
+                logger.error(f"Metric {metric.name} collection error: {e}")
+                continue
+            
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.TYPE}")
+            for suffix, key, extra, value in samples:
+                labels = _format_labels(metric.labelnames, key, extra)
+                lines.append(f"{metric.name}{suffix}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+    
+    def get_sample_value(self, name: str, labels: dict = None):
+        """Значение одного сэмпла по полному имени (например, llm_requests_total) или None"""
+        labels = labels or {}
+        for metric in self._metrics.values():
+            if not name.startswith(metric.name):
+                continue
+            for suffix, key, extra, value in metric.samples():
+                if metric.name + suffix != name:
+                    continue
+                sample_labels = dict(zip(metric.labelnames, key))
+                if extra:
+                    label, _, bound = extra.partition("=")
+                    sample_labels[label] = bound.strip('"')
+                if sample_labels == labels:
+                    return value
+        return None
+
+REGISTRY = Registry()
+
+# Обработка апдейтов
+UPDATES = Counter("bot_updates", "Updates received from Telegram", ("type",))
+UPDATES_IN_FLIGHT = Gauge("bot_updates_in_flight", "Updates being processed right now")
+HANDLER_LATENCY = Histogram("bot_handler_duration_seconds", "Message handler latency", ("handler",))
+HANDLER_ERRORS = Counter("bot_handler_errors", "Unhandled exceptions in message handlers", ("handler",))
+THROTTLED = Counter("bot_throttled_updates", "Updates delayed or dropped by the anti-flood limits", ("scope", "action"))
+THROTTLE_KEYS = Gauge("bot_throttle_buckets", "Users and chats tracked by the anti-flood limits", ("scope",))
+
+# Исходящие запросы к Bot API
+OUTBOUND_WAIT = Histogram("outbound_wait_seconds", "Wait for the Telegram rate limits before a request", ("priority",))
+OUTBOUND_WAITING = Gauge("outbound_waiting", "Requests waiting for the global rate limit", ("priority",))
+OUTBOUND_RETRY_AFTER = Counter("outbound_retry_after", "Flood control errors (RetryAfter) from Telegram", ("method",))
+BROADCAST_MESSAGES = Counter("broadcast_messages", "Broadcast deliveries by result", ("result",))
+
+# База данных
+DB_LATENCY = Histogram("db_call_duration_seconds", "Database call latency including executor wait", ("operation",))
+DB_ERRORS = Counter("db_call_errors", "Failed database calls", ("operation",))
+
+# LLM
+LLM_LATENCY = Histogram("llm_request_duration_seconds", "LLM HTTP request latency", ("provider", "mode"))
+LLM_FIRST_CHUNK = Histogram("llm_first_chunk_seconds", "Time to the first streamed fragment", ("provider",))
+LLM_REQUESTS = Counter("llm_requests", "LLM HTTP requests by outcome", ("provider", "outcome"))
+LLM_FALLBACKS = Counter("llm_fallbacks", "Answers served by the keyword fallback", ("reason",))
+LLM_CACHE = Counter("llm_response_cache", "Response cache lookups", ("result",))
+ANSWER_INDEX = Counter("answer_index_lookups", "Answer index lookups (hit, context, miss)", ("result",))
+LLM_IN_FLIGHT = Gauge("llm_in_flight", "LLM requests holding a concurrency slot")
+LLM_WAITING = Gauge("llm_waiting", "LLM requests waiting for a concurrency slot")
+LLM_REJECTED = Counter("llm_rejected", "LLM requests rejected because the wait queue was full")
+LLM_FAILOVERS = Counter("llm_failovers", "Requests passed to the next provider after an error", ("provider",))
+LLM_HEDGES = Counter("llm_hedged_requests", "Hedged second requests by the provider that answered first", ("winner",))
+BREAKER_STATE = Gauge("llm_circuit_state", "Circuit breaker state (0 closed, 1 half-open, 2 open)", ("provider",))
+
+# Быстрые ответы без LLM
+INTENT_ROUTER = Counter("intent_router_messages", "Messages checked by the intent router", ("intent", "result"))
+
+# Кэши и очереди
+HISTORY_CACHE = Counter("history_cache_lookups", "History window cache lookups", ("result",))
+WRITE_BEHIND_PENDING = Gauge("write_behind_pending", "Records waiting in the write-behind queue")
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(
+        text=REGISTRY.render(),
+        content_type="text/plain",
+        charset="utf-8",
+        headers={"X-Content-Type-Options": "nosniff"}
+    )
+
+def create_metrics_app() -> web.Application:
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_handler)
+    return app
+
+class MetricsServer:
+    """Локальный HTTP-сервер с /metrics"""
+    
+    def __init__(self, host: str = "127.0.0.1", port: int = 9100):
+        self.host = host
+        self.port = port
+        self._runner = None
+    
+    async def start(self):
+        if self._runner is not None:
+            return
+        
+        self._runner = web.AppRunner(create_metrics_app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"Metrics available at http://{self.host}:{self.port}/metrics")
+    
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+metrics_server = MetricsServer(host=config.METRICS_HOST, port=config.METRICS_PORT)
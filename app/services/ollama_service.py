@@ -0,0 +1,130 @@
+import asyncio
+import aiohttp
+import json
+import logging
+from app.config import config
+from app.services.llm_provider import LLMProvider, LLMProviderError, SYSTEM_PROMPT, RETRYABLE_STATUSES
+
+logger = logging.getLogger(__name__)
+
+class OllamaError(LLMProviderError):
+    """Ошибка запроса к Ollama; retryable - можно ли повторить запрос"""
+
+class OllamaService(LLMProvider):
+    """Клиент локальной модели Ollama (POST /api/chat).
+    
+    keep_alive держит модель загруженной между запросами - иначе первый запрос
+    после паузы ждет загрузки весов в память.
+    """
+    
+    name = "ollama"
+    
+    def __init__(self):
+        super().__init__()
+        self.base_url = config.OLLAMA_URL.rstrip("/")
+        self.model = config.OLLAMA_MODEL
+        self.keep_alive = config.OLLAMA_KEEP_ALIVE
+    
+    @property
+    def configured(self) -> bool:
+        return bool(self.base_url and self.model)
+    
+    def _build_payload(self, user_message: str, history: list, stream: bool = False,
+                       system_prompt: str = SYSTEM_PROMPT) -> dict:
+        messages = [{"role": "system", "content": system_prompt}]
+        for msg in history:
+            role = "assistant" if msg['role'] == 'assistant' else 'user'
+            messages.append({"role": role, "content": msg['message']})
+        messages.append({"role": "user", "content": user_message[:1000]})
+        
+        return {
+            "model": self.model,
+            "messages": messages,
+            "stream": stream,
+            "keep_alive": self.keep_alive,
+            "options": {
+                "temperature": 0.3,
+                "num_predict": 500
+            }
+        }
+    
+    def _raise_for_status(self, status: int, response_text: str):
+        logger.error(f"Ollama API error {status}: {response_text}")
+        
+        if status == 404:
+            raise OllamaError(f"Model {self.model} not found - run: ollama pull {self.model}", status=status)
+        raise OllamaError(f"HTTP {status}: {response_text}", status in RETRYABLE_STATUSES, status)
+    
+    async def _request(self, user_message: str, history: list, timeout: float = 15,
+                       system_prompt: str = SYSTEM_PROMPT) -> str:
+        payload = self._build_payload(user_message, history, system_prompt=system_prompt)
+        session = await self._get_session()
+        
+        try:
+            async with session.post(
+                f"{self.base_url}/api/chat",
+                json=payload,
+                timeout=aiohttp.ClientTimeout(total=timeout)
+            ) as response:
+                response_text = await response.text()
+                if response.status != 200:
+                    self._raise_for_status(response.status, response_text)
+                
+                result = json.loads(response_text)
+                return result["message"]["content"]
+        
+        except asyncio.TimeoutError:
+            logger.error("Ollama request timeout")
+            raise OllamaError("Request timeout - model may be loading or overloaded", retryable=True)
+        except aiohttp.ClientError as e:
+            logger.error(f"Ollama connection error: {e}")
+            raise OllamaError(f"Connection error: {e}", retryable=True)
+        except (json.JSONDecodeError, KeyError) as e:
+            logger.error(f"Ollama response format error: {e}")
+            raise Exception("Invalid response format from Ollama")
+    
+    async def _stream_request(self, user_message: str, history: list,
+                              system_prompt: str = SYSTEM_PROMPT):
+        """Потоковый запрос: Ollama присылает JSON-объекты построчно с приращением текста,
+        отдаем накопленный текст - как Yandex GPT.
+        """
+        payload = self._build_payload(user_message, history, stream=True, system_prompt=system_prompt)
+        session = await self._get_session()
+        
+        try:
+            async with session.post(
+                f"{self.base_url}/api/chat",
+                json=payload,
+                # Ограничиваем паузу между фрагментами, а не всю генерацию
+                timeout=aiohttp.ClientTimeout(total=60, sock_read=15)
+            ) as response:
+                if response.status != 200:
+                    self._raise_for_status(response.status, await response.text())
+                
+                text = ""
+                async for line in response.content:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    result = json.loads(line)
+                    if "error" in result:
+                        raise OllamaError(result["error"], retryable=not text)
+                    
+                    chunk = result.get("message", {}).get("content", "")
+                    if chunk:
+                        text += chunk
+                        yield text
+                    if result.get("done"):
+                        break
+        
+        except asyncio.TimeoutError:
+            logger.error("Ollama stream timeout")
+            raise OllamaError("Request timeout - model may be loading or overloaded", retryable=True)
+        except aiohttp.ClientError as e:
+            logger.error(f"Ollama connection error: {e}")
+            raise OllamaError(f"Connection error: {e}", retryable=True)
+        except json.JSONDecodeError as e:
+            logger.error(f"JSON decode error: {e}")
+            raise Exception("Invalid response format from Ollama")
+
+ollama_service = OllamaService()
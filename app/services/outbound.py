@@ -0,0 +1,220 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import time
+from contextlib import contextmanager
+
+from app.config import config
+from app.services import metrics
+from app.services.storage import storage
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты исходящих запросов: меньше - раньше
+INTERACTIVE = 0
+BULK = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BULK: "bulk"}
+
+# Приоритет задается для всего кода внутри outbound.bulk(), включая созданные в нем задачи
+_priority = contextvars.ContextVar("outbound_priority", default=INTERACTIVE)
+
+class TokenBucket:
+    """Корзина токенов: rate запросов в секунду, до burst подряд.
+    
+    Токен резервируется сразу (алгоритм GCRA): reserve() возвращает, сколько ждать
+    своей очереди, поэтому ожидающим не нужны ни блокировка, ни очередь.
+    """
+    
+    def __init__(self, rate: float, burst: int = 1):
+        self.interval = 1 / rate
+        self.tolerance = (burst - 1) * self.interval
+        # Теоретическое время следующего запроса
+        self._tat = 0.0
+    
+    def delay(self, now: float) -> float:
+        """Сколько ждать ближайшего токена"""
+        return max(0.0, self._tat - self.tolerance - now)
+    
+    def reserve(self, now: float) -> float:
+        """Резервирование токена; возвращает время ожидания до него"""
+        delay = self.delay(now)
+        self._tat = max(self._tat, now) + self.interval
+        return delay
+    
+    def pause(self, now: float, seconds: float):
+        """Следующий токен - не раньше чем через seconds (RetryAfter от Telegram)"""
+        self._tat = max(self._tat, now + seconds + self.tolerance)
+    
+    def idle(self, now: float) -> bool:
+        """Корзина снова полна - ее можно не хранить"""
+        return self._tat <= now
+
+class SharedRateLimit:
+    """Лимит частоты в общем хранилище (Redis) - один на все реплики.
+    
+    Счетчик на фиксированное окно: одно увеличение на событие, окно выбирается так,
+    чтобы за него корзина rate/burst пропустила столько же (полная корзина + пополнение).
+    Окна отсчитываются по системным часам - у реплик они должны быть синхронизированы.
+    Ошибка хранилища лимит не применяет: без общего счетчика остаются корзины процесса.
+    """
+    
+    def __init__(self, storage, prefix: str, rate: float, burst: int = 1):
+        self.storage = storage
+        self.prefix = prefix
+        self.window = max(1.0, burst / rate)
+        self.limit = int(rate * self.window) + burst
+        self.errors = 0
+    
+    async def hit(self, key="") -> float:
+        """Учет события: 0 - в пределах лимита, иначе сколько ждать следующего окна"""
+        now = time.time()
+        window = int(now // self.window)
+        try:
+            count = await self.storage.incr(f"{self.prefix}:{key}:{window}", ttl=self.window * 2)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Shared rate limit {self.prefix} error: {e}")
+            return 0.0
+        if count <= self.limit:
+            return 0.0
+        return (window + 1) * self.window - now
+
+class OutboundScheduler:
+    """Ограничение частоты исходящих сообщений под лимиты Telegram.
+    
+    Каждый запрос ждет токен корзины своего чата (личные чаты и группы - с разной
+    частотой) и токен общей корзины бота. Общие токены выдаются по приоритету:
+    ответы пользователям (INTERACTIVE) раньше рассылки (BULK). После RetryAfter
+    чат ставится на паузу, а при рассылке - и вся рассылка. С shared общий лимит бота
+    учитывается и в общем хранилище: реплики вместе не превышают его.
+    """
+    
+    # Сколько чатов хранить, прежде чем удалять корзины без ожидания
+    PRUNE_CHATS = 10000
+    
+    def __init__(self, global_rate: float = 30, global_burst: int = 5, chat_rate: float = 1,
+                 group_rate: float = 0.33, chat_burst: int = 3, shared_storage=None):
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.chat_burst = chat_burst
+        
+        self._global = TokenBucket(global_rate, global_burst)
+        self._shared = None
+        if shared_storage is not None:
+            self._shared = SharedRateLimit(shared_storage, "outbound", global_rate, global_burst)
+        self._chats = {}
+        self._prune_at = self.PRUNE_CHATS
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._dispatcher = None
+        self._bulk_paused_until = 0.0
+        
+        self.retry_after = 0
+    
+    @staticmethod
+    @contextmanager
+    def bulk():
+        """Запросы внутри блока - рассылка: общие токены им выдаются после ответов пользователям"""
+        token = _priority.set(BULK)
+        try:
+            yield
+        finally:
+            _priority.reset(token)
+    
+    def _chat_bucket(self, chat_id, now: float) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self._prune_at:
+                self._chats = {key: value for key, value in self._chats.items() if not value.idle(now)}
+                self._prune_at = max(self.PRUNE_CHATS, len(self._chats) * 2)
+            # Отрицательный id - группа или канал, строковый - @username канала
+            group = not isinstance(chat_id, int) or chat_id < 0
+            bucket = self._chats[chat_id] = TokenBucket(
+                self.group_rate if group else self.chat_rate, self.chat_burst
+            )
+        return bucket
+    
+    async def acquire(self, chat_id):
+        """Ожидание права отправить запрос в чат"""
+        loop = asyncio.get_running_loop()
+        priority = _priority.get()
+        started = loop.time()
+        
+        delay = self._chat_bucket(chat_id, started).reserve(started)
+        if delay:
+            await asyncio.sleep(delay)
+        
+        if priority == BULK:
+            # Пауза рассылки после RetryAfter может продлеваться, пока мы ждем
+            while loop.time() < self._bulk_paused_until:
+                await asyncio.sleep(self._bulk_paused_until - loop.time())
+        await self._global_token(priority)
+        if self._shared is not None:
+            # Токен процесса получен - ждем и места в общем лимите бота
+            while delay := await self._shared.hit():
+                await asyncio.sleep(delay)
+        
+        metrics.OUTBOUND_WAIT.labels(PRIORITY_NAMES[priority]).observe(loop.time() - started)
+    
+    async def _global_token(self, priority: int):
+        loop = asyncio.get_running_loop()
+        if not self._waiters and not self._global.delay(loop.time()):
+            self._global.reserve(loop.time())
+            return
+        
+        future = loop.create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        if self._dispatcher is None:
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+        # Отмененное ожидание диспетчер пропустит
+        await future
+    
+    async def _dispatch(self):
+        """Выдача общих токенов ожидающим: по приоритету, при равном - по порядку"""
+        loop = asyncio.get_running_loop()
+        try:
+            while self._waiters:
+                delay = self._global.delay(loop.time())
+                if delay:
+                    await asyncio.sleep(delay)
+                    continue
+                
+                _, _, future = heapq.heappop(self._waiters)
+                if not future.done():
+                    self._global.reserve(loop.time())
+                    future.set_result(None)
+        finally:
+            self._dispatcher = None
+    
+    def pause(self, chat_id, seconds: float):
+        """RetryAfter: чат ждет seconds; если превышен лимит рассылкой - ждет и вся рассылка"""
+        now = asyncio.get_running_loop().time()
+        self.retry_after += 1
+        self._chat_bucket(chat_id, now).pause(now, seconds)
+        if _priority.get() == BULK:
+            self._bulk_paused_until = max(self._bulk_paused_until, now + seconds)
+    
+    def waiting(self, priority: int) -> int:
+        return sum(1 for item in self._waiters if item[0] == priority and not item[2].done())
+    
+    def stats(self) -> dict:
+        return {
+            "waiting_interactive": self.waiting(INTERACTIVE),
+            "waiting_bulk": self.waiting(BULK),
+            "chats": len(self._chats),
+            "retry_after": self.retry_after
+        }
+
+outbound = OutboundScheduler(
+    global_rate=config.OUTBOUND_GLOBAL_RATE,
+    global_burst=config.OUTBOUND_GLOBAL_BURST,
+    chat_rate=config.OUTBOUND_CHAT_RATE,
+    group_rate=config.OUTBOUND_GROUP_RATE,
+    chat_burst=config.OUTBOUND_CHAT_BURST,
+    shared_storage=storage if storage.shared else None
+)
+
+metrics.OUTBOUND_WAITING.labels("interactive").set_function(lambda: outbound.waiting(INTERACTIVE))
+metrics.OUTBOUND_WAITING.labels("bulk").set_function(lambda: outbound.waiting(BULK))
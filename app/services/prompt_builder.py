@@ -0,0 +1,163 @@
+import asyncio
+import hashlib
+import json
+import logging
+import math
+
+from app.config import config
+from app.services.storage import storage
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PROMPT = """Ты ведешь краткую сводку разговора консультанта магазина электроники с клиентом.
+Дополни сводку новыми сообщениями: что ищет клиент, бюджет, предпочтения, уже предложенные товары.
+Пиши по-русски, без приветствий, не длиннее 5 предложений."""
+
+def estimate_tokens(text: str, chars_per_token: float = 3.0) -> int:
+    """Оценка числа токенов без токенизатора модели (для русского текста ~3 символа на токен)"""
+    return math.ceil(len(text) / chars_per_token) if text else 0
+
+def truncate_to_tokens(text: str, tokens: int, chars_per_token: float = 3.0) -> str:
+    limit = int(tokens * chars_per_token)
+    if len(text) <= limit:
+        return text
+    # Обрезаем по границе слова, чтобы не оставлять обрывки
+    cut = text[:limit].rsplit(" ", 1)[0] or text[:limit]
+    return cut + "…"
+
+def _fingerprint(msg: dict) -> str:
+    # Метка времени различает одинаковые реплики ("да", "спасибо") одного разговора
+    key = f"{msg.get('timestamp')}:{msg['role']}:{msg['message']}"
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+class PromptBuilder:
+    """Сборка истории для промпта в пределах бюджета токенов.
+    
+    История из get_recent_history приходит от новых сообщений к старым: в промпт
+    попадают последние сообщения (не больше max_messages и history_tokens), в
+    хронологическом порядке. Вытесненные старые ходы сворачиваются в краткую сводку
+    пользователя - она хранится в общем хранилище и добавляется к системному промпту.
+    Сводка обновляется в фоне, когда накопится batch несвернутых сообщений.
+    """
+    
+    def __init__(self, history_tokens: int = 600, message_tokens: int = 200, max_messages: int = 4,
+                 summary_tokens: int = 200, summary_batch: int = 4, summary_ttl: float = 604800,
+                 chars_per_token: float = 3.0, summary_storage=None):
+        self.history_tokens = history_tokens
+        self.message_tokens = message_tokens
+        self.max_messages = max_messages
+        self.summary_tokens = summary_tokens
+        self.summary_batch = summary_batch
+        self.summary_ttl = summary_ttl
+        self.chars_per_token = chars_per_token
+        self.storage = summary_storage
+        
+        # Пользователи, для которых сводка обновляется прямо сейчас
+        self._summarizing = set()
+        self._tasks = set()
+    
+    @property
+    def history_window(self) -> int:
+        """Сколько последних сообщений читать из истории (текущее + промпт + очередь в сводку)"""
+        return 1 + self.max_messages + self.summary_batch
+    
+    def tokens(self, text: str) -> int:
+        return estimate_tokens(text, self.chars_per_token)
+    
+    def select(self, user_message: str, history: list) -> tuple:
+        """(сообщения для промпта от старых к новым, вытесненные - от новых к старым)"""
+        # Текущее сообщение уже сохранено в истории и передается отдельно
+        if history and history[0]["role"] == "user" and history[0]["message"] == user_message:
+            history = history[1:]
+        
+        selected = []
+        budget = self.history_tokens
+        for msg in history[:self.max_messages]:
+            text = truncate_to_tokens(msg["message"], self.message_tokens, self.chars_per_token)
+            cost = self.tokens(text)
+            if cost > budget:
+                break
+            budget -= cost
+            selected.append({"role": msg["role"], "message": text})
+        
+        return selected[::-1], history[len(selected):]
+    
+    async def build(self, user_id: int, user_message: str, history: list, system_prompt: str,
+                    summarize=None) -> tuple:
+        """(системный промпт со сводкой, история для промпта от старых к новым).
+        
+        summarize(сводка, сообщения) -> новая сводка; без нее сводка не обновляется.
+        """
+        selected, dropped = self.select(user_message, history)
+        summary = await self._load_summary(user_id)
+        
+        if summarize is not None and self.storage is not None and dropped:
+            pending = self._pending(dropped, summary.get("last"))
+            if len(pending) >= self.summary_batch and user_id not in self._summarizing:
+                self._summarizing.add(user_id)
+                task = asyncio.ensure_future(self._refresh_summary(user_id, summary, pending, summarize))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+        
+        if summary.get("text"):
+            system_prompt = f"{system_prompt}\n\nКратко о предыдущем разговоре: {summary['text']}"
+        return system_prompt, selected
+    
+    @staticmethod
+    def _pending(dropped: list, last: str) -> list:
+        """Вытесненные сообщения, еще не свернутые в сводку (от новых к старым)"""
+        for i, msg in enumerate(dropped):
+            if _fingerprint(msg) == last:
+                return dropped[:i]
+        # Последнее свернутое сообщение уже вышло из окна истории - новые все
+        return dropped
+    
+    async def _load_summary(self, user_id: int) -> dict:
+        if self.storage is None:
+            return {}
+        try:
+            value = await self.storage.get(f"summary:{user_id}")
+            return json.loads(value) if value else {}
+        except Exception as e:
+            logger.warning(f"Failed to load history summary for user {user_id}: {e}")
+            return {}
+    
+    async def _refresh_summary(self, user_id: int, summary: dict, pending: list, summarize):
+        try:
+            text = await summarize(summary.get("text", ""), pending[::-1])
+            text = truncate_to_tokens(" ".join(text.split()), self.summary_tokens, self.chars_per_token)
+            await self.storage.set(
+                f"summary:{user_id}",
+                json.dumps({"text": text, "last": _fingerprint(pending[0])}, ensure_ascii=False),
+                self.summary_ttl
+            )
+        except Exception as e:
+            # Сводка остается прежней, свернем эти сообщения в следующий раз
+            logger.warning(f"Failed to refresh history summary for user {user_id}: {e}")
+        finally:
+            self._summarizing.discard(user_id)
+    
+    def summary_request(self, summary: str, messages: list) -> str:
+        """Текст запроса к LLM на обновление сводки (messages - от старых к новым)"""
+        lines = [f"Текущая сводка: {summary or 'пока пусто'}", "", "Новые сообщения:"]
+        for msg in messages:
+            speaker = "Консультант" if msg["role"] == "assistant" else "Клиент"
+            text = truncate_to_tokens(msg["message"], self.message_tokens, self.chars_per_token)
+            lines.append(f"{speaker}: {text}")
+        return "\n".join(lines)
+    
+    async def close(self):
+        """Ожидание фоновых обновлений сводок при остановке бота"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+prompt_builder = PromptBuilder(
+    history_tokens=config.PROMPT_HISTORY_TOKENS,
+    message_tokens=config.PROMPT_MESSAGE_TOKENS,
+    max_messages=config.PROMPT_HISTORY_MESSAGES,
+    summary_tokens=config.PROMPT_SUMMARY_TOKENS,
+    summary_batch=config.PROMPT_SUMMARY_BATCH,
+    summary_ttl=config.PROMPT_SUMMARY_TTL,
+    chars_per_token=config.PROMPT_CHARS_PER_TOKEN,
+    summary_storage=storage if config.PROMPT_SUMMARY_ENABLED else None
+)
@@ -0,0 +1,125 @@
+import hashlib
+import logging
+import re
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from app.config import config
+from app.services.storage import storage
+
+logger = logging.getLogger(__name__)
+
+class ResponseCache:
+    """LRU-кэш ответов LLM с ограничением по времени жизни, количеству и объему.
+    
+    С общим хранилищем (Redis) локальный LRU остается первым уровнем, а промахи
+    проверяются в хранилище - ответ, полученный одной репликой, видят все.
+    """
+    
+    def __init__(self, max_entries: int = 1000, max_bytes: int = 5_000_000, ttl: float = 3600,
+                 shared_storage=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.shared_storage = shared_storage
+        
+        # key -> (expires_at, response, size)
+        self._entries = OrderedDict()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def normalize(message: str) -> str:
+        """Приведение вопроса к канонической форме: регистр, ё, пунктуация, пробелы"""
+        message = message.lower().replace("ё", "е")
+        message = re.sub(r"[^\w\s]", " ", message)
+        return " ".join(message.split())
+    
+    def make_key(self, user_message: str, system_prompt: str, history: list = ()) -> str:
+        """Ключ ответа: вопрос, системный промпт и история из промпта (от старых к новым)"""
+        digest = hashlib.sha256()
+        digest.update(self.normalize(user_message).encode())
+        digest.update(b"\0")
+        digest.update(system_prompt.encode())
+        for msg in history:
+            digest.update(f"\0{msg['role']}\0{msg['message']}".encode())
+        return digest.hexdigest()
+    
+    async def get(self, key: str) -> Optional[str]:
+        response = self._get_local(key)
+        if response is None and self.shared_storage is not None:
+            try:
+                response = await self.shared_storage.get(f"response:{key}")
+            except Exception as e:
+                logger.warning(f"Shared response cache error: {e}")
+            if response is not None:
+                self._set_local(key, response)
+        
+        if response is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return response
+    
+    async def set(self, key: str, response: str):
+        self._set_local(key, response)
+        if self.shared_storage is not None:
+            try:
+                await self.shared_storage.set(f"response:{key}", response, ttl=self.ttl)
+            except Exception as e:
+                logger.warning(f"Shared response cache error: {e}")
+    
+    def _get_local(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        
+        expires_at, response, _ = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+            return None
+        
+        self._entries.move_to_end(key)
+        return response
+    
+    def _set_local(self, key: str, response: str):
+        size = len(response.encode())
+        if size > self.max_bytes:
+            return
+        
+        if key in self._entries:
+            self._remove(key)
+        
+        self._entries[key] = (time.monotonic() + self.ttl, response, size)
+        self._size += size
+        
+        # Вытесняем давно не использованные записи
+        while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+    
+    def _remove(self, key: str):
+        _, _, size = self._entries.pop(key)
+        self._size -= size
+    
+    def clear(self):
+        self._entries.clear()
+        self._size = 0
+    
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+response_cache = ResponseCache(
+    max_entries=config.RESPONSE_CACHE_MAX_ENTRIES,
+    max_bytes=config.RESPONSE_CACHE_MAX_BYTES,
+    ttl=config.RESPONSE_CACHE_TTL,
+    shared_storage=storage if storage.shared else None
+)
@@ -0,0 +1,205 @@
+import logging
+import time
+from typing import Optional
+
+from app.config import config
+
+logger = logging.getLogger(__name__)
+
+class MemoryStorage:
+    """Общее состояние в памяти процесса: строки, счетчики и списки с временем жизни.
+    
+    Подходит для одной реплики и для проверок - видно только этому процессу.
+    Просроченные ключи удаляются при обращении и при переполнении.
+    """
+    
+    # Состояние не разделяется между репликами
+    shared = False
+    
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        # key -> (expires_at или None, значение)
+        self._data = {}
+    
+    def _get(self, key: str):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        
+        expires_at, value = entry
+        if expires_at is not None and expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        return value
+    
+    def _put(self, key: str, value, ttl: float = None):
+        expires_at = time.monotonic() + ttl if ttl else None
+        self._data.pop(key, None)
+        self._data[key] = (expires_at, value)
+        
+        if len(self._data) > self.max_keys:
+            now = time.monotonic()
+            for expired in [k for k, (at, _) in self._data.items() if at is not None and at < now]:
+                del self._data[expired]
+            # Просроченных не хватило - удаляем самые старые записи
+            while len(self._data) > self.max_keys:
+                del self._data[next(iter(self._data))]
+    
+    async def get(self, key: str) -> Optional[str]:
+        return self._get(key)
+    
+    async def set(self, key: str, value: str, ttl: float = None):
+        self._put(key, value, ttl)
+    
+    async def delete(self, key: str):
+        self._data.pop(key, None)
+    
+    async def exists(self, key: str) -> bool:
+        return self._get(key) is not None
+    
+    async def incr(self, key: str, ttl: float = None) -> int:
+        """Увеличение счетчика; время жизни отсчитывается от первого увеличения"""
+        if self._get(key) is None:
+            self._put(key, 1, ttl)
+            return 1
+        
+        expires_at, value = self._data[key]
+        self._data[key] = (expires_at, value + 1)
+        return value + 1
+    
+    async def list_push(self, key: str, values: list, maxlen: int, ttl: float = None,
+                        only_existing: bool = False):
+        """Добавление в конец списка с обрезкой до maxlen последних элементов"""
+        items = self._get(key)
+        if items is None:
+            if only_existing:
+                return
+            items = []
+        self._put(key, (items + list(values))[-maxlen:], ttl)
+    
+    async def list_replace(self, key: str, values: list, maxlen: int, ttl: float = None):
+        self._put(key, list(values)[-maxlen:], ttl)
+    
+    async def list_range(self, key: str) -> list:
+        return list(self._get(key) or [])
+    
+    async def close(self):
+        self._data.clear()
+
+class RedisStorage:
+    """Общее состояние в Redis: все реплики бота видят одни и те же данные.
+    
+    Клиент redis.asyncio передается снаружи (в проверках подойдет fakeredis)
+    или создается по адресу через from_url. Ключи получают общий префикс.
+    """
+    
+    shared = True
+    
+    def __init__(self, redis, prefix: str = "shop_bot"):
+        self.redis = redis
+        self.prefix = prefix
+    
+    @classmethod
+    def from_url(cls, url: str, prefix: str = "shop_bot", max_connections: int = 50,
+                 pool_timeout: float = 5) -> "RedisStorage":
+        try:
+            from redis.asyncio import BlockingConnectionPool, Redis
+        except ImportError:
+            raise Exception("STORAGE_BACKEND=redis requires the redis package (pip install redis)")
+        
+        # При всплеске апдейтов запросы ждут свободное соединение, а не открывают новые
+        pool = BlockingConnectionPool.from_url(
+            url,
+            max_connections=max_connections,
+            timeout=pool_timeout,
+            decode_responses=True
+        )
+        return cls(Redis(connection_pool=pool), prefix)
+    
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}:{key}"
+    
+    async def get(self, key: str) -> Optional[str]:
+        return await self.redis.get(self._key(key))
+    
+    async def set(self, key: str, value: str, ttl: float = None):
+        await self.redis.set(self._key(key), value, px=int(ttl * 1000) if ttl else None)
+    
+    async def delete(self, key: str):
+        await self.redis.delete(self._key(key))
+    
+    async def exists(self, key: str) -> bool:
+        return bool(await self.redis.exists(self._key(key)))
+    
+    async def incr(self, key: str, ttl: float = None) -> int:
+        """Увеличение счетчика; время жизни отсчитывается от первого увеличения"""
+        key = self._key(key)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            if ttl:
+                # Ключ создается вместе со сроком жизни, повторные SET NX его не продлевают
+                pipe.set(key, 0, px=int(ttl * 1000), nx=True)
+            pipe.incr(key)
+            result = await pipe.execute()
+        return int(result[-1])
+    
+    async def list_push(self, key: str, values: list, maxlen: int, ttl: float = None,
+                        only_existing: bool = False):
+        """Добавление в конец списка с обрезкой до maxlen последних элементов"""
+        key = self._key(key)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            if only_existing:
+                # RPUSHX не создает список - неполное окно не появится
+                pipe.rpushx(key, *values)
+            else:
+                pipe.rpush(key, *values)
+            pipe.ltrim(key, -maxlen, -1)
+            if ttl:
+                pipe.pexpire(key, int(ttl * 1000))
+            await pipe.execute()
+    
+    async def list_replace(self, key: str, values: list, maxlen: int, ttl: float = None):
+        key = self._key(key)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(key)
+            if values:
+                pipe.rpush(key, *list(values)[-maxlen:])
+                if ttl:
+                    pipe.pexpire(key, int(ttl * 1000))
+            await pipe.execute()
+    
+    async def list_range(self, key: str) -> list:
+        return await self.redis.lrange(self._key(key), 0, -1)
+    
+    async def close(self):
+        await self.redis.aclose(close_connection_pool=True)
+
+def create_storage(backend: str, url: str = None, prefix: str = "shop_bot"):
+    if backend == "redis":
+        logger.info(f"Using Redis shared state storage at {url}")
+        return RedisStorage.from_url(
+            url,
+            prefix,
+            max_connections=config.REDIS_MAX_CONNECTIONS,
+            pool_timeout=config.REDIS_POOL_TIMEOUT
+        )
+    if backend != "memory":
+        raise Exception(f"Unknown STORAGE_BACKEND: {backend}")
+    return MemoryStorage()
+
+def create_fsm_storage():
+    """Хранилище состояний диалогов aiogram: в Redis - общее для всех реплик"""
+    if isinstance(storage, RedisStorage):
+        from aiogram.fsm.storage.base import DefaultKeyBuilder
+        from aiogram.fsm.storage.redis import RedisStorage as AiogramRedisStorage
+        
+        return AiogramRedisStorage(
+            storage.redis,
+            key_builder=DefaultKeyBuilder(prefix=f"{storage.prefix}:fsm"),
+            state_ttl=config.FSM_STATE_TTL or None,
+            data_ttl=config.FSM_STATE_TTL or None
+        )
+    
+    from aiogram.fsm.storage.memory import MemoryStorage as AiogramMemoryStorage
+    return AiogramMemoryStorage()
+
+storage = create_storage(config.STORAGE_BACKEND, config.REDIS_URL, config.STORAGE_KEY_PREFIX)
@@ -0,0 +1,102 @@
+from app.config import config
+from app.services import metrics
+from app.services.outbound import SharedRateLimit, TokenBucket
+from app.services.storage import storage
+
+class TokenBuckets:
+    """Корзины токенов по ключу (пользователь, чат) с одинаковыми лимитами.
+    
+    Корзина - одно число, полные корзины удаляются, когда словарь вырастает вдвое:
+    память - O(1) на активный ключ, неактивные не копятся.
+    """
+    
+    # Сколько ключей хранить, прежде чем удалять полные корзины
+    PRUNE_KEYS = 10000
+    
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+        self._prune_at = self.PRUNE_KEYS
+    
+    def __len__(self):
+        return len(self._buckets)
+    
+    def get(self, key, now: float) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self._prune_at:
+                self._buckets = {k: value for k, value in self._buckets.items() if not value.idle(now)}
+                self._prune_at = max(self.PRUNE_KEYS, len(self._buckets) * 2)
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+        return bucket
+
+class Throttler:
+    """Антифлуд входящих апдейтов: корзина на пользователя и на групповой чат.
+    
+    Апдейт, токены для которого появятся не позже max_delay, ждет их (сглаживание
+    всплесков); остальные отбрасываются, не расходуя токенов, поэтому отправитель,
+    прекративший флуд, снова обслуживается через max_delay. В личном чате лимит
+    пользователя совпадает с лимитом чата - чатом считаются только группы.
+    С shared_storage апдейты, пропущенные корзинами, считаются и в общем хранилище:
+    флуд, разошедшийся по репликам, отбрасывается по общему лимиту.
+    """
+    
+    def __init__(self, user_rate: float = 0.5, user_burst: int = 5, chat_rate: float = 3,
+                 chat_burst: int = 10, max_delay: float = 2, shared_storage=None):
+        self.max_delay = max_delay
+        self.users = TokenBuckets(user_rate, user_burst)
+        self.chats = TokenBuckets(chat_rate, chat_burst)
+        self.shared = None
+        if shared_storage is not None:
+            self.shared = {
+                "user": SharedRateLimit(shared_storage, "throttle:user", user_rate, user_burst),
+                "chat": SharedRateLimit(shared_storage, "throttle:chat", chat_rate, chat_burst),
+            }
+        # Кому уже сообщили об ограничении: ключ -> время, до которого не повторять
+        self._warned = {}
+    
+    def reserve(self, user_id, chat_id, now: float) -> tuple:
+        """(ожидание перед обработкой или None - отбросить, ограничение: "user" или "chat")"""
+        limits = []
+        if user_id is not None:
+            limits.append(("user", self.users.get(user_id, now)))
+        if chat_id is not None:
+            limits.append(("chat", self.chats.get(chat_id, now)))
+        if not limits:
+            return 0.0, None
+        
+        delay, scope = max((bucket.delay(now), scope) for scope, bucket in limits)
+        if delay > self.max_delay:
+            return None, scope
+        for _, bucket in limits:
+            bucket.reserve(now)
+        return delay, scope
+    
+    async def reserve_shared(self, user_id, chat_id):
+        """Учет апдейта в общих лимитах: ограничение ("user" или "chat"), если превышено, или None"""
+        for scope, key in (("user", user_id), ("chat", chat_id)):
+            if key is not None and await self.shared[scope].hit(key):
+                return scope
+        return None
+    
+    def should_warn(self, key, now: float) -> bool:
+        """Предупреждение об ограничении - одно на max_delay, а не на каждый отброшенный апдейт"""
+        if self._warned.get(key, 0.0) > now:
+            return False
+        if len(self._warned) >= TokenBuckets.PRUNE_KEYS:
+            self._warned = {k: until for k, until in self._warned.items() if until > now}
+        self._warned[key] = now + self.max_delay
+        return True
+
+throttler = Throttler(
+    user_rate=config.THROTTLE_USER_RATE,
+    user_burst=config.THROTTLE_USER_BURST,
+    chat_rate=config.THROTTLE_CHAT_RATE,
+    chat_burst=config.THROTTLE_CHAT_BURST,
+    max_delay=config.THROTTLE_MAX_DELAY,
+    shared_storage=storage if storage.shared else None
+)
+
+metrics.THROTTLE_KEYS.labels("user").set_function(lambda: len(throttler.users))
+metrics.THROTTLE_KEYS.labels("chat").set_function(lambda: len(throttler.chats))
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк индекса прошлых ответов: построение, загрузка и поиск по --vectors вопросам
+
+Синтетические вопросы собираются из шаблонов, товаров и чисел. Измеряются скорость
+добавления, загрузка индекса с диска, поиск по одному запросу и батчем, одновременные
+поиски через AnswerIndex.search (объединяются в батчи сами) и доля запросов с опечатками,
+для которых ближайшим найден исходный вопрос. Файлы индекса (~vectors * dim * 4 байт)
+пишутся во временную директорию и удаляются в конце.
+
+python answer_index_benchmark.py --vectors 1000000 --queries 256
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import time
+
+from load_test import prepare_environment, percentile
+
+TEMPLATES = [
+    "Сколько стоит {product} {n}?",
+    "Есть ли в наличии {product} {n}",
+    "Какая гарантия на {product} {n}?",
+    "Посоветуйте {product} до {n} рублей",
+    "Можно ли вернуть {product} {n} через неделю",
+    "Чем {product} {n} лучше чем {product} {m}?",
+    "Когда привезут {product} {n}",
+]
+PRODUCTS = [
+    "смартфон", "ноутбук", "наушники", "планшет", "телевизор", "монитор",
+    "роутер", "фотоаппарат", "пылесос", "часы", "колонку", "клавиатуру",
+]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=1000000, help="вопросов в индексе")
+    parser.add_argument("--queries", type=int, default=256, help="запросов в каждом замере")
+    parser.add_argument("--batch", type=int, default=32, help="запросов в батче")
+    parser.add_argument("--k", type=int, default=5, help="ближайших вопросов на запрос")
+    parser.add_argument("--chunk", type=int, default=50000, help="вопросов в одном add_many")
+    parser.add_argument("--seed", type=int, default=1, help="seed генератора вопросов")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="переопределение настройки из app/config.py")
+    return parser.parse_args()
+
+def make_question(rng: random.Random) -> str:
+    return rng.choice(TEMPLATES).format(
+        product=rng.choice(PRODUCTS), n=rng.randint(1, 99999), m=rng.randint(1, 99999)
+    )
+
+def make_typo(rng: random.Random, question: str) -> str:
+    """Опечатка: перестановка двух соседних букв в случайном слове"""
+    words = question.split()
+    i = rng.randrange(len(words))
+    word = words[i]
+    if len(word) > 3:
+        j = rng.randrange(len(word) - 1)
+        words[i] = word[:j] + word[j + 1] + word[j] + word[j + 2:]
+    return " ".join(words)
+
+def build(index, args) -> dict:
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    for start in range(0, args.vectors, args.chunk):
+        size = min(args.chunk, args.vectors - start)
+        questions = [make_question(rng) for _ in range(size)]
+        index.add_many(questions, [f"Ответ {start + i}" for i in range(size)], [0] * size)
+    return {"elapsed": time.perf_counter() - started}
+
+def measure_sync(index, queries: list, batch: int, k: int) -> dict:
+    latencies = []
+    started = time.perf_counter()
+    for i in range(0, len(queries), batch):
+        call_started = time.perf_counter()
+        index.search_many(queries[i:i + batch], k)
+        latencies.append(time.perf_counter() - call_started)
+    elapsed = time.perf_counter() - started
+    return {
+        "qps": len(queries) / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+    }
+
+async def measure_concurrent(index, queries: list, concurrency: int, k: int) -> dict:
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    async def one(query):
+        async with semaphore:
+            started = time.perf_counter()
+            await index.search(query, k)
+            latencies.append(time.perf_counter() - started)
+    
+    started = time.perf_counter()
+    await asyncio.gather(*(one(query) for query in queries))
+    elapsed = time.perf_counter() - started
+    return {
+        "qps": len(queries) / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+    }
+
+def main():
+    args = parse_args()
+    prepare_environment(args)
+    workdir = os.getcwd()
+    
+    from app.services.answer_index import AnswerIndex
+    
+    try:
+        index = AnswerIndex(os.path.join(workdir, "answer_index"))
+        index.open()
+        result = build(index, args)
+        print(f"Построение: {args.vectors} вопросов за {result['elapsed']:.1f} с "
+              f"({args.vectors / result['elapsed']:.0f} в секунду), размерность {index.dim}, "
+              f"файл векторов {os.path.getsize(index.vectors_path) / 2 ** 20:.0f} МБ")
+        index.close()
+        
+        index = AnswerIndex(index.path)
+        started = time.perf_counter()
+        index.open()
+        print(f"Загрузка с диска: {time.perf_counter() - started:.2f} с, {len(index)} вопросов")
+        
+        # Запросы - сохраненные вопросы с опечаткой: ближайшим должен оказаться исходный
+        rng = random.Random(args.seed + 1)
+        ids = [rng.randrange(len(index)) for _ in range(args.queries)]
+        queries = [make_typo(rng, index.entry(entry_id)["q"]) for entry_id in ids]
+        
+        found = index.search_many(queries, args.k)
+        top1 = sum(
+            # Совпадение по тексту: тот же вопрос мог сгенерироваться несколько раз
+            bool(row) and index.entry(row[0][1])["q"] == index.entry(entry_id)["q"]
+            for row, entry_id in zip(found, ids)
+        )
+        print(f"Исходный вопрос ближайший для {top1 / len(ids):.1%} запросов с опечаткой, "
+              f"близость p50 {percentile([row[0][0] for row in found], 0.5):.3f}")
+        
+        single = measure_sync(index, queries, 1, args.k)
+        batched = measure_sync(index, queries, args.batch, args.k)
+        concurrent = asyncio.run(measure_concurrent(index, queries, args.batch, args.k))
+        print(f"  по одному: {single['qps']:.1f} запросов/с, p50 {single['p50_ms']:.0f} мс на запрос")
+        print(f"  батч {args.batch}: {batched['qps']:.1f} запросов/с, p50 {batched['p50_ms']:.0f} мс на батч")
+        print(f"  {args.batch} одновременно через search: {concurrent['qps']:.1f} запросов/с, "
+              f"p50 {concurrent['p50_ms']:.0f} мс, p95 {concurrent['p95_ms']:.0f} мс на запрос")
+        index.close()
+    finally:
+        os.chdir("/")
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк рассылки по таблице users с лимитами Telegram и без них
+
+Bot API подменяется сессией, которая ведет себя как Telegram под нагрузкой: больше
+--api-rate сообщений в секунду на бота или --api-chat-rate в один чат - ошибка 429
+(RetryAfter), каждый --blocked-every пользователь заблокировал бота. Во время рассылки
+каждые --interactive-interval с отправляется ответ пользователю вне рассылки.
+Прогоны: без OutboundLimitMiddleware и с ним. Сравниваются скорость рассылки,
+доставка, число 429 и задержка ответов пользователям.
+
+python broadcast_benchmark.py --users 1000 --api-latency 0.05
+"""
+
+import argparse
+import asyncio
+import time
+from datetime import datetime
+
+from load_test import prepare_environment, percentile
+
+INTERACTIVE_CHAT_ID = 10 ** 9
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000, help="пользователей в таблице users")
+    parser.add_argument("--api-latency", type=float, default=0.05, help="задержка ответа Bot API, с")
+    parser.add_argument("--api-rate", type=float, default=30, help="лимит Telegram: сообщений в секунду на бота")
+    parser.add_argument("--api-chat-rate", type=float, default=1, help="лимит Telegram: сообщений в секунду в чат")
+    parser.add_argument("--blocked-every", type=int, default=20, help="каждый N-й пользователь заблокировал бота")
+    parser.add_argument("--interactive-interval", type=float, default=0.2, help="интервал ответов пользователям, с")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="переопределение настройки из app/config.py")
+    return parser.parse_args()
+
+def create_telegram_session(args):
+    """Сессия aiogram, отвечающая как Telegram: 429 при превышении лимитов, 403 от заблокировавших"""
+    from aiogram.client.session.base import BaseSession
+    from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+    from aiogram.types import Chat, Message
+    from app.services.outbound import TokenBucket
+    
+    class TelegramSession(BaseSession):
+        def __init__(self):
+            super().__init__()
+            self.flood = 0
+            self._message_id = 0
+            self._global = TokenBucket(args.api_rate, int(args.api_rate))
+            self._chats = {}
+        
+        async def make_request(self, bot, method, timeout=None):
+            await asyncio.sleep(args.api_latency)
+            now = asyncio.get_running_loop().time()
+            chat = self._chats.setdefault(method.chat_id, TokenBucket(args.api_chat_rate, 3))
+            if self._global.delay(now) or chat.delay(now):
+                self.flood += 1
+                raise TelegramRetryAfter(method, "Too Many Requests: retry after 1", retry_after=1)
+            self._global.reserve(now)
+            chat.reserve(now)
+            
+            if method.chat_id < INTERACTIVE_CHAT_ID and method.chat_id % args.blocked_every == 0:
+                raise TelegramForbiddenError(method, "Forbidden: bot was blocked by the user")
+            self._message_id += 1
+            return Message(
+                message_id=self._message_id,
+                date=datetime.now(),
+                chat=Chat(id=method.chat_id, type="private"),
+                text=method.text
+            ).as_(bot)
+        
+        async def stream_content(self, *args, **kwargs):
+            raise NotImplementedError("stream_content is not used by the benchmark")
+            yield b""
+        
+        async def close(self):
+            pass
+    
+    return TelegramSession()
+
+async def run_once(args, limited: bool) -> dict:
+    from aiogram import Bot
+    from app.config import config
+    from app.middlewares.outbound import OutboundLimitMiddleware
+    from app.services.broadcast import Broadcaster
+    from app.services.outbound import OutboundScheduler
+    
+    bot = Bot(token=config.BOT_TOKEN)
+    session = bot.session = create_telegram_session(args)
+    if limited:
+        scheduler = OutboundScheduler(
+            global_rate=config.OUTBOUND_GLOBAL_RATE,
+            global_burst=config.OUTBOUND_GLOBAL_BURST,
+            chat_rate=config.OUTBOUND_CHAT_RATE,
+            chat_burst=config.OUTBOUND_CHAT_BURST
+        )
+        session.middleware(OutboundLimitMiddleware(scheduler))
+    
+    broadcaster = Broadcaster(page_size=config.BROADCAST_PAGE_SIZE, concurrency=config.BROADCAST_CONCURRENCY)
+    broadcast = asyncio.ensure_future(broadcaster.run(bot, "Скидки на смартфоны до конца недели!"))
+    
+    # Ответы пользователям, пока идет рассылка
+    latencies = []
+    interactive_failed = 0
+    i = 0
+    while not broadcast.done():
+        i += 1
+        started = time.perf_counter()
+        try:
+            await bot.send_message(INTERACTIVE_CHAT_ID + i, "Ответ консультанта")
+            latencies.append(time.perf_counter() - started)
+        except Exception:
+            interactive_failed += 1
+        await asyncio.sleep(args.interactive_interval)
+    
+    stats = await broadcast
+    elapsed = stats["finished"] - stats["started"]
+    return {
+        "elapsed": elapsed,
+        "rate": (stats["sent"] + stats["blocked"] + stats["failed"]) / elapsed,
+        "sent": stats["sent"],
+        "blocked": stats["blocked"],
+        "failed": stats["failed"],
+        "flood": session.flood,
+        "interactive_p50_ms": percentile(latencies, 0.5) * 1000,
+        "interactive_p95_ms": percentile(latencies, 0.95) * 1000,
+        "interactive_failed": interactive_failed,
+    }
+
+def main():
+    args = parse_args()
+    prepare_environment(args)
+    
+    import logging
+    # Ошибки доставки при рассылке без лимитов ожидаемы
+    logging.disable(logging.WARNING)
+    
+    from app.database.crud import UserCRUD
+    for start in range(1, args.users + 1, 1000):
+        UserCRUD.upsert_users([(user_id, None, None, None) for user_id in range(start, min(start + 1000, args.users + 1))])
+    
+    print(f"{args.users} пользователей, Bot API: {args.api_latency * 1000:.0f} мс, лимит {args.api_rate:.0f} сообщ/с, "
+          f"каждый {args.blocked_every}-й заблокировал бота")
+    for name, limited in (("без лимитов", False), ("с лимитами", True)):
+        r = asyncio.run(run_once(args, limited))
+        print(f"{name:>12}: {r['elapsed']:.1f} с, {r['rate']:.1f} сообщ/с, доставлено {r['sent']}, "
+              f"заблокировали {r['blocked']}, ошибок {r['failed']}, ответов 429: {r['flood']}")
+        print(f"{'':>12}  ответы пользователям: p50 {r['interactive_p50_ms']:.0f} мс, "
+              f"p95 {r['interactive_p95_ms']:.0f} мс, не доставлено {r['interactive_failed']}")
+
+if __name__ == "__main__":
+    main()
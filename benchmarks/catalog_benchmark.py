@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк поиска по каталогу товаров
+
+Строит индекс по синтетическому каталогу заданного размера и измеряет время
+построения, занимаемую память и задержку CatalogIndex.search на типичных
+запросах покупателей (с ценовыми ограничениями и без), а также размер
+контекста каталога, который попадает в промпт.
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PROJECT_DIR)
+
+# БД создается в текущей директории - уводим ее во временную
+os.chdir(tempfile.mkdtemp(prefix="shop_bot_bench_"))
+
+from app.services.catalog import CatalogIndex, catalog
+
+CATEGORIES = {
+    "Смартфоны": ("Смартфон", ["Apple", "Samsung", "Xiaomi", "Honor", "Realme"]),
+    "Ноутбуки": ("Ноутбук", ["Lenovo", "ASUS", "HP", "Acer", "Huawei"]),
+    "Наушники": ("Беспроводные наушники", ["Sony", "JBL", "Apple", "Sennheiser"]),
+    "Телевизоры": ("Телевизор", ["LG", "Samsung", "Sony", "Haier"]),
+    "Планшеты": ("Планшет", ["Apple", "Samsung", "Xiaomi", "Lenovo"]),
+    "Умные часы": ("Умные часы", ["Apple", "Garmin", "Huawei", "Amazfit"]),
+}
+
+FEATURES = [
+    "с ярким AMOLED-экраном", "с быстрой зарядкой", "с мощным процессором", "с шумоподавлением",
+    "с отличной камерой", "для игр", "для учебы и работы", "с защитой от воды", "с большим аккумулятором",
+    "в металлическом корпусе", "с поддержкой 5G", "с NFC",
+]
+
+QUERIES = [
+    "Какие у вас есть смартфоны Samsung?",
+    "Посоветуйте ноутбук для учебы до 60000 рублей",
+    "Нужны беспроводные наушники с шумоподавлением",
+    "телевизор LG 55 дюймов",
+    "планшет apple от 30 тыс",
+    "умные часы с защитой от воды дешевле 20000",
+    "смартфон с хорошей камерой и NFC",
+    "Сколько стоит доставка?",
+]
+
+def generate(count: int) -> list:
+    products = []
+    for i in range(count):
+        category = random.choice(list(CATEGORIES))
+        noun, brands = CATEGORIES[category]
+        brand = random.choice(brands)
+        features = random.sample(FEATURES, 3)
+        products.append({
+            "sku": f"SKU-{i:07d}",
+            "name": f"{noun} {brand} Model {random.randint(1, 999)} {random.choice([64, 128, 256, 512])}",
+            "category": category,
+            "brand": brand,
+            "price": float(random.randrange(3000, 250000, 10)),
+            "description": f"{noun} {features[0]}, {features[1]} и {features[2]}.",
+            "stock": random.choice([0, 0, 1, 3, 10, 25]),
+        })
+    return products
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--products", type=int, default=100000, help="размер каталога")
+    parser.add_argument("--lookups", type=int, default=5000, help="поисковых запросов")
+    args = parser.parse_args()
+    
+    random.seed(1)
+    products = generate(args.products)
+    
+    tracemalloc.start()
+    started = time.perf_counter()
+    index = CatalogIndex(products)
+    build = time.perf_counter() - started
+    memory = tracemalloc.get_traced_memory()[0] / 1024 / 1024
+    tracemalloc.stop()
+    print(f"Каталог {len(index)} товаров: индекс за {build:.2f} с, {memory:.1f} МБ (вместе с товарами)")
+    
+    print(f"\n{'запрос':<50} {'найдено':>8} {'p50, мкс':>10} {'p99, мкс':>10}")
+    for query in QUERIES:
+        found = index.search(query)
+        timings = []
+        for _ in range(args.lookups // len(QUERIES)):
+            started = time.perf_counter()
+            index.search(query)
+            timings.append(time.perf_counter() - started)
+        timings.sort()
+        print(f"{query[:50]:<50} {len(found):>8} "
+              f"{timings[len(timings) // 2] * 1e6:>10.1f} {timings[int(len(timings) * 0.99)] * 1e6:>10.1f}")
+    
+    catalog.index = index
+    context = catalog.prompt_context(QUERIES[1])
+    print(f"\nКонтекст промпта для \"{QUERIES[1]}\": {len(context)} символов")
+    print(context)
+
+if __name__ == "__main__":
+    main()
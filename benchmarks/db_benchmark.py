@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк пропускной способности обработки сообщений: синхронные CRUD,
+асинхронные CRUD со сквозной записью и с отложенной пакетной записью
+
+Имитирует поток одновременных апдейтов: на каждое сообщение выполняются те же
+операции с БД, что и в handle_all_messages, плюс ожидание ответа LLM.
+Параллельно измеряется задержка event loop - насколько запаздывают другие чаты.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PROJECT_DIR)
+
+# БД создается в текущей директории - уводим ее во временную
+os.chdir(tempfile.mkdtemp(prefix="shop_bot_bench_"))
+
+from app.config import config
+from app.database.crud import UserCRUD, ChatHistoryCRUD
+from app.database.async_crud import AsyncUserCRUD, AsyncChatHistoryCRUD
+from app.database.executor import shutdown_db_executor
+from app.database.history_cache import history_cache
+from app.database.write_behind import write_behind
+
+async def sync_update(user_id: int, llm_latency: float):
+    UserCRUD.get_or_create_user(user_id, f"user{user_id}", "Test", "User")
+    ChatHistoryCRUD.add_message(user_id, "user", "Какие у вас есть смартфоны?")
+    ChatHistoryCRUD.get_recent_history(user_id)
+    await asyncio.sleep(llm_latency)
+    ChatHistoryCRUD.add_message(user_id, "assistant", "У нас большой выбор смартфонов.")
+
+async def async_update(user_id: int, llm_latency: float):
+    await AsyncUserCRUD.ensure_user(user_id, f"user{user_id}", "Test", "User")
+    await AsyncChatHistoryCRUD.add_message(user_id, "user", "Какие у вас есть смартфоны?")
+    await AsyncChatHistoryCRUD.get_recent_history(user_id)
+    await asyncio.sleep(llm_latency)
+    await AsyncChatHistoryCRUD.add_message(user_id, "assistant", "У нас большой выбор смартфонов.")
+
+async def measure_loop_lag(interval: float, lags: list, stop: asyncio.Event):
+    """Насколько позже запланированного просыпается event loop"""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.sleep(interval)
+        lags.append(loop.time() - started - interval)
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+async def run(handler, updates: int, users: int, llm_latency: float) -> dict:
+    lags = []
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(measure_loop_lag(0.005, lags, stop))
+    
+    started = time.perf_counter()
+    await asyncio.gather(*(handler(i % users, llm_latency) for i in range(updates)))
+    elapsed = time.perf_counter() - started
+    
+    stop.set()
+    await lag_task
+    return {
+        "elapsed": elapsed,
+        "rate": updates / elapsed,
+        "lag_p99": percentile(lags, 0.99) * 1000,
+        "lag_max": max(lags, default=0.0) * 1000,
+    }
+
+def report(name: str, result: dict):
+    print(f"{name:>8}: {result['rate']:8.1f} сообщ/с за {result['elapsed']:.2f} с, "
+          f"задержка event loop p99 {result['lag_p99']:.1f} мс, max {result['lag_max']:.1f} мс")
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--updates", type=int, default=2000, help="количество сообщений")
+    parser.add_argument("--users", type=int, default=200, help="количество пользователей")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="имитация ответа LLM, с")
+    args = parser.parse_args()
+    
+    print(f"БД: {os.path.join(os.getcwd(), 'shop_bot.db')}")
+    print(f"{args.updates} сообщений от {args.users} пользователей, LLM {args.llm_latency * 1000:.0f} мс\n")
+    
+    report("sync", await run(sync_update, args.updates, args.users, args.llm_latency))
+    
+    config.WRITE_BEHIND_ENABLED = False
+    history_cache.clear()
+    report("async", await run(async_update, args.updates, args.users, args.llm_latency))
+    
+    config.WRITE_BEHIND_ENABLED = True
+    history_cache.clear()
+    write_behind.start()
+    report("batched", await run(async_update, args.updates, args.users, args.llm_latency))
+    await write_behind.stop()
+    
+    shutdown_db_executor()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк выборки истории диалога при росте таблицы chat_history
+
+Таблица последовательно наполняется до каждого из заданных размеров (число
+пользователей растет вместе с таблицей), после чего измеряется время
+ChatHistoryCRUD.get_recent_history для случайных пользователей.
+С индексом (user_id, timestamp) время выборки почти не зависит от размера таблицы.
+Для проверки на десятках миллионов строк: --sizes 1000000,10000000,30000000
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PROJECT_DIR)
+
+# БД создается в текущей директории - уводим ее во временную
+os.chdir(tempfile.mkdtemp(prefix="shop_bot_bench_"))
+
+from app.database.models import db
+from app.database.crud import ChatHistoryCRUD
+from app.database.retention import HistoryRetention
+
+def fill(current: int, target: int, users: int, chunk: int = 50000):
+    """Дозаполнение таблицы до target строк пачками"""
+    now = time.time()
+    with db.connection() as conn:
+        while current < target:
+            count = min(chunk, target - current)
+            rows = (
+                (
+                    random.randrange(users),
+                    "user" if i % 2 == 0 else "assistant",
+                    "Какой смартфон выбрать до 30000 рублей?",
+                    time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(now - random.uniform(0, 30 * 86400)))
+                )
+                for i in range(count)
+            )
+            conn.executemany(
+                "INSERT INTO chat_history (user_id, role, message, timestamp) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            conn.commit()
+            current += count
+    return current
+
+def measure(users: int, lookups: int) -> dict:
+    timings = []
+    for _ in range(lookups):
+        user_id = random.randrange(users)
+        started = time.perf_counter()
+        ChatHistoryCRUD.get_recent_history(user_id)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return {
+        "p50": timings[len(timings) // 2] * 1e6,
+        "p99": timings[int(len(timings) * 0.99)] * 1e6,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="100000,1000000,3000000", help="размеры таблицы через запятую")
+    parser.add_argument("--per-user", type=int, default=20, help="сообщений на пользователя")
+    parser.add_argument("--lookups", type=int, default=2000, help="выборок на каждый размер")
+    parser.add_argument("--retention", action="store_true", help="замерить проход очистки на итоговой таблице")
+    args = parser.parse_args()
+    
+    with db.connection() as conn:
+        plan = conn.execute(
+            """EXPLAIN QUERY PLAN SELECT role, message FROM chat_history
+            WHERE user_id = ? ORDER BY timestamp DESC, id DESC LIMIT ?""",
+            (1, 10)
+        ).fetchall()
+    print("План запроса:", "; ".join(row[3] for row in plan))
+    print(f"{'строк':>12} {'p50, мкс':>10} {'p99, мкс':>10}")
+    
+    rows = 0
+    for size in (int(s) for s in args.sizes.split(",")):
+        users = max(1, size // args.per_user)
+        rows = fill(rows, size, users)
+        result = measure(users, args.lookups)
+        print(f"{rows:>12} {result['p50']:>10.1f} {result['p99']:>10.1f}")
+    
+    if args.retention:
+        retention = HistoryRetention(db, max_messages=args.per_user, max_age_days=14, interval=0, vacuum_pages=10000)
+        started = time.perf_counter()
+        stats = retention.run_once()
+        print(f"\nОчистка: {stats} за {time.perf_counter() - started:.1f} с")
+        result = measure(users, args.lookups)
+        print(f"После очистки: p50 {result['p50']:.1f} мкс, p99 {result['p99']:.1f} мкс")
+    
+    db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк маршрутизации запросов к LLM: переключение провайдеров и страхующие запросы
+
+Yandex GPT (основной) и Ollama (резервный) подменяются локальными серверами из
+load_test. У основного "тяжелый хвост": доля запросов --slow-rate отвечает за
+--slow-latency вместо --latency, доля --error-rate завершается ошибкой 503.
+Один и тот же поток запросов прогоняется через LLMRouter без страхующих запросов
+и с ними (задержка - перцентиль LLM_HEDGE_PERCENTILE по прогреву), сравниваются
+p50/p95/p99 и число запросов к каждому провайдеру.
+
+python llm_router_benchmark.py --requests 2000 --slow-rate 0.03 --error-rate 0.01
+"""
+
+import argparse
+import asyncio
+import random
+import sys
+import time
+
+from load_test import prepare_environment, create_fake_yandex_app, percentile
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000, help="запросов в каждом прогоне")
+    parser.add_argument("--concurrency", type=int, default=20, help="запросов одновременно (не больше HTTP_POOL_LIMIT_PER_HOST)")
+    parser.add_argument("--latency", type=float, default=0.1, help="обычная задержка основного провайдера, с")
+    parser.add_argument("--slow-rate", type=float, default=0.03, help="доля медленных ответов основного")
+    parser.add_argument("--slow-latency", type=float, default=2.0, help="задержка медленного ответа, с")
+    parser.add_argument("--error-rate", type=float, default=0.01, help="доля ошибок 503 у основного")
+    parser.add_argument("--backup-latency", type=float, default=0.15, help="задержка резервного провайдера, с")
+    parser.add_argument("--warmup", type=int, default=200, help="запросов для статистики задержек")
+    parser.add_argument("--seed", type=int, default=1, help="seed генератора задержек")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="переопределение настройки из app/config.py")
+    return parser.parse_args()
+
+def create_flaky_app(args):
+    """Основной провайдер: тяжелый хвост задержек и редкие ошибки"""
+    from aiohttp import web
+    
+    app = create_fake_yandex_app(
+        lambda: args.slow_latency if random.random() < args.slow_rate else args.latency, 0.01, 5
+    )
+    
+    @web.middleware
+    async def errors(request, handler):
+        if random.random() < args.error_rate:
+            await asyncio.sleep(args.latency)
+            return web.Response(status=503, text="overloaded")
+        return await handler(request)
+    
+    app.middlewares.append(errors)
+    return app
+
+async def start_server(app) -> tuple:
+    from aiohttp import web
+    
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    return runner, site._server.sockets[0].getsockname()[1]
+
+async def measure(router, requests: int, concurrency: int) -> dict:
+    from app.services import metrics
+    
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    calls_before = {
+        name: metrics.LLM_REQUESTS.labels(name, "ok").get() + metrics.LLM_REQUESTS.labels(name, "error").get()
+        for name in ("yandex_gpt", "ollama")
+    }
+    
+    async def one(i):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await router.complete(f"Вопрос {i}", [])
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+    
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - started
+    
+    calls = {
+        name: metrics.LLM_REQUESTS.labels(name, "ok").get() + metrics.LLM_REQUESTS.labels(name, "error").get()
+        - calls_before[name]
+        for name in calls_before
+    }
+    return {
+        "elapsed": elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "errors": errors,
+        "calls": calls,
+    }
+
+async def run(args) -> dict:
+    from app.services.llm_router import LLMRouter
+    from app.services.ollama_service import ollama_service
+    from app.services.yandex_gpt_service import yandex_gpt_service
+    
+    primary, primary_port = await start_server(create_flaky_app(args))
+    backup, backup_port = await start_server(create_fake_yandex_app(args.backup_latency, 0.01, 5))
+    yandex_gpt_service.base_url = f"http://127.0.0.1:{primary_port}/completion"
+    ollama_service.base_url = f"http://127.0.0.1:{backup_port}"
+    
+    providers = [yandex_gpt_service, ollama_service]
+    plain = LLMRouter(providers)
+    hedged = LLMRouter(providers, hedge=True)
+    
+    # Прогрев: статистика задержек основного провайдера для срока страхующего запроса
+    random.seed(args.seed)
+    await measure(plain, args.warmup, args.concurrency)
+    
+    results = {}
+    for name, router in (("failover", plain), ("hedged", hedged)):
+        # Одинаковая последовательность медленных ответов и ошибок в обоих прогонах
+        random.seed(args.seed)
+        hedge_delay = hedged._hedge_delay(yandex_gpt_service)
+        results[name] = await measure(router, args.requests, args.concurrency)
+    
+    await plain.close()
+    await primary.cleanup()
+    await backup.cleanup()
+    return {"hedge_delay": hedge_delay, **results}
+
+def main():
+    args = parse_args()
+    prepare_environment(args)
+    
+    import logging
+    # Ошибки 503 основного провайдера ожидаемы
+    logging.disable(logging.ERROR)
+    
+    result = asyncio.run(run(args))
+    delay = result["hedge_delay"]
+    print(f"Основной: {args.latency * 1000:.0f} мс, {args.slow_rate:.0%} ответов за {args.slow_latency * 1000:.0f} мс, "
+          f"{args.error_rate:.0%} ошибок; резервный: {args.backup_latency * 1000:.0f} мс")
+    print(f"Срок страхующего запроса в начале прогона: {delay * 1000:.0f} мс" if delay
+          else "Срок страхующего запроса: нет данных")
+    for name in ("failover", "hedged"):
+        r = result[name]
+        print(f"{name:>8}: p50 {r['p50_ms']:.0f} мс, p95 {r['p95_ms']:.0f} мс, p99 {r['p99_ms']:.0f} мс, "
+              f"ошибок {r['errors']}, запросов yandex_gpt/ollama: {r['calls']['yandex_gpt']:.0f}/{r['calls']['ollama']:.0f}")
+    if result["failover"]["errors"] or result["hedged"]["errors"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
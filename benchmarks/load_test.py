@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест бота целиком: синтетические апдейты через Dispatcher из app/main.py
+
+Bot API подменяется сессией aiogram, которая отвечает без сети, Yandex GPT и Ollama -
+локальным aiohttp-сервером с настраиваемой задержкой (обычный и потоковый режим).
+Ollama вместо Yandex GPT: --env USE_OLLAMA=True --env LLM_PROVIDERS=ollama
+На выходе: сообщений в секунду, p50/p95/p99 времени обработки апдейта,
+время в БД и LLM по метрикам приложения, пиковая память процесса.
+
+Настройки приложения переопределяются так же, как в продакшене, через
+переменные окружения: --env LLM_STREAMING=False --env WRITE_BEHIND_ENABLED=False
+Для сравнения прогонов результат можно вывести одной строкой JSON (--json).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PROJECT_DIR)
+
+QUESTIONS = [
+    "Привет! Какие у вас есть смартфоны?",
+    "Посоветуйте ноутбук для учебы до 60000 рублей",
+    "Сколько стоит доставка?",
+    "Какая гарантия на технику?",
+    "Есть ли рассрочка?",
+    "Нужны беспроводные наушники с шумоподавлением",
+    "Чем отличается iPhone 15 от iPhone 15 Pro?",
+    "Можно ли вернуть товар?",
+]
+
+ANSWER = ("Рекомендую обратить внимание на несколько моделей: они отличаются камерой, "
+          "временем работы и ценой. Уточните бюджет, и я подберу лучший вариант.")
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=2000, help="количество апдейтов")
+    parser.add_argument("--users", type=int, default=500, help="количество пользователей")
+    parser.add_argument("--concurrency", type=int, default=200, help="апдейтов в обработке одновременно")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="задержка ответа фейкового Yandex GPT, с")
+    parser.add_argument("--llm-jitter", type=float, default=0.05, help="случайная добавка к задержке LLM, с")
+    parser.add_argument("--llm-chunks", type=int, default=5, help="фрагментов в потоковом ответе")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="задержка фейкового Bot API, с")
+    parser.add_argument("--seed", type=int, default=1, help="seed генератора апдейтов")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="переопределение настройки из app/config.py")
+    parser.add_argument("--json", action="store_true", help="вывести результат одной строкой JSON")
+    return parser.parse_args()
+
+def prepare_environment(args):
+    """Окружение до импорта приложения: конфиг читается при импорте"""
+    os.environ.update({
+        "BOT_TOKEN": "123456:LOAD-TEST",
+        "BOT_MODE": "polling",
+        "YANDEX_API_KEY": "load-test",
+        "YANDEX_FOLDER_ID": "load-test",
+        "USE_YANDEX_GPT": "True",
+        "METRICS_ENABLED": "False",
+        # Фейковый Bot API лимитов Telegram не имеет: --env OUTBOUND_LIMIT_ENABLED=True
+        "OUTBOUND_LIMIT_ENABLED": "False",
+        # Синтетические пользователи пишут чаще живых: --env THROTTLE_ENABLED=True
+        "THROTTLE_ENABLED": "False",
+    })
+    for item in args.env:
+        key, _, value = item.partition("=")
+        os.environ[key] = value
+    
+    # БД создается в текущей директории - уводим ее во временную
+    os.chdir(tempfile.mkdtemp(prefix="shop_bot_load_"))
+
+def create_fake_yandex_app(latency: float, jitter: float, chunks: int):
+    """Локальная замена Yandex GPT API (/completion) и Ollama (/api/chat): тот же формат ответа,
+    обычный и потоковый. latency может быть функцией без аргументов - задержкой каждого запроса
+    """
+    from aiohttp import web
+    
+    def request_delay():
+        return (latency() if callable(latency) else latency) + random.uniform(0, jitter)
+    
+    async def completion(request: web.Request) -> web.StreamResponse:
+        payload = await request.json()
+        delay = request_delay()
+        
+        if not payload["completionOptions"].get("stream"):
+            await asyncio.sleep(delay)
+            return web.json_response({"result": {"alternatives": [{"message": {"text": ANSWER}}]}})
+        
+        response = web.StreamResponse()
+        await response.prepare(request)
+        words = ANSWER.split()
+        for i in range(1, chunks + 1):
+            await asyncio.sleep(delay / chunks)
+            text = " ".join(words[:len(words) * i // chunks])
+            line = json.dumps({"result": {"alternatives": [{"message": {"text": text}}]}}, ensure_ascii=False)
+            await response.write(line.encode() + b"\n")
+        await response.write_eof()
+        return response
+    
+    async def ollama_chat(request: web.Request) -> web.StreamResponse:
+        payload = await request.json()
+        delay = request_delay()
+        
+        if not payload.get("stream", True):
+            await asyncio.sleep(delay)
+            return web.json_response({"message": {"role": "assistant", "content": ANSWER}, "done": True})
+        
+        # Ollama присылает приращения текста, последняя строка - done
+        response = web.StreamResponse()
+        await response.prepare(request)
+        words = ANSWER.split()
+        sent = 0
+        for i in range(1, chunks + 1):
+            await asyncio.sleep(delay / chunks)
+            end = len(words) * i // chunks
+            chunk = " ".join(words[sent:end]) + (" " if i < chunks else "")
+            sent = end
+            line = json.dumps({"message": {"role": "assistant", "content": chunk}, "done": False}, ensure_ascii=False)
+            await response.write(line.encode() + b"\n")
+        await response.write(json.dumps({"done": True}).encode() + b"\n")
+        await response.write_eof()
+        return response
+    
+    app = web.Application()
+    app.router.add_post("/completion", completion)
+    app.router.add_post("/api/chat", ollama_chat)
+    return app
+
+def create_fake_session(api_latency: float):
+    """Сессия aiogram без сети: отвечает на методы Bot API как Telegram"""
+    from aiogram.client.session.base import BaseSession
+    from aiogram.methods import SendMessage, EditMessageText
+    from aiogram.types import Chat, Message
+    
+    class FakeSession(BaseSession):
+        def __init__(self):
+            super().__init__()
+            self.calls = {}
+            self._message_id = 0
+        
+        async def make_request(self, bot, method, timeout=None):
+            name = type(method).__name__
+            self.calls[name] = self.calls.get(name, 0) + 1
+            if api_latency:
+                await asyncio.sleep(api_latency)
+            
+            if isinstance(method, (SendMessage, EditMessageText)):
+                self._message_id += 1
+                return Message(
+                    message_id=method.message_id if isinstance(method, EditMessageText) else self._message_id,
+                    date=datetime.now(),
+                    chat=Chat(id=method.chat_id, type="private"),
+                    text=method.text
+                ).as_(bot)
+            return True
+        
+        async def stream_content(self, *args, **kwargs):
+            raise NotImplementedError("stream_content is not used by the bot")
+            yield b""
+        
+        async def close(self):
+            pass
+    
+    return FakeSession()
+
+def make_updates(count: int, users: int):
+    from aiogram.types import Update
+    
+    updates = []
+    for i in range(count):
+        user_id = 100000 + random.randrange(users)
+        updates.append(Update.model_validate({
+            "update_id": i + 1,
+            "message": {
+                "message_id": i + 1,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": user_id, "is_bot": False, "first_name": "Load", "username": f"user{user_id}"},
+                "text": random.choice(QUESTIONS)
+            }
+        }))
+    return updates
+
+async def run(args) -> dict:
+    from aiohttp import web
+    from app.config import config
+    from app.main import create_bot, create_dispatcher
+    from app.services import metrics
+    from app.services.ollama_service import ollama_service
+    from app.services.yandex_gpt_service import yandex_gpt_service
+    
+    runner = web.AppRunner(create_fake_yandex_app(args.llm_latency, args.llm_jitter, args.llm_chunks), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    yandex_gpt_service.base_url = f"http://127.0.0.1:{port}/completion"
+    ollama_service.base_url = f"http://127.0.0.1:{port}"
+    
+    bot = create_bot()
+    dp = create_dispatcher()
+    session = create_fake_session(args.api_latency)
+    # Request-middleware (лимиты Telegram) переходят к подмененной сессии
+    session.middleware = bot.session.middleware
+    bot.session = session
+    updates = make_updates(args.updates, args.users)
+    
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    
+    latencies = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+    
+    async def feed(update):
+        async with semaphore:
+            started = time.perf_counter()
+            await dp.feed_update(bot, update)
+            latencies.append(time.perf_counter() - started)
+    
+    started = time.perf_counter()
+    await asyncio.gather(*(feed(update) for update in updates))
+    elapsed = time.perf_counter() - started
+    
+    await dp.emit_shutdown(bot=bot, dispatcher=dp)
+    await runner.cleanup()
+    
+    db_seconds, db_calls = metrics.DB_LATENCY.totals()
+    llm_seconds, llm_calls = metrics.LLM_LATENCY.totals()
+    return {
+        "updates": args.updates,
+        "users": args.users,
+        "streaming": config.LLM_STREAMING,
+        "write_behind": config.WRITE_BEHIND_ENABLED,
+        "elapsed": elapsed,
+        "rate": args.updates / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "db_seconds": db_seconds,
+        "db_calls": db_calls,
+        "llm_seconds": llm_seconds,
+        "llm_calls": llm_calls,
+        "api_calls": session.calls,
+        # ru_maxrss в Linux - в килобайтах
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+def report(result: dict):
+    print(f"{result['updates']} апдейтов от {result['users']} пользователей "
+          f"(потоковый режим: {result['streaming']}, пакетная запись: {result['write_behind']})")
+    print(f"Пропускная способность: {result['rate']:.1f} сообщ/с за {result['elapsed']:.2f} с")
+    print(f"Время апдейта: p50 {result['p50_ms']:.1f} мс, p95 {result['p95_ms']:.1f} мс, p99 {result['p99_ms']:.1f} мс")
+    print(f"БД: {result['db_calls']} вызовов, {result['db_seconds']:.2f} с суммарно")
+    print(f"LLM: {result['llm_calls']} запросов, {result['llm_seconds']:.2f} с суммарно")
+    print(f"Bot API: {result['api_calls']}")
+    print(f"Пиковая память процесса: {result['max_rss_mb']:.1f} МБ")
+
+def main():
+    args = parse_args()
+    random.seed(args.seed)
+    prepare_environment(args)
+    
+    import logging
+    logging.disable(logging.WARNING)
+    
+    result = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False))
+    else:
+        report(result)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк оформления заказов с резервированием остатков
+
+Множество покупателей одновременно заказывают небольшой набор "горячих"
+товаров с ограниченным остатком. Режим crud вызывает AsyncOrderCRUD.place_order
+напрямую, режим flow проходит весь диалог оформления через Dispatcher
+(кнопка заказа, поиск, выбор товара, количество, подтверждение) с Bot API без сети.
+После прогона проверяется, что ни один товар не продан сверх остатка,
+а счетчики заказов пользователей сходятся с таблицей orders.
+
+БД выбирается как в боте: --env DATABASE_URL=postgresql://localhost/shop_bot
+(заказы прошлых прогонов в той же БД учитываются при проверке).
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import re
+import sys
+import time
+
+from load_test import prepare_environment, create_fake_session, percentile
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["crud", "flow"], default="crud", help="что измерять")
+    parser.add_argument("--orders", type=int, default=5000, help="попыток оформить заказ")
+    parser.add_argument("--users", type=int, default=1000, help="количество покупателей")
+    parser.add_argument("--concurrency", type=int, default=100, help="заказов в обработке одновременно")
+    parser.add_argument("--products", type=int, default=1000, help="товаров в каталоге")
+    parser.add_argument("--hot", type=int, default=10, help="товаров, которые заказывают все")
+    parser.add_argument("--stock", type=int, default=500, help="начальный остаток каждого товара")
+    parser.add_argument("--seed", type=int, default=1, help="seed генератора заказов")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="переопределение настройки из app/config.py")
+    return parser.parse_args()
+
+async def seed_catalog(count: int, stock: int) -> list:
+    from app.database.crud import ProductCRUD
+    from app.database.executor import run_query
+    
+    products = [{
+        "sku": f"SKU-{i:05d}",
+        "name": f"Смартфон Model {i}",
+        "category": "Смартфоны",
+        "brand": "Samsung",
+        "price": float(10000 + i * 10),
+        "description": None,
+        "stock": stock,
+    } for i in range(count)]
+    await run_query(ProductCRUD.upsert_products, products)
+    return products
+
+async def fetch_all(query: str, *args) -> list:
+    """Строки запроса на выбранной БД (параметры в запросе - $1, $2, ...)"""
+    from app.database.executor import run_in_db_thread
+    from app.database.models import db
+    from app.database.postgres import pg_db
+    
+    if pg_db is not None:
+        async with pg_db.connection() as conn:
+            return [tuple(row) for row in await conn.fetch(query, *args)]
+    
+    def fetch():
+        with db.connection() as conn:
+            return [tuple(row) for row in conn.execute(re.sub(r"\$\d+", "?", query), args)]
+    return await run_in_db_thread(fetch)
+
+async def snapshot(skus: list) -> dict:
+    """Проданное по заказам количество, число заказов и сумма счетчиков пользователей"""
+    ordered = {}
+    orders = 0
+    for (items,) in await fetch_all("SELECT products FROM orders"):
+        orders += 1
+        for item in json.loads(items):
+            ordered[item["sku"]] = ordered.get(item["sku"], 0) + item["quantity"]
+    
+    stock = {sku: value for sku, value in await fetch_all("SELECT sku, stock FROM products") if sku in skus}
+    orders_count = (await fetch_all("SELECT COALESCE(SUM(orders_count), 0) FROM users"))[0][0]
+    return {"ordered": ordered, "orders": orders, "stock": stock, "orders_count": orders_count}
+
+def make_flow_updates(user_id: int, sku: str, quantity: int, counter) -> list:
+    """Апдейты одного оформления: кнопка, поиск, выбор товара, количество, подтверждение"""
+    from aiogram.types import Update
+    
+    user = {"id": user_id, "is_bot": False, "first_name": "Order", "username": f"user{user_id}"}
+    chat = {"id": user_id, "type": "private"}
+    
+    def message(text):
+        update_id = next(counter)
+        return {"update_id": update_id, "message": {
+            "message_id": update_id, "date": int(time.time()), "chat": chat, "from": user, "text": text
+        }}
+    
+    def callback(data):
+        update_id = next(counter)
+        return {"update_id": update_id, "callback_query": {
+            "id": str(update_id), "from": user, "chat_instance": str(user_id), "data": data,
+            "message": {"message_id": update_id, "date": int(time.time()), "chat": chat, "text": "Корзина"}
+        }}
+    
+    return [Update.model_validate(update) for update in (
+        message("📦 Сделать заказ"),
+        message("смартфон samsung"),
+        callback(f"cart:add:{sku}"),
+        message(str(quantity)),
+        callback("cart:confirm:"),
+    )]
+
+async def run(args) -> dict:
+    from itertools import count
+    from app.database.async_crud import AsyncOrderCRUD
+    from app.database.crud import OutOfStockError
+    from app.main import create_bot, create_dispatcher
+    
+    products = await seed_catalog(args.products, args.stock)
+    hot = [product["sku"] for product in products[:args.hot]]
+    before = await snapshot(hot)
+    
+    # Покупатель оформляет свои заказы по очереди, разные покупатели - одновременно
+    plans = {}
+    for _ in range(args.orders):
+        user_id = 100000 + random.randrange(args.users)
+        plans.setdefault(user_id, []).append((random.choice(hot), random.randint(1, 3)))
+    
+    bot = create_bot()
+    dp = create_dispatcher()
+    session = create_fake_session(0)
+    bot.session = session
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    
+    latencies = []
+    outcomes = {"placed": 0, "out_of_stock": 0}
+    semaphore = asyncio.Semaphore(args.concurrency)
+    counter = count(1)
+    
+    async def customer(user_id, orders):
+        for sku, quantity in orders:
+            updates = make_flow_updates(user_id, sku, quantity, counter) if args.mode == "flow" else []
+            async with semaphore:
+                started = time.perf_counter()
+                if args.mode == "crud":
+                    try:
+                        await AsyncOrderCRUD.place_order(user_id, [(sku, quantity)])
+                        outcomes["placed"] += 1
+                    except OutOfStockError:
+                        outcomes["out_of_stock"] += 1
+                else:
+                    for update in updates:
+                        await dp.feed_update(bot, update)
+                latencies.append(time.perf_counter() - started)
+    
+    started = time.perf_counter()
+    await asyncio.gather(*(customer(user_id, orders) for user_id, orders in plans.items()))
+    elapsed = time.perf_counter() - started
+    
+    # Проверка целостности: списано ровно столько, сколько заказано, и не больше остатка
+    after = await snapshot(hot)
+    await dp.emit_shutdown(bot=bot, dispatcher=dp)
+    
+    ordered = {sku: after["ordered"].get(sku, 0) - before["ordered"].get(sku, 0) for sku in hot}
+    stock = after["stock"]
+    orders = after["orders"] - before["orders"]
+    orders_count = after["orders_count"] - before["orders_count"]
+    oversold = [sku for sku in hot if stock[sku] < 0 or args.stock - stock[sku] != ordered[sku]]
+    if args.mode == "flow":
+        outcomes["placed"] = orders
+        outcomes["out_of_stock"] = args.orders - orders
+    
+    return {
+        "mode": args.mode,
+        "attempts": args.orders,
+        "elapsed": elapsed,
+        "rate": args.orders / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "placed": outcomes["placed"],
+        "out_of_stock": outcomes["out_of_stock"],
+        "sold": sum(ordered.values()),
+        "available": args.hot * args.stock,
+        "oversold": oversold,
+        "counts_match": orders_count == orders == outcomes["placed"],
+    }
+
+def main():
+    args = parse_args()
+    random.seed(args.seed)
+    prepare_environment(args)
+    
+    import logging
+    logging.disable(logging.WARNING)
+    
+    result = asyncio.run(run(args))
+    print(f"Режим {result['mode']}: {result['attempts']} попыток за {result['elapsed']:.2f} с "
+          f"({result['rate']:.0f} заказов/с)")
+    print(f"Время оформления: p50 {result['p50_ms']:.1f} мс, p99 {result['p99_ms']:.1f} мс")
+    print(f"Оформлено: {result['placed']}, отказ (нет остатка): {result['out_of_stock']}")
+    print(f"Продано {result['sold']} шт. из {result['available']} в наличии")
+    print(f"Перепроданные товары: {result['oversold'] or 'нет'}")
+    print(f"Счетчики заказов пользователей сходятся: {'да' if result['counts_match'] else 'НЕТ'}")
+    if result["oversold"] or not result["counts_match"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
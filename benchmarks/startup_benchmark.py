@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк запуска бота: время импорта модулей и холодного старта до готовности
+
+Каждый замер - в новом процессе Python во временной директории с подготовленными
+данными: БД с --products товарами и индекс ответов из --answers вопросов.
+Импорт: модули --modules по отдельности; после импорта проверяется, не появились ли
+в рабочей директории файлы (БД при импорте). Холодный старт: импорт app.main,
+создание бота и диспетчера, startup диспетчера (миграции БД, каталог, индекс ответов);
+полное время - от запуска процесса до готовности принимать апдейты.
+--root - дерево приложения другой ревизии для сравнения (git worktree).
+
+python startup_benchmark.py --runs 5 --products 20000 --answers 200000
+"""
+
+import argparse
+import json
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from load_test import PROJECT_DIR, prepare_environment, percentile
+
+MODULES = "app.config,app.database.crud,app.services.llm_service,app.main"
+
+IMPORT_CODE = """
+import json, os, sys, time
+sys.path.insert(0, {root!r})
+before = set(os.listdir())
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+print(json.dumps({{"import": elapsed, "files": sorted(set(os.listdir()) - before)}}))
+"""
+
+STARTUP_CODE = """
+import asyncio, json, logging, sys, time
+sys.path.insert(0, {root!r})
+started = time.perf_counter()
+import app.main as main
+imported = time.perf_counter()
+logging.disable(logging.WARNING)
+
+async def run():
+    # Ревизии до фабрик создавали бота и диспетчер при импорте
+    bot = main.create_bot() if hasattr(main, "create_bot") else main.bot
+    dp = main.create_dispatcher() if hasattr(main, "create_dispatcher") else main.dp
+    created = time.perf_counter()
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    ready = time.perf_counter()
+    print(json.dumps({{
+        "import": imported - started,
+        "factory": created - imported,
+        "startup": ready - created
+    }}), flush=True)
+    await dp.emit_shutdown(bot=bot, dispatcher=dp)
+    await bot.session.close()
+
+asyncio.run(run())
+"""
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="процессов на каждый замер")
+    parser.add_argument("--products", type=int, default=20000, help="товаров в каталоге")
+    parser.add_argument("--answers", type=int, default=200000, help="вопросов в индексе ответов")
+    parser.add_argument("--modules", default=MODULES, help="модули для замера импорта, через запятую")
+    parser.add_argument("--root", default=PROJECT_DIR, help="дерево приложения")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="переопределение настройки из app/config.py")
+    return parser.parse_args()
+
+def seed(args):
+    """БД с каталогом и индекс ответов в рабочей директории"""
+    from app.config import config
+    from app.database.crud import ProductCRUD
+    from app.services.answer_index import AnswerIndex
+    
+    rng = random.Random(1)
+    brands = ["Apple", "Samsung", "Xiaomi", "Lenovo", "Sony", "LG"]
+    nouns = ["Смартфон", "Ноутбук", "Наушники", "Планшет", "Телевизор"]
+    for start in range(0, args.products, 5000):
+        ProductCRUD.upsert_products([{
+            "sku": f"SKU-{i:06d}",
+            "name": f"{rng.choice(nouns)} {rng.choice(brands)} Model {i}",
+            "category": None,
+            "brand": None,
+            "price": float(rng.randint(1000, 200000)),
+            "description": None,
+            "stock": rng.randint(0, 50),
+        } for i in range(start, min(start + 5000, args.products))])
+    
+    index = AnswerIndex(config.ANSWER_INDEX_PATH, dim=config.ANSWER_INDEX_DIM)
+    index.open()
+    for start in range(0, args.answers, 50000):
+        size = min(50000, args.answers - start)
+        index.add_many(
+            [f"Сколько стоит {rng.choice(nouns).lower()} {rng.randint(1, 99999)}?" for _ in range(size)],
+            [f"Ответ {start + i}" for i in range(size)],
+            [0] * size
+        )
+    index.close()
+
+def run_child(code: str, cwd: str = None) -> tuple:
+    """Результат дочернего процесса и время от его запуска до первой строки вывода"""
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-c", code], stdout=subprocess.PIPE, text=True, cwd=cwd)
+    line = process.stdout.readline()
+    elapsed = time.perf_counter() - started
+    process.communicate()
+    if process.returncode or not line:
+        raise Exception(f"Child process failed with code {process.returncode}")
+    return json.loads(line), elapsed
+
+def import_once(root: str, module: str) -> dict:
+    # Импорт - в пустой директории: так видно, создает ли он БД
+    with tempfile.TemporaryDirectory(prefix="shop_bot_import_") as cwd:
+        return run_child(IMPORT_CODE.format(root=root, module=module), cwd=cwd)[0]
+
+def median(values: list) -> float:
+    return percentile(values, 0.5)
+
+def main():
+    args = parse_args()
+    prepare_environment(args)
+    seed(args)
+    print(f"Дерево: {args.root}, каталог {args.products} товаров, индекс ответов {args.answers} вопросов, "
+          f"медиана {args.runs} процессов")
+    
+    for module in args.modules.split(","):
+        runs = [import_once(args.root, module) for _ in range(args.runs)]
+        files = sorted({name for run in runs for name in run["files"]})
+        print(f"  импорт {module:<26} {median([run['import'] for run in runs]) * 1000:7.0f} мс"
+              f"{', создает файлы: ' + ', '.join(files) if files else ''}")
+    
+    results = [run_child(STARTUP_CODE.format(root=args.root)) for _ in range(args.runs)]
+    stages = [result for result, _ in results]
+    print(f"  холодный старт: импорт app.main {median([s['import'] for s in stages]):.2f} с, "
+          f"бот и диспетчер {median([s['factory'] for s in stages]) * 1000:.0f} мс, "
+          f"startup {median([s['startup'] for s in stages]):.2f} с")
+    print(f"  от запуска процесса до готовности: {median([elapsed for _, elapsed in results]):.2f} с")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк антифлуда: ответы покупателям, пока несколько пользователей засыпают бота сообщениями
+
+--spammers пользователей шлют по --spam-rate сообщений в секунду (разный текст - мимо
+кэша ответов), --customers покупателей - по вопросу раз в --customer-interval с.
+Апдейты поступают по расписанию в течение --duration с и обрабатываются отдельными
+задачами, как при polling. Прогоны без ThrottlingMiddleware и с ним - каждый в своем
+процессе: настройки читаются при импорте app. Сравниваются время ответа
+покупателям, число запросов к LLM и БД и число отброшенных апдейтов.
+
+python throttling_benchmark.py --spammers 10 --spam-rate 20 --customers 50 --duration 10
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import sys
+import time
+
+from load_test import (QUESTIONS, create_fake_session, create_fake_yandex_app,
+                       percentile, prepare_environment)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--spammers", type=int, default=10, help="пользователей, засыпающих бота сообщениями")
+    parser.add_argument("--spam-rate", type=float, default=20, help="сообщений в секунду от каждого из них")
+    parser.add_argument("--customers", type=int, default=50, help="обычных покупателей")
+    parser.add_argument("--customer-interval", type=float, default=5, help="интервал вопросов покупателя, с")
+    parser.add_argument("--duration", type=float, default=10, help="длительность потока апдейтов, с")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="задержка ответа фейкового Yandex GPT, с")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="задержка фейкового Bot API, с")
+    parser.add_argument("--seed", type=int, default=1, help="seed генератора апдейтов")
+    parser.add_argument("--throttle", choices=("on", "off"), help="один прогон в этом процессе, результат - JSON")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="переопределение настройки из app/config.py")
+    return parser.parse_args()
+
+def make_schedule(args) -> list:
+    """(время от начала, апдейт, от покупателя ли) по возрастанию времени"""
+    from aiogram.types import Update
+    
+    rng = random.Random(args.seed)
+    senders = [(1000 + i, 1 / args.spam_rate, False) for i in range(args.spammers)]
+    senders += [(100000 + i, args.customer_interval, True) for i in range(args.customers)]
+    
+    events = []
+    for user_id, interval, customer in senders:
+        at = rng.uniform(0, interval)
+        while at < args.duration:
+            events.append((at, user_id, customer))
+            at += interval
+    events.sort()
+    
+    return [(at, Update.model_validate({
+        "update_id": i + 1,
+        "message": {
+            "message_id": i + 1,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Bench"},
+            # Номер в тексте - мимо кэша ответов и индекса похожих вопросов
+            "text": f"{rng.choice(QUESTIONS)} #{i}"
+        }
+    }), customer) for i, (at, user_id, customer) in enumerate(events)]
+
+async def run(args) -> dict:
+    from aiohttp import web
+    from app.main import create_bot, create_dispatcher
+    from app.services import metrics
+    from app.services.yandex_gpt_service import yandex_gpt_service
+    
+    runner = web.AppRunner(create_fake_yandex_app(args.llm_latency, 0, 5), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    yandex_gpt_service.base_url = f"http://127.0.0.1:{port}/completion"
+    
+    bot = create_bot()
+    dp = create_dispatcher()
+    session = create_fake_session(args.api_latency)
+    session.middleware = bot.session.middleware
+    bot.session = session
+    schedule = make_schedule(args)
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    
+    loop = asyncio.get_running_loop()
+    latencies = []
+    
+    async def feed(update, customer):
+        started = loop.time()
+        await dp.feed_update(bot, update)
+        if customer:
+            latencies.append(loop.time() - started)
+    
+    tasks = []
+    started = loop.time()
+    for at, update, customer in schedule:
+        delay = started + at - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.ensure_future(feed(update, customer)))
+    await asyncio.gather(*tasks)
+    
+    await dp.emit_shutdown(bot=bot, dispatcher=dp)
+    await runner.cleanup()
+    
+    _, db_calls = metrics.DB_LATENCY.totals()
+    _, llm_calls = metrics.LLM_LATENCY.totals()
+    return {
+        "updates": len(schedule),
+        "customer_updates": len(latencies),
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "max_ms": max(latencies, default=0) * 1000,
+        "llm_calls": llm_calls,
+        "llm_rejected": metrics.LLM_REJECTED.labels().get(),
+        "db_calls": db_calls,
+        "dropped": sum(metrics.THROTTLED.labels(scope, "dropped").get() for scope in ("user", "chat")),
+        "delayed": sum(metrics.THROTTLED.labels(scope, "delayed").get() for scope in ("user", "chat")),
+    }
+
+def run_child(throttle: str) -> dict:
+    """Прогон в отдельном процессе с теми же аргументами"""
+    command = [sys.executable, __file__, "--throttle", throttle] + sys.argv[1:]
+    output = subprocess.run(command, stdout=subprocess.PIPE, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    args = parse_args()
+    if args.throttle is None:
+        print(f"{args.spammers} флудящих по {args.spam_rate:.0f} сообщ/с, {args.customers} покупателей "
+              f"(вопрос раз в {args.customer_interval:.0f} с), {args.duration:.0f} с, LLM {args.llm_latency * 1000:.0f} мс")
+        for name, throttle in (("без антифлуда", "off"), ("с антифлудом", "on")):
+            r = run_child(throttle)
+            print(f"{name:>14}: покупатели p50 {r['p50_ms']:.0f} мс, p95 {r['p95_ms']:.0f} мс, max {r['max_ms']:.0f} мс "
+                  f"({r['customer_updates']} вопросов из {r['updates']} апдейтов)")
+            print(f"{'':>14}  LLM: {r['llm_calls']} запросов, отказов по очереди {r['llm_rejected']:.0f}; "
+                  f"БД: {r['db_calls']} вызовов; отброшено {r['dropped']:.0f}, задержано {r['delayed']:.0f}")
+        return
+    
+    args.env.append(f"THROTTLE_ENABLED={args.throttle == 'on'}")
+    prepare_environment(args)
+    
+    import logging
+    logging.disable(logging.WARNING)
+    
+    print(json.dumps(asyncio.run(run(args))))
+
+if __name__ == "__main__":
+    main()
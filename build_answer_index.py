@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Построение индекса прошлых ответов консультанта из истории чатов
+
+Пары "вопрос пользователя - следующий за ним ответ ассистента" читаются из chat_history
+страницами по id; резервные ответы и сообщения о недоступности сервиса пропускаются.
+Индекс строится заново во временных файлах и заменяет ANSWER_INDEX_PATH целиком -
+запущенный бот увидит его после перезапуска. Контекст исторических ответов (товары
+и цены в промпте) неизвестен, поэтому они попадают в промпт только как образцы и не
+отдаются без LLM; готовыми ответами становятся новые ответы работающего бота.
+
+Пример: python build_answer_index.py --page-size 5000
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+from dotenv import load_dotenv
+
+# Добавляем путь к проекту
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+load_dotenv()
+
+async def build(index, page_size: int, batch_size: int) -> dict:
+    from app.database.async_crud import run_query
+    from app.database.crud import ChatHistoryCRUD
+    from app.services.llm_service import llm_service, BUSY_MESSAGE, NOT_CONFIGURED_MESSAGE, ERROR_MESSAGE
+    
+    skipped_answers = {BUSY_MESSAGE, NOT_CONFIGURED_MESSAGE, ERROR_MESSAGE}
+    stats = {"messages": 0, "pairs": 0, "skipped": 0}
+    questions = {}
+    batch = ([], [], [])
+    last_id = 0
+    
+    while True:
+        rows = await run_query(ChatHistoryCRUD.get_messages_after, last_id, page_size)
+        if not rows:
+            break
+        last_id = rows[-1]["id"]
+        stats["messages"] += len(rows)
+        
+        for row in rows:
+            if row["role"] == "user":
+                questions[row["user_id"]] = row["message"]
+                continue
+            
+            # Ответ относится к последнему вопросу пользователя, если ответа на него еще не было
+            question = questions.pop(row["user_id"], None)
+            if question is None:
+                continue
+            answer = row["message"]
+            if answer in skipped_answers or answer == llm_service._get_fallback_response(question):
+                stats["skipped"] += 1
+                continue
+            
+            for column, value in zip(batch, (question, answer, 0)):
+                column.append(value)
+            if len(batch[0]) >= batch_size:
+                index.add_many(*batch)
+                stats["pairs"] += len(batch[0])
+                batch = ([], [], [])
+    
+    index.add_many(*batch)
+    stats["pairs"] += len(batch[0])
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--path", help="путь индекса (по умолчанию ANSWER_INDEX_PATH)")
+    parser.add_argument("--page-size", type=int, default=5000, help="сообщений за один запрос к БД")
+    parser.add_argument("--batch-size", type=int, default=10000, help="пар в одной записи в индекс")
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO)
+    
+    from app.config import config
+    from app.database.executor import shutdown_db_executor
+    from app.database.postgres import pg_db
+    from app.services.answer_index import AnswerIndex
+    
+    path = args.path or config.ANSWER_INDEX_PATH
+    index = AnswerIndex(f"{path}.tmp", dim=config.ANSWER_INDEX_DIM)
+    for tmp_path in (index.vectors_path, index.entries_path):
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    index.open()
+    
+    async def run():
+        try:
+            return await build(index, args.page_size, args.batch_size)
+        finally:
+            if pg_db is not None:
+                await pg_db.close()
+    
+    started = time.perf_counter()
+    try:
+        stats = asyncio.run(run())
+    finally:
+        index.close()
+        shutdown_db_executor()
+    
+    # Файлы заменяются после полной записи - прерванная сборка не портит рабочий индекс
+    os.replace(index.vectors_path, f"{path}.vectors")
+    os.replace(index.entries_path, f"{path}.jsonl")
+    
+    print(f"💬 Прочитано сообщений: {stats['messages']}")
+    print(f"   Пар вопрос-ответ: {stats['pairs']}, пропущено резервных ответов: {stats['skipped']}")
+    print(f"✅ Индекс: {path}.vectors, {path}.jsonl (размерность {config.ANSWER_INDEX_DIM})")
+    print(f"⏱️  {time.perf_counter() - started:.1f} с")
+
+if __name__ == "__main__":
+    main()
@@ -63,6 +63,8 @@ async def test_yandex_gpt():
             print("   - Блокировку firewall")
         
         return False
+    finally:
+        await service.close()
 
 async def test_simple_request():
     """Простой тест напрямую через aiohttp"""
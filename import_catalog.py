@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Импорт прайс-листа в каталог товаров
+
+Поддерживаются CSV и JSONL (в том числе сжатые .gz). Колонки: sku/артикул,
+name/название, category/категория, brand/бренд, price/цена, description/описание,
+stock/остаток. Запущенный бот подхватывает изменения сам (CATALOG_RELOAD_INTERVAL).
+
+Пример: python import_catalog.py prices.csv --delimiter ";" --missing zero
+"""
+
+import argparse
+import logging
+import os
+import sys
+from dotenv import load_dotenv
+
+# Добавляем путь к проекту
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+load_dotenv()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="файл прайс-листа")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="формат файла (по умолчанию по расширению)")
+    parser.add_argument("--delimiter", default=",", help="разделитель CSV")
+    parser.add_argument("--chunk-size", type=int, help="строк в одной транзакции")
+    parser.add_argument("--missing", choices=["keep", "zero", "delete"], default="keep",
+                        help="товары, которых нет в файле: оставить, обнулить остаток или удалить")
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO)
+    
+    from app.config import config
+    from app.database.models import db
+    from app.database.catalog_import import CatalogImporter
+    
+    if db is None:
+        # Импорт пишет пачками через соединение SQLite (временные таблицы, executemany)
+        sys.exit("❌ Импорт каталога поддерживает только SQLite (DATABASE_URL - путь к файлу)")
+    
+    importer = CatalogImporter(db, chunk_size=args.chunk_size or config.CATALOG_IMPORT_CHUNK_SIZE)
+    try:
+        stats = importer.run(args.path, fmt=args.format, delimiter=args.delimiter, missing=args.missing)
+    finally:
+        db.close()
+    
+    print(f"📦 Прочитано строк: {stats['read']}, пропущено: {stats['skipped']}")
+    print(f"   Новых товаров: {stats['inserted']}, изменено: {stats['updated']}, без изменений: {stats['unchanged']}")
+    if args.missing != "keep":
+        print(f"   Отсутствуют в файле ({args.missing}): {stats['missing']}")
+    if "version" in stats:
+        print(f"✅ Версия каталога: {stats['version']} - бот перестроит поисковый индекс")
+    else:
+        print("✅ Каталог не изменился")
+    print(f"⏱️  {stats['elapsed']} с")
+
+if __name__ == "__main__":
+    main()
@@ -60,9 +60,49 @@ async def test_bot_functionality():
     else:
         print("   ⚠️  Yandex GPT не настроен, будут использоваться локальные ответы")
     
+    # Тест метрик (секретный токен webhook проверяет tests/test_webhook.py)
+    print("4. Проверка метрик...")
+    try:
+        await test_metrics()
+        print("   ✅ Метрики собираются и отдаются на /metrics")
+    except Exception as e:
+        print(f"   ❌ Ошибка метрик: {e}")
+        return False
+    
     print("\n🎉 Все системы работают! Бот готов к запуску.")
     return True
 
+async def test_metrics():
+    """Проверка счетчиков после поддельного апдейта Telegram и экспорта /metrics"""
+    from aiohttp.test_utils import TestClient, TestServer
+    from app.main import create_bot, create_dispatcher
+    from app.services.metrics import REGISTRY, create_metrics_app
+    
+    update = {
+        "update_id": 1,
+        "edited_message": {
+            "message_id": 1,
+            "date": 0,
+            "chat": {"id": 123, "type": "private"},
+            "from": {"id": 123, "is_bot": False, "first_name": "Test"},
+            "text": "Привет"
+        }
+    }
+    
+    bot = create_bot()
+    await create_dispatcher().feed_raw_update(bot, update)
+    await bot.session.close()
+    
+    updates = REGISTRY.get_sample_value("bot_updates_total", {"type": "edited_message"})
+    assert updates, "апдейт не посчитан"
+    
+    async with TestClient(TestServer(create_metrics_app())) as client:
+        response = await client.get("/metrics")
+        assert response.status == 200, f"ожидался 200, получен {response.status}"
+        text = await response.text()
+        assert "llm_request_duration_seconds" in text
+        assert "db_call_duration_seconds" in text
+
 if __name__ == "__main__":
     success = asyncio.run(test_bot_functionality())
     
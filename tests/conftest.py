@@ -0,0 +1,20 @@
+"""Окружение тестов: конфиг читается при импорте app, поэтому задается здесь, до тестовых модулей"""
+
+import os
+import sys
+import tempfile
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+# БД и индекс ответов - во временной директории, а не в дереве проекта
+DATA_DIR = tempfile.mkdtemp(prefix="shop_bot_tests_")
+
+os.environ.setdefault("BOT_TOKEN", "123456:TEST")
+os.environ.setdefault("DATABASE_URL", os.path.join(DATA_DIR, "shop_bot.db"))
+os.environ.setdefault("ANSWER_INDEX_PATH", os.path.join(DATA_DIR, "answer_index"))
+os.environ.update({
+    "METRICS_ENABLED": "False",
+    "USE_YANDEX_GPT": "False",
+    "USE_OLLAMA": "False",
+})
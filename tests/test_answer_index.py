@@ -0,0 +1,41 @@
+import pytest
+
+from app.config import config
+from app.services.answer_index import AnswerIndex, embed
+
+PAIRS = [
+    ("Есть ли в наличии iPhone 15?", "Есть ли в наличии iPhone 13?"),
+    ("ноутбук для игр до 50000", "ноутбук для игр до 150000"),
+]
+
+@pytest.fixture
+def index(tmp_path):
+    index = AnswerIndex(str(tmp_path / "answers"), dim=config.ANSWER_INDEX_DIM,
+                        answer_threshold=config.ANSWER_INDEX_THRESHOLD)
+    index.open()
+    yield index
+    index.close()
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("asked, stored", PAIRS)
+async def test_other_model_or_price_is_not_answered(index, asked, stored):
+    # По близости вопросы неразличимы - ответ отсекает только сравнение моделей и чисел
+    vectors = embed([asked, stored], index.dim)
+    assert float(vectors[0] @ vectors[1]) >= index.answer_threshold
+    
+    # Пустой каталог: у всех первых вопросов один и тот же контекст
+    index.add(stored, "ответ на другой вопрос", 1)
+    answer, neighbours = await index.match(asked, 1)
+    
+    assert answer is None
+    assert [entry["q"] for entry in neighbours] == [stored]
+
+@pytest.mark.asyncio
+async def test_same_question_is_answered(index):
+    index.add("Есть ли в наличии iPhone 15?", "Да, iPhone 15 есть", 1)
+    
+    answer, _ = await index.match("есть ли в наличии IPHONE 15", 1)
+    assert answer == "Да, iPhone 15 есть"
+    # Ответ с другим контекстом (товары и цены в промпте) не переиспользуется
+    answer, _ = await index.match("есть ли в наличии IPHONE 15", 2)
+    assert answer is None
@@ -0,0 +1,42 @@
+"""Индекс каталога в памяти после заказа"""
+
+import asyncio
+
+import pytest
+
+from app.services import catalog as catalog_module
+from app.services.catalog import Catalog
+
+PRODUCTS = [
+    {"sku": "A1", "name": "Смартфон Alpha", "category": "Смартфоны", "brand": "Alpha", "price": 1000.0, "stock": 2},
+    {"sku": "B2", "name": "Смартфон Beta", "category": "Смартфоны", "brand": "Beta", "price": 2000.0, "stock": 1},
+]
+
+@pytest.mark.asyncio
+async def test_order_updates_stock(monkeypatch):
+    stock = {product["sku"]: product["stock"] for product in PRODUCTS}
+    
+    async def run_query(func, *args):
+        if func.__name__ == "get_catalog_version":
+            return 1
+        return [dict(product, stock=stock[product["sku"]]) for product in PRODUCTS]
+    
+    monkeypatch.setattr(catalog_module, "run_query", run_query)
+    catalog = Catalog(reload_interval=0)
+    await catalog.load()
+    
+    # Товар остался в наличии - остаток обновляется на месте, без перестроения
+    stock["A1"] = 1
+    index = catalog.index
+    catalog.update_stock({"A1": 1})
+    assert catalog.index is index
+    assert catalog.index.get("A1")["stock"] == 1
+    
+    # Товар закончился - индекс перестраивается, поиск по наличию его больше не находит
+    stock["B2"] = 0
+    catalog.update_stock({"B2": 0})
+    assert catalog.index.get("B2")["stock"] == 0
+    await asyncio.wait_for(catalog._reload, 1)
+    assert catalog.index is not index
+    assert [product["sku"] for product in catalog.search("смартфон", in_stock=True)] == ["A1"]
+    await catalog.stop()
@@ -0,0 +1,35 @@
+import pytest
+
+from app.database.catalog_import import CatalogImporter
+from app.database.models import Database
+
+@pytest.fixture
+def database(tmp_path):
+    database = Database(str(tmp_path / "shop_bot.db"))
+    database.open()
+    yield database
+    database.close()
+
+def write_csv(path, rows: list) -> str:
+    path.write_text("\n".join(["sku,name,price,stock"] + rows) + "\n", encoding="utf-8")
+    return str(path)
+
+def skus(database) -> dict:
+    with database.connection() as conn:
+        return {row[0]: row[1] for row in conn.execute("SELECT sku, stock FROM products ORDER BY sku")}
+
+@pytest.mark.parametrize("missing, expected", [
+    ("delete", {"A1": 3, "B2": 5}),
+    ("zero", {"A1": 3, "B2": 5, "C3": 0}),
+])
+def test_malformed_row_is_not_missing(database, tmp_path, missing, expected):
+    importer = CatalogImporter(database)
+    importer.run(write_csv(tmp_path / "full.csv", ["A1,Смартфон,100,1", "B2,Ноутбук,200,5", "C3,Планшет,300,7"]))
+    
+    # Цена B2 не разбирается, C3 в файле нет
+    stats = importer.run(write_csv(tmp_path / "update.csv", ["A1,Смартфон,100,3", "B2,Ноутбук,двести,6"]),
+                         missing=missing)
+    
+    assert (stats["skipped"], stats["missing"]) == (1, 1)
+    # B2 остается с прежними данными, отсутствует только C3
+    assert skus(database) == expected
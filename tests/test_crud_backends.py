@@ -0,0 +1,146 @@
+"""Функции CRUD из crud.py и их двойники из postgres.py на одних и тех же сценариях.
+
+PostgreSQL проверяется, если DATABASE_URL указывает на него:
+DATABASE_URL=postgresql://postgres@localhost/shop_bot python -m pytest tests/test_crud_backends.py
+"""
+
+import asyncio
+import os
+import random
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import pytest_asyncio
+
+from app.database import crud, postgres
+from app.database.crud import (ChatHistoryCRUD, OrderCRUD, OutOfStockError, ProductCRUD, UserCRUD,
+                               message_timestamp)
+from app.database.models import Database, is_postgres_url
+from app.database.postgres import PostgresDatabase
+
+DATABASE_URL = os.environ.get("DATABASE_URL", "")
+
+BACKENDS = [
+    "sqlite",
+    pytest.param("postgres", marks=pytest.mark.skipif(
+        not is_postgres_url(DATABASE_URL), reason="DATABASE_URL не указывает на PostgreSQL"
+    )),
+]
+
+@pytest_asyncio.fixture(params=BACKENDS)
+async def call(request, tmp_path, monkeypatch):
+    """Вызов функции CRUD на проверяемой БД: SQLite - напрямую, PostgreSQL - через двойник"""
+    if request.param == "sqlite":
+        database = Database(str(tmp_path / "shop_bot.db"))
+        monkeypatch.setattr(crud, "db", database)
+        
+        async def call(func, *args):
+            return func(*args)
+        
+        yield call
+        database.close()
+        return
+    
+    database = PostgresDatabase(DATABASE_URL, min_size=1, max_size=2)
+    monkeypatch.setattr(postgres, "pg_db", database)
+    
+    async def call(func, *args):
+        return await PostgresDatabase.twin(func)(*args)
+    
+    yield call
+    await database.close()
+
+def new_user_id() -> int:
+    # БД PostgreSQL может быть общей с ботом - берем id, которых у живых пользователей нет
+    return random.randint(10**12, 10**13)
+
+@pytest.mark.asyncio
+async def test_users(call):
+    user_id = new_user_id()
+    
+    user = await call(UserCRUD.get_or_create_user, user_id, "first", "Иван", None)
+    assert (user["id"], user["username"], user["orders_count"]) == (user_id, "first", 0)
+    
+    # Существующий пользователь не перезаписывается
+    user = await call(UserCRUD.get_or_create_user, user_id, "second", "Петр", None)
+    assert (user["username"], user["first_name"]) == ("first", "Иван")
+    
+    await call(UserCRUD.upsert_users, [(user_id, "renamed", "Иван", "Иванов")])
+    await call(UserCRUD.increment_orders_count, user_id)
+    user = await call(UserCRUD.get_or_create_user, user_id)
+    assert (user["username"], user["last_name"], user["orders_count"]) == ("renamed", "Иванов", 1)
+    
+    assert await call(UserCRUD.get_user_ids_after, user_id - 1, 1) == [user_id]
+
+@pytest.mark.asyncio
+async def test_chat_history(call):
+    user_id = new_user_id()
+    # Пакет отложенной записи - время строкой в UTC, как в WriteBehindQueue
+    timestamp = (datetime.now(timezone.utc) - timedelta(minutes=1)).strftime("%Y-%m-%d %H:%M:%S")
+    
+    await call(ChatHistoryCRUD.add_messages, [
+        (user_id, "user", "есть ли доставка?", timestamp),
+        (user_id, "assistant", "Да, 1-3 дня", timestamp),
+    ])
+    await call(ChatHistoryCRUD.add_message, user_id, "user", "а самовывоз?")
+    
+    # От новых к старым; при равном времени - по id
+    history = await call(ChatHistoryCRUD.get_recent_history, user_id, 2)
+    assert [(row["role"], row["message"]) for row in history] == [
+        ("user", "а самовывоз?"),
+        ("assistant", "Да, 1-3 дня"),
+    ]
+    
+    rows = [
+        row for row in await call(ChatHistoryCRUD.get_messages_after, 0, 1000000)
+        if row["user_id"] == user_id
+    ]
+    assert [row["message"] for row in rows] == ["есть ли доставка?", "Да, 1-3 дня", "а самовывоз?"]
+    assert rows == sorted(rows, key=lambda row: row["id"])
+    
+    # Метка, переданная при записи, возвращается без изменений - по ней сводка находит сообщение
+    stamp = message_timestamp()
+    await call(ChatHistoryCRUD.add_message, user_id, "user", "да", stamp)
+    history = await call(ChatHistoryCRUD.get_recent_history, user_id, 1)
+    assert history == [{"role": "user", "message": "да", "timestamp": stamp}]
+
+@pytest.mark.asyncio
+async def test_place_order_reserves_stock(call):
+    user_id = new_user_id()
+    sku = f"TEST-{uuid.uuid4().hex[:12]}"
+    await call(ProductCRUD.upsert_products, [{
+        "sku": sku, "name": "Смартфон Тест", "category": "Смартфоны", "brand": "Test",
+        "price": 1000.0, "description": None, "stock": 3,
+    }])
+    
+    version = await call(ProductCRUD.get_catalog_version)
+    order = await call(OrderCRUD.place_order, user_id, [(sku, 2)])
+    assert order["total_amount"] == 2000.0
+    assert order["products"] == [{"sku": sku, "name": "Смартфон Тест", "price": 1000.0, "quantity": 2}]
+    assert order["stock"] == {sku: 1}
+    assert (await call(ProductCRUD.get_product, sku))["stock"] == 1
+    
+    with pytest.raises(OutOfStockError) as error:
+        await call(OrderCRUD.place_order, user_id, [(sku, 2)])
+    assert error.value.available == 1
+    
+    # Отказ не списывает остаток и не засчитывает заказ
+    assert (await call(ProductCRUD.get_product, sku))["stock"] == 1
+    user = await call(UserCRUD.get_or_create_user, user_id)
+    assert user["orders_count"] == 1
+    # Товар в наличии - индексы каталога не перестраиваются
+    assert await call(ProductCRUD.get_catalog_version) == version
+    
+    # Товар закончился - индексы в памяти перестанут показывать его в наличии
+    order = await call(OrderCRUD.place_order, user_id, [(sku, 1)])
+    assert order["stock"] == {sku: 0}
+    assert await call(ProductCRUD.get_catalog_version) > version
+
+@pytest.mark.asyncio
+async def test_concurrent_get_or_create_user(call):
+    # Проигравшая гонку вставка возвращает пользователя, созданного параллельно
+    for _ in range(20):
+        user_id = new_user_id()
+        users = await asyncio.gather(*(call(UserCRUD.get_or_create_user, user_id, "buyer") for _ in range(2)))
+        assert [user["id"] for user in users] == [user_id, user_id]
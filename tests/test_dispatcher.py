@@ -0,0 +1,10 @@
+from app.main import create_dispatcher
+
+def test_dispatchers_get_own_routers():
+    # Роутер подключается только к одному диспетчеру: второй диспетчер получает новые
+    first = create_dispatcher()
+    second = create_dispatcher()
+    
+    names = [router.name for router in second.sub_routers]
+    assert names == ["main", "broadcast", "orders", "fallback"]
+    assert not set(map(id, first.sub_routers)) & set(map(id, second.sub_routers))
@@ -0,0 +1,155 @@
+"""Маршрутизация запросов к LLM на локальных заменах Yandex GPT API и Ollama"""
+
+import asyncio
+import json
+
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from app.services.llm_provider import LLMProviderError
+from app.services.llm_router import LLMRouter
+from app.services.ollama_service import OllamaService
+from app.services.yandex_gpt_service import YandexGPTService
+
+class FakeYandexGPT:
+    """Yandex GPT API (/completion): ответ целиком или накопленный текст построчно.
+    
+    status - код ответа, delay - задержка перед ответом, break_after - после скольких
+    фрагментов потока оборвать соединение.
+    """
+    
+    def __init__(self, text: str, status: int = 200, delay: float = 0, break_after: int = None):
+        self.text = text
+        self.status = status
+        self.delay = delay
+        self.break_after = break_after
+        self.requests = 0
+    
+    async def handle(self, request: web.Request) -> web.StreamResponse:
+        self.requests += 1
+        payload = await request.json()
+        await asyncio.sleep(self.delay)
+        if self.status != 200:
+            return web.Response(status=self.status, text="fake error")
+        
+        if not payload["completionOptions"]["stream"]:
+            return web.json_response({"result": {"alternatives": [{"message": {"text": self.text}}]}})
+        
+        response = web.StreamResponse()
+        await response.prepare(request)
+        words = self.text.split()
+        for i in range(1, len(words) + 1):
+            if i - 1 == self.break_after:
+                # Обрыв посреди ответа: незавершенный chunked-поток
+                request.transport.close()
+                return response
+            line = json.dumps({"result": {"alternatives": [{"message": {"text": " ".join(words[:i])}}]}},
+                              ensure_ascii=False)
+            await response.write(line.encode() + b"\n")
+        await response.write_eof()
+        return response
+
+class FakeOllama:
+    """Ollama (/api/chat): ответ целиком или приращения текста, последняя строка - done"""
+    
+    def __init__(self, text: str):
+        self.text = text
+        self.requests = 0
+    
+    async def handle(self, request: web.Request) -> web.StreamResponse:
+        self.requests += 1
+        payload = await request.json()
+        if not payload["stream"]:
+            return web.json_response({"message": {"role": "assistant", "content": self.text}, "done": True})
+        
+        response = web.StreamResponse()
+        await response.prepare(request)
+        for word in self.text.split(" "):
+            line = json.dumps({"message": {"role": "assistant", "content": word + " "}, "done": False},
+                              ensure_ascii=False)
+            await response.write(line.encode() + b"\n")
+        await response.write(json.dumps({"done": True}).encode() + b"\n")
+        await response.write_eof()
+        return response
+
+@pytest_asyncio.fixture
+async def serve():
+    """serve(path, handler) -> адрес локального сервера; серверы останавливаются после теста"""
+    servers = []
+    
+    async def start(path: str, handler) -> str:
+        app = web.Application()
+        app.router.add_post(path, handler)
+        server = TestServer(app)
+        await server.start_server()
+        servers.append(server)
+        return str(server.make_url(path))
+    
+    yield start
+    for server in servers:
+        await server.close()
+
+@pytest_asyncio.fixture
+async def providers():
+    yandex = YandexGPTService()
+    yandex.api_key = "test-key"
+    yandex.folder_id = "test-folder"
+    ollama = OllamaService()
+    ollama.model = "test-model"
+    yield yandex, ollama
+    await yandex.close()
+    await ollama.close()
+
+async def connect(serve, providers, fake_yandex: FakeYandexGPT, fake_ollama: FakeOllama):
+    yandex, ollama = providers
+    yandex.base_url = await serve("/completion", fake_yandex.handle)
+    ollama.base_url = (await serve("/api/chat", fake_ollama.handle)).rsplit("/api/chat", 1)[0]
+
+@pytest.mark.asyncio
+async def test_slow_primary_is_hedged(serve, providers):
+    fake_yandex = FakeYandexGPT("ответ Yandex GPT", delay=5)
+    fake_ollama = FakeOllama("ответ Ollama")
+    await connect(serve, providers, fake_yandex, fake_ollama)
+    router = LLMRouter(list(providers), hedge=True, hedge_delay=0.05)
+    
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    answer = await router.complete("Есть ли в наличии iPhone 15?", [])
+    
+    # Ответ страхующего запроса, не дожидаясь основного
+    assert answer == "ответ Ollama"
+    assert loop.time() - started < 2
+    assert (fake_yandex.requests, fake_ollama.requests) == (1, 1)
+
+@pytest.mark.asyncio
+async def test_primary_error_fails_over(serve, providers):
+    fake_yandex = FakeYandexGPT("ответ Yandex GPT", status=503)
+    fake_ollama = FakeOllama("ответ Ollama")
+    await connect(serve, providers, fake_yandex, fake_ollama)
+    router = LLMRouter(list(providers))
+    
+    assert await router.complete("Есть ли в наличии iPhone 15?", []) == "ответ Ollama"
+    # Пока есть куда переключиться, основной провайдер не повторяется
+    assert fake_yandex.requests == 1
+    
+    texts = [text async for text in router.stream("Есть ли в наличии iPhone 15?", [])]
+    assert texts[-1].strip() == "ответ Ollama"
+    assert (fake_yandex.requests, fake_ollama.requests) == (2, 2)
+
+@pytest.mark.asyncio
+async def test_mid_stream_error_does_not_fail_over(serve, providers):
+    fake_yandex = FakeYandexGPT("iPhone 15 есть в наличии", break_after=2)
+    fake_ollama = FakeOllama("ответ Ollama")
+    await connect(serve, providers, fake_yandex, fake_ollama)
+    router = LLMRouter(list(providers))
+    
+    texts = []
+    with pytest.raises(LLMProviderError):
+        async for text in router.stream("Есть ли в наличии iPhone 15?", []):
+            texts.append(text)
+    
+    # Показанное начало ответа не продолжается другой моделью
+    assert texts == ["iPhone", "iPhone 15"]
+    assert (fake_yandex.requests, fake_ollama.requests) == (1, 0)
@@ -0,0 +1,41 @@
+import json
+
+import pytest
+
+from app.services.prompt_builder import PromptBuilder, _fingerprint
+from app.services.storage import MemoryStorage
+
+def message(role: str, text: str, second: int) -> dict:
+    return {"role": role, "message": text, "timestamp": f"2026-10-18 12:00:{second:02d}.000000"}
+
+@pytest.mark.asyncio
+async def test_summary_tells_repeated_replies_apart():
+    storage = MemoryStorage()
+    builder = PromptBuilder(max_messages=2, summary_batch=2, summary_storage=storage)
+    # От новых к старым, как из get_recent_history; "да" повторяется в разговоре
+    history = [
+        message("user", "спасибо", 7),
+        message("assistant", "Заказ оформлен", 6),
+        message("user", "оформляйте", 5),
+        message("user", "да", 4),
+        message("assistant", "Нужен чехол?", 3),
+        message("user", "да", 2),
+        message("assistant", "Подобрать iPhone 15?", 1),
+    ]
+    # В сводку свернуто все до первого "да" включительно
+    await storage.set("summary:1", json.dumps({"text": "ищет iPhone 15", "last": _fingerprint(history[5])}))
+    
+    calls = []
+    
+    async def summarize(summary, messages):
+        calls.append((summary, [msg["message"] for msg in messages]))
+        return "ищет iPhone 15 и чехол"
+    
+    _, selected = await builder.build(1, "спасибо", history, "prompt", summarize=summarize)
+    await builder.close()
+    
+    assert [msg["message"] for msg in selected] == ["оформляйте", "Заказ оформлен"]
+    # Второе "да" не принято за уже свернутое первое
+    assert calls == [("ищет iPhone 15", ["Нужен чехол?", "да"])]
+    summary = json.loads(await storage.get("summary:1"))
+    assert summary == {"text": "ищет iPhone 15 и чехол", "last": _fingerprint(history[3])}
@@ -0,0 +1,26 @@
+from app.services.llm_service import LLMService
+
+QUESTION = "Какой смартфон посоветуете?"
+
+def history(*messages) -> list:
+    return [{"role": role, "message": text} for role, text in messages]
+
+def test_first_question_key_is_shared():
+    service = LLMService()
+    
+    key = service._cache_key(QUESTION, [], "prompt", "prompt")
+    assert key == service._cache_key(QUESTION + "!", [], "prompt", "prompt")
+    # Сводка прошлого разговора в промпте - ответ уже не общий
+    assert key != service._cache_key(QUESTION, [], "prompt\n\nсводка", "prompt")
+
+def test_mid_dialogue_key_includes_history_and_summary():
+    service = LLMService()
+    budget = history(("user", "ищу телефон до 20000"), ("assistant", "Есть Xiaomi Redmi 13"))
+    premium = history(("user", "ищу флагман"), ("assistant", "Есть iPhone 15 Pro"))
+    
+    key = service._cache_key(QUESTION, budget, "prompt", "prompt")
+    assert key == service._cache_key(QUESTION, list(budget), "prompt", "prompt")
+    # Тот же вопрос после другого разговора или с другой сводкой - другой ответ
+    assert key != service._cache_key(QUESTION, premium, "prompt", "prompt")
+    assert key != service._cache_key(QUESTION, budget, "prompt\n\nсводка", "prompt")
+    assert key != service._cache_key(QUESTION, [], "prompt", "prompt")
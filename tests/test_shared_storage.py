@@ -0,0 +1,97 @@
+import random
+from types import SimpleNamespace
+
+import fakeredis
+import pytest
+
+from app.database import async_crud
+from app.database.async_crud import AsyncChatHistoryCRUD
+from app.database.crud import ChatHistoryCRUD
+from app.database.executor import run_query
+from app.database.history_cache import SharedHistoryCache
+from app.database.write_behind import write_behind
+from app.services import outbound
+from app.services.outbound import SharedRateLimit
+from app.services.storage import RedisStorage
+from app.services.throttling import Throttler
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+def replica(server) -> RedisStorage:
+    """Хранилище отдельной реплики бота: свой клиент, общий сервер Redis"""
+    return RedisStorage(fakeredis.FakeAsyncRedis(server=server, decode_responses=True), prefix="test")
+
+@pytest.mark.asyncio
+async def test_list_push_trims_and_respects_only_existing(server):
+    storage = replica(server)
+    
+    await storage.list_push("items", ["a"], maxlen=3, only_existing=True)
+    assert await storage.list_range("items") == []
+    
+    await storage.list_push("items", ["a", "b", "c", "d"], maxlen=3, ttl=60)
+    assert await storage.list_range("items") == ["b", "c", "d"]
+    assert 0 < await storage.redis.pttl("test:items") <= 60000
+
+@pytest.mark.asyncio
+async def test_incr_keeps_first_ttl(server):
+    storage = replica(server)
+    
+    assert await storage.incr("counter", ttl=60) == 1
+    assert await storage.incr("counter", ttl=600) == 2
+    assert await storage.redis.pttl("test:counter") <= 60000
+
+@pytest.mark.asyncio
+async def test_history_window_is_shared_between_replicas(server):
+    first = SharedHistoryCache(replica(server), window=3)
+    second = SharedHistoryCache(replica(server), window=3)
+    
+    # Без загруженного окна добавление его не создает - иначе окно было бы неполным
+    await first.append(1, "user", "привет")
+    assert await second.get(1, 3) is None
+    
+    await first.warm(1, [{"role": "assistant", "message": "ответ"}, {"role": "user", "message": "вопрос"}])
+    for i in range(3):
+        await second.append(1, "user", f"сообщение {i}")
+    
+    assert [msg["message"] for msg in await first.get(1, 3)] == ["сообщение 2", "сообщение 1", "сообщение 0"]
+    assert await first.get(1, 4) is None
+
+@pytest.mark.asyncio
+async def test_shared_window_bypasses_write_behind(server, monkeypatch):
+    monkeypatch.setattr(async_crud.config, "WRITE_BEHIND_ENABLED", True)
+    monkeypatch.setattr(async_crud, "history_cache", SharedHistoryCache(replica(server), window=10))
+    
+    user_id = random.randint(10**12, 10**13)
+    await AsyncChatHistoryCRUD.add_message(user_id, "user", "есть ли доставка?")
+    
+    # Сообщение сразу в БД: другая реплика, загружая окно, его увидит
+    assert write_behind.pending_messages(user_id) == []
+    rows = await run_query(ChatHistoryCRUD.get_recent_history, user_id, 10)
+    assert [row["message"] for row in rows] == ["есть ли доставка?"]
+    
+    await AsyncChatHistoryCRUD.get_recent_history(user_id, 10)
+    other = SharedHistoryCache(replica(server), window=10)
+    assert await other.get(user_id, 10) == rows
+
+@pytest.mark.asyncio
+async def test_throttle_limits_are_shared_between_replicas(server, monkeypatch):
+    # Все события - в одном окне счетчика
+    monkeypatch.setattr(outbound, "time", SimpleNamespace(time=lambda: 1000.0))
+    first = Throttler(user_rate=0.5, user_burst=2, shared_storage=replica(server))
+    second = Throttler(user_rate=0.5, user_burst=2, shared_storage=replica(server))
+    
+    # Окно 4 с: полная корзина (2) и пополнение за окно (2)
+    for throttler in (first, second, first, second):
+        assert await throttler.reserve_shared(1, None) is None
+    assert await second.reserve_shared(1, None) == "user"
+    assert await first.reserve_shared(2, None) is None
+
+@pytest.mark.asyncio
+async def test_shared_rate_limit_waits_for_next_window(server, monkeypatch):
+    monkeypatch.setattr(outbound, "time", SimpleNamespace(time=lambda: 1000.25))
+    limit = SharedRateLimit(replica(server), "outbound", rate=2, burst=1)
+    
+    assert [await limit.hit() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert await SharedRateLimit(replica(server), "outbound", rate=2, burst=1).hit() == 0.75
@@ -0,0 +1,53 @@
+"""Прием апдейтов Telegram webhook-сервером: секретный токен и адрес"""
+
+import asyncio
+
+import pytest
+from aiogram import Dispatcher
+from aiohttp.test_utils import TestClient, TestServer
+
+from app.config import config
+from app.main import create_bot, create_webhook_app
+
+UPDATE = {
+    "update_id": 1,
+    "edited_message": {
+        "message_id": 1,
+        "date": 0,
+        "chat": {"id": 123, "type": "private"},
+        "from": {"id": 123, "is_bot": False, "first_name": "Test"},
+        "text": "Привет",
+    },
+}
+
+@pytest.mark.asyncio
+async def test_webhook_checks_secret_token(monkeypatch):
+    monkeypatch.setattr(config, "WEBHOOK_SECRET", "test-secret")
+    monkeypatch.setattr(config, "WEBHOOK_PATH", "/telegram/webhook")
+    
+    # Диспетчер без хуков запуска бота: проверяется только доставка апдейта
+    received = asyncio.Queue()
+    dp = Dispatcher()
+    dp.edited_message.register(received.put)
+    
+    async with TestClient(TestServer(create_webhook_app(dp, create_bot()))) as client:
+        response = await client.post("/telegram/webhook", json=UPDATE)
+        assert response.status == 401
+        response = await client.post(
+            "/telegram/webhook", json=UPDATE, headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"}
+        )
+        assert response.status == 401
+        
+        response = await client.post(
+            "/webhook", json=UPDATE, headers={"X-Telegram-Bot-Api-Secret-Token": "test-secret"}
+        )
+        assert response.status == 404
+        
+        response = await client.post(
+            "/telegram/webhook", json=UPDATE, headers={"X-Telegram-Bot-Api-Secret-Token": "test-secret"}
+        )
+        assert response.status == 200
+        message = await asyncio.wait_for(received.get(), 1)
+        assert message.text == "Привет"
+        # Отклоненные запросы до обработчиков не доходят
+        assert received.empty()
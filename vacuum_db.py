@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Обслуживание БД SQLite: перевод на инкрементальную очистку освобожденных страниц
+
+Новая БД создается сразу с PRAGMA auto_vacuum=INCREMENTAL; существующую переводит
+этот скрипт полным VACUUM. Он перезаписывает весь файл (нужно свободное место
+размером с БД) и блокирует запись до окончания - запускайте при остановленном боте.
+Дальше место возвращает фоновая очистка истории (HISTORY_VACUUM_PAGES).
+
+Пример: python vacuum_db.py
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+from dotenv import load_dotenv
+
+# Добавляем путь к проекту
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+load_dotenv()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO)
+    
+    from app.database.models import db
+    
+    if db is None:
+        # В PostgreSQL место освобождает autovacuum
+        sys.exit("❌ Обслуживание нужно только для SQLite (DATABASE_URL - путь к файлу)")
+    
+    size = os.path.getsize(db.db_path) if os.path.exists(db.db_path) else 0
+    started = time.perf_counter()
+    try:
+        converted = db.enable_incremental_vacuum()
+    finally:
+        db.close()
+    
+    if not converted:
+        print("✅ Инкрементальная очистка уже включена")
+        return
+    print(f"✅ БД переведена на инкрементальную очистку: {size / 2**20:.1f} -> "
+          f"{os.path.getsize(db.db_path) / 2**20:.1f} МБ")
+    print(f"⏱️  {time.perf_counter() - started:.2f} с")
+
+if __name__ == "__main__":
+    main()